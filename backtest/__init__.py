@@ -0,0 +1,9 @@
+"""
+Replay recorded sessions through StraddleStrategy against a simulated broker
+"""
+
+from replay import ReplayEngine, run_backtest
+from broker import SimulatedBroker
+from sweep import run_sweep
+
+__all__ = ["ReplayEngine", "SimulatedBroker", "run_backtest", "run_sweep"]
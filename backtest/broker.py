@@ -0,0 +1,130 @@
+import itertools
+from datetime import datetime
+from queue import Queue
+from typing import Callable, Dict, List, Optional
+
+from kiteconnect import KiteConnect
+
+
+class SimulatedBroker:
+    # Stands in for KiteConnect during replays. Orders rest in memory and are filled against replayed
+    # prices: MARKET at the current price, LIMIT once the price reaches the limit, SL/SL-M once the
+    # trigger is crossed. Every order change is pushed to `updates` in the format OrderBook consumes.
+    def __init__(self, clock: Callable[[], datetime]):
+        self.clock = clock
+        self.updates = Queue()
+        self.updates.put(("stream", True))
+        self.last_prices = {}  # type: Dict[str, float]
+        self.positions = {}  # type: Dict[str, int]
+        self.cash = 0.0
+        self._orders = {}  # type: Dict[str, Dict]
+        self._open_orders = {}  # type: Dict[str, Dict[str, Dict]]
+        self._order_ids = itertools.count(1)
+
+    def _publish(self, order: Dict):
+        self.updates.put(("order", dict(order)))
+
+    def _fill(self, order: Dict, price: float):
+        quantity = order["quantity"] if self._is_buy(order) else -order["quantity"]
+        symbol = order["tradingsymbol"]
+        self.positions[symbol] = self.positions.get(symbol, 0) + quantity
+        self.cash -= quantity * price
+        order.update(status="COMPLETE", average_price=price, filled_quantity=order["quantity"], pending_quantity=0)
+        order["exchange_update_timestamp"] = self.clock()
+        self._open_orders.get(symbol, {}).pop(order["order_id"], None)
+        self._publish(order)
+
+    def _is_buy(self, order: Dict) -> bool:
+        return order["transaction_type"] == KiteConnect.TRANSACTION_TYPE_BUY
+
+    def _match(self, order: Dict, price: float):
+        order_type = order["order_type"]
+        if order_type in (KiteConnect.ORDER_TYPE_SL, KiteConnect.ORDER_TYPE_SLM) and not order.get("triggered"):
+            triggered = price >= order["trigger_price"] if self._is_buy(order) else price <= order["trigger_price"]
+            if not triggered:
+                return
+            order["triggered"] = True
+        if order_type in (KiteConnect.ORDER_TYPE_MARKET, KiteConnect.ORDER_TYPE_SLM):
+            self._fill(order, price)
+        elif self._is_buy(order) and price <= order["price"]:
+            self._fill(order, price)
+        elif not self._is_buy(order) and price >= order["price"]:
+            self._fill(order, price)
+
+    def on_tick(self, symbol: str, price: float):
+        self.last_prices[symbol] = price
+        open_orders = self._open_orders.get(symbol)
+        if open_orders:
+            for order in list(open_orders.values()):
+                self._match(order, price)
+
+    def place_order(
+        self,
+        variety,
+        tradingsymbol,
+        exchange,
+        transaction_type,
+        quantity,
+        product,
+        order_type,
+        price=None,
+        trigger_price=None,
+        disclosed_quantity=None,
+        validity=None,
+        **kwargs,
+    ) -> str:
+        order_id = str(next(self._order_ids))
+        order = {
+            "order_id": order_id,
+            "variety": variety,
+            "tradingsymbol": tradingsymbol,
+            "exchange": exchange,
+            "transaction_type": transaction_type,
+            "order_type": order_type,
+            "price": price,
+            "trigger_price": trigger_price,
+            "quantity": quantity,
+            "product": product,
+            "validity": validity,
+            "status": "TRIGGER PENDING" if trigger_price else "OPEN",
+            "order_timestamp": self.clock(),
+        }
+        self._orders[order_id] = order
+        self._open_orders.setdefault(tradingsymbol, {})[order_id] = order
+        self._publish(order)
+        if tradingsymbol in self.last_prices:
+            self._match(order, self.last_prices[tradingsymbol])
+        return order_id
+
+    def modify_order(self, variety, order_id, price=None, trigger_price=None, order_type=None, **kwargs) -> str:
+        order = self._orders[str(order_id)]
+        if order["status"] not in ("OPEN", "TRIGGER PENDING"):
+            raise ValueError(f"Order {order_id} is {order['status']} and cannot be modified")
+        if price is not None:
+            order["price"] = price
+        if trigger_price is not None:
+            order["trigger_price"] = trigger_price
+        if order_type is not None:
+            order["order_type"] = order_type
+        self._publish(order)
+        if order["tradingsymbol"] in self.last_prices:
+            self._match(order, self.last_prices[order["tradingsymbol"]])
+        return order["order_id"]
+
+    def cancel_order(self, variety, order_id, **kwargs) -> str:
+        order = self._orders[str(order_id)]
+        if order["status"] in ("OPEN", "TRIGGER PENDING"):
+            order["status"] = "CANCELLED"
+            self._open_orders[order["tradingsymbol"]].pop(order["order_id"], None)
+            self._publish(order)
+        return order["order_id"]
+
+    def order_history(self, order_id) -> List[Dict]:
+        return [dict(self._orders[str(order_id)])]
+
+    def orders(self) -> List[Dict]:
+        return [dict(order) for order in self._orders.values()]
+
+    def mark_to_market(self, prices: Optional[Dict[str, float]] = None) -> float:
+        prices = prices or self.last_prices
+        return self.cash + sum(quantity * prices.get(symbol, 0.0) for symbol, quantity in self.positions.items())
@@ -0,0 +1,153 @@
+from datetime import date, datetime, time
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+from broker import SimulatedBroker
+from greeks import ChainAnalytics
+from instrument_file import option_data_from_tick
+from order_book import OrderBook
+from strategy import StraddleStrategy
+from tick_recorder import TickReader
+
+from constants import ENTRY_TIME, EXIT_TIME
+
+# Rows converted to Python objects at a time while replaying
+CHUNK_SIZE = 65536
+
+
+class SessionContracts:
+    # Contract lookups for a recorded session, shaped like ContractIndex so ChainIndex can use it
+    def __init__(self, contracts: Dict[int, Dict]):
+        self._by_symbol = {detail["symbol"]: detail for detail in contracts.values()}
+
+    def by_tradingsymbol(self, tradingsymbol: str) -> Optional[Dict]:
+        return self._by_symbol.get(tradingsymbol)
+
+
+class ReplayEngine:
+    # Feeds recorded ticks through the same tick -> option data -> chain snapshot path as the live
+    # feed, driven by a simulated clock. Snapshots are emitted every `snapshot_interval` simulated
+    # seconds and the simulated broker sees every tick, so SL and limit orders fill between snapshots.
+    # Greeks are attached to the snapshots like in the live feed when the expiry of the chain is given.
+    def __init__(self, reader: TickReader, snapshot_interval: float = 1.0, expiry: Union[date, str, None] = None):
+        self.reader = reader
+        self.contracts = reader.contracts
+        self.token_list = list(self.contracts)
+        self.snapshot_interval_ms = int(snapshot_interval * 1000)
+        self.now_ms = int(reader["exchange_timestamp"][0]) if len(reader) else 0
+        self.broker = SimulatedBroker(self.now)
+        self.equity = []  # type: List[float]
+        # Called with (symbol, last price) of every tick after the broker saw it, e.g. synthetic stops
+        self.tick_taps = []  # type: List[Callable[[str, float], None]]
+        self.analytics = ChainAnalytics(self.contracts, expiry, clock=self.now) if expiry is not None else None
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.now_ms / 1000)
+
+    @property
+    def session_date(self) -> date:
+        return self.now().date()
+
+    def _snapshot(self, latest: Dict[int, Dict]) -> List[Dict]:
+        # Same order and skipping of contracts without ticks as InstrumentMaster.generate_optionChain
+        option_chain = [latest[token] for token in self.token_list if token in latest]
+        if self.analytics is not None:
+            self.analytics.attach(option_chain)
+        return option_chain
+
+    def stream(self) -> Iterator[List[Dict]]:
+        latest = {}  # type: Dict[int, Dict]
+        contracts = self.contracts
+        broker = self.broker
+        next_snapshot_ms = None
+        for start in range(0, len(self.reader), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            rows = zip(
+                self.reader["token"][start:end].tolist(),
+                self.reader["exchange_timestamp"][start:end].tolist(),
+                self.reader["last_price"][start:end].tolist(),
+                self.reader["volume"][start:end].tolist(),
+                self.reader["change"][start:end].tolist(),
+            )
+            for token, timestamp, last_price, volume, change in rows:
+                if next_snapshot_ms is None:
+                    next_snapshot_ms = timestamp + self.snapshot_interval_ms
+                while timestamp >= next_snapshot_ms:
+                    self.now_ms = next_snapshot_ms
+                    self.equity.append(broker.mark_to_market())
+                    yield self._snapshot(latest)
+                    next_snapshot_ms += self.snapshot_interval_ms
+                contract_detail = contracts.get(token)
+                if contract_detail is None:
+                    continue
+                # Ticks can be slightly out of order across tokens, the clock never moves backwards
+                self.now_ms = max(self.now_ms, timestamp)
+                tick = {
+                    "instrument_token": token,
+                    "last_price": last_price,
+                    "volume_traded": volume,
+                    "change": change,
+                }
+                latest[token] = option_data_from_tick(tick, contract_detail)
+                broker.on_tick(contract_detail["symbol"], last_price)
+                for tap in self.tick_taps:
+                    tap(contract_detail["symbol"], last_price)
+        if latest:
+            self.equity.append(broker.mark_to_market())
+            yield self._snapshot(latest)
+
+
+def max_drawdown(equity: List[float]) -> float:
+    peak = float("-inf")
+    drawdown = 0.0
+    for value in equity:
+        peak = max(peak, value)
+        drawdown = max(drawdown, peak - value)
+    return drawdown
+
+
+def run_backtest(
+    session_path: str,
+    instrument_symbol: str,
+    entry_time: time = ENTRY_TIME,
+    exit_time: time = EXIT_TIME,
+    n_lots: int = 1,
+    snapshot_interval: float = 1.0,
+    reader: Optional[TickReader] = None,
+    expiry: Union[date, str, None] = None,
+    **strategy_params,
+) -> Dict:
+    reader = reader or TickReader(session_path)
+    # Sessions recorded with their expiry replay with greeks attached
+    expiry = expiry or reader.meta.get("expiry")
+    engine = ReplayEngine(reader, snapshot_interval, expiry)
+    broker = engine.broker
+    underlying_symbol = next(detail["symbol"] for detail in engine.contracts.values() if detail["type"] == "EQ")
+    strategy = StraddleStrategy(
+        kite_instance=broker,
+        instrument_symbol=instrument_symbol,
+        expiry_date=None,
+        access_token=None,
+        stream=engine.stream(),
+        clock=engine.now,
+        order_book=OrderBook(broker, updates=broker.updates),
+        contract_index=SessionContracts(engine.contracts),
+        underlying_symbol=underlying_symbol,
+        order_cache=None,
+        **strategy_params,
+    )
+    if strategy.stop_engine is not None:
+        engine.tick_taps.append(strategy.stop_engine.on_tick)
+    session_date = engine.session_date
+    strategy.execute(
+        entry_time=datetime.combine(session_date, entry_time),
+        exit_time=datetime.combine(session_date, exit_time),
+        n_lots=n_lots,
+    )
+    pnl = broker.mark_to_market()
+    engine.equity.append(pnl)
+    return {
+        "session": str(session_date),
+        "pnl": pnl,
+        "max_drawdown": max_drawdown(engine.equity),
+        "orders": len(broker.orders()),
+    }
@@ -0,0 +1,143 @@
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from replay import max_drawdown, run_backtest
+from tick_recorder import TickReader
+
+# Grid keys understood by the sweep, strategy parameters plus the session window
+SWEEP_PARAMETERS = (
+    "stop_loss",
+    "stop_loss_trailing_trigger",
+    "target",
+    "add_targets",
+    "entry_delta",
+    "entry_time",
+    "exit_time",
+)
+
+# Per worker process: session descriptors and the readers attached to shared memory
+_sessions = []  # type: List[Dict]
+_readers = {}  # type: Dict[int, TickReader]
+_attached = []  # type: List[SharedMemory]
+
+
+def share_sessions(session_paths: Sequence[str]) -> Tuple[List[Dict], List[SharedMemory]]:
+    # Every column of every session is copied once into shared memory, workers attach to it by name
+    descriptors = []
+    blocks = []
+    for path in session_paths:
+        reader = TickReader(path)
+        columns = {}
+        for column, values in reader.columns.items():
+            block = SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            blocks.append(block)
+            columns[column] = (block.name, values.shape, values.dtype.str)
+        descriptors.append({"path": path, "meta": reader.meta, "columns": columns})
+    return descriptors, blocks
+
+
+def _init_worker(descriptors: List[Dict]):
+    global _sessions
+    _sessions = descriptors
+    # Strategies print every snapshot, keep sweep output to warnings
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _reader(session_idx: int) -> TickReader:
+    if session_idx not in _readers:
+        descriptor = _sessions[session_idx]
+        columns = {}
+        for column, (name, shape, dtype) in descriptor["columns"].items():
+            block = SharedMemory(name=name)
+            _attached.append(block)
+            columns[column] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        _readers[session_idx] = TickReader.from_columns(descriptor["path"], descriptor["meta"], columns)
+    return _readers[session_idx]
+
+
+def _run(task: Tuple[int, Dict], instrument_symbol: str, n_lots: int) -> Dict:
+    session_idx, params = task
+    reader = _reader(session_idx)
+    try:
+        result = run_backtest(reader.path, instrument_symbol, n_lots=n_lots, reader=reader, **params)
+    except Exception as e:
+        logging.exception(f"Backtest failed for {reader.path} with {params}")
+        result = {"session": reader.path, "pnl": None, "max_drawdown": None, "orders": None, "error": str(e)}
+    result.update(params)
+    return result
+
+
+def expand_grid(grid: Dict[str, Sequence]) -> List[Dict]:
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {sorted(unknown)}")
+    if "target" in grid and not any(grid.get("add_targets", ())):
+        # Targets are only placed with add_targets, every target value would give the same result
+        raise ValueError("Sweeping target needs add_targets=[True] in the grid")
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def summarize(runs: pd.DataFrame, keys: Sequence[str]) -> pd.DataFrame:
+    # One row per combination: total and average daily P&L, the worst intraday drawdown and the
+    # drawdown of the day by day cumulative P&L
+    summary = []
+    groups = runs.groupby(list(keys), sort=False, dropna=False) if keys else [((), runs)]
+    for values, group in groups:
+        values = values if isinstance(values, tuple) else (values,)
+        daily_pnl = group.sort_values("session")["pnl"].dropna()
+        summary.append(
+            dict(
+                zip(keys, values),
+                sessions=len(group),
+                failed=int(group["pnl"].isna().sum()),
+                total_pnl=daily_pnl.sum(),
+                mean_pnl=daily_pnl.mean(),
+                worst_intraday_drawdown=group["max_drawdown"].max(),
+                cumulative_drawdown=max_drawdown([0.0] + daily_pnl.cumsum().tolist()),
+            )
+        )
+    return pd.DataFrame(summary)
+
+
+def run_sweep(
+    session_paths: Sequence[str],
+    grid: Dict[str, Sequence],
+    instrument_symbol: str,
+    n_lots: int = 1,
+    processes: Optional[int] = None,
+    output: Optional[str] = "sweep_results.csv",
+    runs_output: Optional[str] = None,
+) -> pd.DataFrame:
+    combinations = expand_grid(grid)
+    descriptors, blocks = share_sessions(session_paths)
+    tasks = [(session_idx, params) for params in combinations for session_idx in range(len(descriptors))]
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(descriptors,)) as pool:
+            rows = list(
+                pool.map(
+                    _run,
+                    tasks,
+                    itertools.repeat(instrument_symbol),
+                    itertools.repeat(n_lots),
+                    chunksize=max(1, len(tasks) // (4 * (processes or 4))),
+                )
+            )
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    runs = pd.DataFrame(rows)
+    if runs_output:
+        runs.to_csv(runs_output, index=False)
+    results = summarize(runs, list(grid))
+    if output:
+        results.to_csv(output, index=False)
+    return results
@@ -0,0 +1,180 @@
+import json
+import random
+import struct
+import time
+from multiprocessing import Array, Process, Queue
+from queue import Empty
+from typing import Dict, List, Optional
+
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
+
+from fakes import SPOT, UNDERLYING_TOKEN
+from ticker_shards import fresh_reactor
+
+# Kite binary packet sizes by mode, indices have shorter quote and full packets
+PACKET_SIZE = {"ltp": 8, "quote": 44, "full": 184}
+INDEX_PACKET_SIZE = {"ltp": 8, "quote": 28, "full": 32}
+# Segment of index tokens, the low byte of the instrument token
+INDICES_SEGMENT = 9
+
+
+def pack_tick(token: int, mode: str, price: float, volume: int, timestamp: int) -> bytes:
+    # One tick in the Kite binary layout of the mode, prices in paise
+    paise = int(round(price * 100))
+    if token & 0xFF == INDICES_SEGMENT:
+        size = INDEX_PACKET_SIZE[mode]
+        # last, high, low, open, close, change
+        packet = struct.pack(">IIIIIII", token, paise, paise, paise, paise, paise, 0)
+    else:
+        size = PACKET_SIZE[mode]
+        # last, last quantity, average, volume, buy quantity, sell quantity, open, high, low, close
+        packet = struct.pack(">IIIIIIIIIII", token, paise, 25, paise, volume, 0, 0, paise, paise, paise, paise)
+        if mode == "full":
+            # last trade time, oi, oi day high, oi day low, exchange timestamp, then an empty depth
+            packet += struct.pack(">IIIII", timestamp, 0, 0, 0, timestamp)
+    packet = (packet + bytes(size))[:size]
+    return struct.pack(">H", size) + packet
+
+
+class FakeTickerProtocol(WebSocketServerProtocol):
+    # One ticker connection: keeps the subscribed tokens and their modes, and pushes a batch of ticks
+    # of every subscribed token each `interval` seconds, like the Kite ticker does
+    def onOpen(self):
+        self.modes = {}  # type: Dict[int, str]
+        self.volumes = {}  # type: Dict[int, int]
+        self.factory.connections += 1
+        self.connection = self.factory.connections
+        self.factory.clients.add(self)
+        self.random = random.Random(self.factory.seed + self.connection)
+        self.factory.stats[0] += 1
+        self.push = self.factory.reactor.callLater(self.factory.interval, self.send_ticks)
+
+    def onMessage(self, payload, isBinary):
+        message = json.loads(payload.decode("utf-8"))
+        action, value = message.get("a"), message.get("v")
+        if action == "subscribe":
+            for token in value:
+                self.modes.setdefault(token, "quote")
+                self.volumes.setdefault(token, 0)
+        elif action == "unsubscribe":
+            for token in value:
+                self.modes.pop(token, None)
+        elif action == "mode":
+            mode, tokens = value
+            for token in tokens:
+                if token in self.modes:
+                    self.modes[token] = mode
+        self.factory.subscriptions.put((self.connection, action, value))
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.clients.discard(self)
+        if getattr(self, "push", None) is not None and self.push.active():
+            self.push.cancel()
+
+    def send_ticks(self):
+        if self.modes:
+            prices = self.factory.prices
+            timestamp = int(time.time())
+            packets = []
+            for token, mode in self.modes.items():
+                if token not in prices:
+                    prices[token] = SPOT if token == UNDERLYING_TOKEN else self.random.uniform(5.0, 800.0)
+                prices[token] = max(0.05, prices[token] * (1 + self.random.gauss(0, 0.001)))
+                self.volumes[token] += self.random.randint(1, 50) * 25
+                packets.append(pack_tick(token, mode, prices[token], self.volumes[token], timestamp))
+            # A message holds at most 65535 packets, Kite sends far fewer per frame
+            for start in range(0, len(packets), self.factory.batch_size):
+                batch = packets[start : start + self.factory.batch_size]
+                self.sendMessage(struct.pack(">H", len(batch)) + b"".join(batch), isBinary=True)
+                self.factory.stats[1] += len(batch)
+        self.push = self.factory.reactor.callLater(self.factory.interval, self.send_ticks)
+
+
+class FakeTickerServer:
+    # Local stand-in for the Kite websocket, run in its own process. Point a KiteTicker at it with
+    # root=server.url; api key and access token are not checked. `connections` and `ticks_sent` count
+    # what the server saw, and every subscribe, unsubscribe and mode message is put on `subscriptions`
+    # as (connection, action, value). Order updates and dropped connections are sent on request.
+    def __init__(self, interval: float = 0.25, batch_size: int = 500, seed: int = 0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.seed = seed
+        self.subscriptions = Queue()
+        # (action, data) requests from the test or benchmark process, polled by the server
+        self.control = Queue()
+        self.stats = Array("d", 2, lock=False)
+        self.process = None  # type: Optional[Process]
+        self.port = None  # type: Optional[int]
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}"
+
+    @property
+    def connections(self) -> int:
+        return int(self.stats[0])
+
+    @property
+    def ticks_sent(self) -> int:
+        return int(self.stats[1])
+
+    def serve(self, ports: Queue):
+        reactor = fresh_reactor()
+        factory = WebSocketServerFactory(reactor=reactor)
+        factory.protocol = FakeTickerProtocol
+        factory.interval = self.interval
+        factory.batch_size = self.batch_size
+        factory.seed = self.seed
+        factory.connections = 0
+        factory.stats = self.stats
+        factory.subscriptions = self.subscriptions
+        factory.clients = set()
+        # Prices are shared by the connections, a token streamed on two of them ticks the same
+        factory.prices = {}  # type: Dict[int, float]
+
+        def poll_control():
+            while True:
+                try:
+                    action, data = self.control.get_nowait()
+                except Empty:
+                    break
+                for client in list(factory.clients):
+                    if action == "order":
+                        message = json.dumps({"type": "order", "data": data}).encode("utf-8")
+                        client.sendMessage(message, isBinary=False)
+                    elif action == "drop":
+                        client.transport.abortConnection()
+            reactor.callLater(0.05, poll_control)
+
+        reactor.callLater(0.05, poll_control)
+        listener = reactor.listenTCP(0, factory, interface="127.0.0.1")
+        ports.put(listener.getHost().port)
+        reactor.run(installSignalHandlers=False)
+
+    def start(self) -> "FakeTickerServer":
+        ports = Queue()
+        self.process = Process(target=self.serve, args=(ports,), daemon=True)
+        self.process.start()
+        self.port = ports.get(timeout=10)
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def send_order_update(self, data: Dict):
+        # Sent to every open connection as a text message, the way Kite sends order updates
+        self.control.put(("order", data))
+
+    def drop_connections(self):
+        # Close every open connection without a close handshake, the clients reconnect
+        self.control.put(("drop", None))
+
+    def messages(self) -> List[tuple]:
+        # Subscription messages received so far
+        received = []
+        while not self.subscriptions.empty():
+            received.append(self.subscriptions.get())
+        return received
@@ -0,0 +1,183 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from broker import SimulatedBroker
+
+SYMBOL = "BANKNIFTY"
+UNDERLYING_SYMBOL = "NIFTY BANK"
+UNDERLYING_TOKEN = 260105
+EXPIRY = date(2023, 2, 16)
+SPOT = 40000.0
+STRIKE_STEP = 100
+
+
+def option_symbol(strike: float, option_type: str, expiry: date = EXPIRY) -> str:
+    # Weekly contract tradingsymbol, e.g. BANKNIFTY2321640000CE
+    return f"{SYMBOL}{expiry.year % 100}{expiry.month}{expiry.day:02d}{int(strike)}{option_type}"
+
+
+def make_instruments(n_strikes: int, expiry: date = EXPIRY) -> Tuple[List[Dict], pd.DataFrame]:
+    # Kite instrument master with one chain of n_strikes strikes around SPOT plus its index, and the
+    # F&O market lot file listing the chain, in the shapes InstrumentMaster.build_instrument_records reads
+    instruments = [
+        {
+            "instrument_token": UNDERLYING_TOKEN,
+            "tradingsymbol": UNDERLYING_SYMBOL,
+            "name": UNDERLYING_SYMBOL,
+            "strike": 0.0,
+            "instrument_type": "EQ",
+            "segment": "INDICES",
+            "exchange": "NSE",
+            "expiry": "",
+            "lot_size": 0,
+        }
+    ]
+    first_strike = SPOT - STRIKE_STEP * (n_strikes // 2)
+    token = 10000000
+    for idx in range(n_strikes):
+        strike = first_strike + idx * STRIKE_STEP
+        for option_type in ("CE", "PE"):
+            token += 1
+            instruments.append(
+                {
+                    "instrument_token": token,
+                    "tradingsymbol": option_symbol(strike, option_type, expiry),
+                    "name": SYMBOL,
+                    "strike": strike,
+                    "instrument_type": option_type,
+                    "segment": "NFO-OPT",
+                    "exchange": "NFO",
+                    "expiry": expiry,
+                    "lot_size": 25,
+                }
+            )
+    fno_contract = pd.DataFrame({"UNDERLYING": [f"{UNDERLYING_SYMBOL} "], "SYMBOL": [f"{SYMBOL} "]})
+    return instruments, fno_contract
+
+
+def contract_details(n_strikes: int, expiry: date = EXPIRY) -> Dict[int, Dict]:
+    # Token -> contract detail of the synthetic chain, as InstrumentMaster.fetch_token_detail returns it
+    return {
+        contract["instrument_token"]: {
+            "symbol": contract["tradingsymbol"],
+            "strike": contract["strike"],
+            "type": contract["instrument_type"],
+        }
+        for contract in make_instruments(n_strikes, expiry)[0]
+    }
+
+
+class FakeTicker:
+    # Stands in for KiteTicker. Prices of the subscribed tokens follow a seeded random walk and
+    # connect() pushes batches of FULL mode ticks through the assigned callbacks without a socket.
+    MODE_LTP = "ltp"
+    MODE_QUOTE = "quote"
+    MODE_FULL = "full"
+
+    def __init__(self, n_batches: int, batch_size: int, seed: int = 0):
+        self.n_batches = n_batches
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.tokens = []  # type: List[int]
+        self.prices = {}  # type: Dict[int, float]
+        self.volumes = {}  # type: Dict[int, int]
+        self.on_ticks = None
+        self.on_connect = None
+        self.on_order_update = None
+        self.on_close = None
+        self.on_error = None
+        self.on_noreconnect = None
+        self.on_reconnect = None
+        # Seconds spent in on_ticks and ticks pushed by the last connect()
+        self.elapsed = 0.0
+        self.n_ticks = 0
+
+    def subscribe(self, tokens: List[int]):
+        for token in tokens:
+            if token not in self.prices:
+                self.tokens.append(token)
+                self.prices[token] = SPOT if token == UNDERLYING_TOKEN else self.random.uniform(5.0, 800.0)
+                self.volumes[token] = 0
+
+    def unsubscribe(self, tokens: List[int]):
+        for token in tokens:
+            if token in self.prices:
+                self.tokens.remove(token)
+                del self.prices[token]
+                del self.volumes[token]
+
+    def set_mode(self, mode: str, tokens: List[int]):
+        pass
+
+    def batches(self, tokens: Optional[List[int]] = None) -> Iterator[List[Dict]]:
+        if tokens is not None:
+            self.subscribe(tokens)
+        exchange_time = datetime.combine(EXPIRY, datetime.min.time()) + timedelta(hours=9, minutes=15)
+        for _ in range(self.n_batches):
+            exchange_time += timedelta(milliseconds=250)
+            batch = []
+            for token in self.random.sample(self.tokens, min(self.batch_size, len(self.tokens))):
+                price = max(0.05, self.prices[token] * (1 + self.random.gauss(0, 0.001)))
+                self.prices[token] = price
+                self.volumes[token] += self.random.randint(1, 50) * 25
+                batch.append(
+                    {
+                        "instrument_token": token,
+                        "last_price": round(price, 2),
+                        "volume_traded": self.volumes[token],
+                        "change": self.random.uniform(-5.0, 5.0),
+                        "exchange_timestamp": exchange_time,
+                    }
+                )
+            yield batch
+
+    def connect(self, threaded: bool = False):
+        # Batches are generated up front so that `elapsed` only covers the tick callbacks
+        self.on_connect(self, {})
+        batches = list(self.batches())
+        start = time.perf_counter()
+        for batch in batches:
+            self.on_ticks(self, batch)
+        self.elapsed = time.perf_counter() - start
+        self.n_ticks = sum(len(batch) for batch in batches)
+
+
+class StubKite(SimulatedBroker):
+    # Stands in for KiteConnect: the instrument master is synthetic and orders go to the simulated
+    # broker, optionally after a fixed delay per call to mimic the REST round trip
+    def __init__(self, n_strikes: int, latency: float = 0.0):
+        super().__init__(datetime.now)
+        self.n_strikes = n_strikes
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def instruments(self, exchange=None) -> List[Dict]:
+        self._wait()
+        return make_instruments(self.n_strikes)[0]
+
+    def place_order(self, *args, **kwargs) -> str:
+        self._wait()
+        return super().place_order(*args, **kwargs)
+
+    def modify_order(self, *args, **kwargs) -> str:
+        self._wait()
+        return super().modify_order(*args, **kwargs)
+
+    def cancel_order(self, *args, **kwargs) -> str:
+        self._wait()
+        return super().cancel_order(*args, **kwargs)
+
+    def order_history(self, order_id) -> List[Dict]:
+        self._wait()
+        return super().order_history(order_id)
+
+    def orders(self) -> List[Dict]:
+        self._wait()
+        return super().orders()
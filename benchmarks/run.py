@@ -0,0 +1,365 @@
+"""
+Offline benchmarks of the feed, snapshot and strategy hot paths
+
+    python benchmarks/run.py                      # results saved to benchmarks/results/<commit>.json
+    python benchmarks/run.py --compare base.json  # also report changes against an earlier run
+
+Ticks come from FakeTicker, orders go to StubKite and the redis backend uses fakeredis unless
+--redis points at a local redis-server. Sharded tickers connect to a FakeTickerServer on localhost,
+nothing else touches the network.
+"""
+
+import argparse
+import contextlib
+import json
+import timeit
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Process
+from typing import Dict, Iterator, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, path) for path in ("", "core", "option_chain_stream", "backtest", "benchmarks")]
+
+import numpy as np
+
+import codec
+from fake_ticker_server import FakeTickerServer
+from fakes import EXPIRY, SYMBOL, UNDERLYING_SYMBOL, FakeTicker, StubKite, contract_details, make_instruments
+from greeks import ChainAnalytics
+from instrument_file import InstrumentMaster, option_data_from_tick
+from order_book import OrderBook
+from redis_pool import configure
+from replay import SessionContracts
+from storage import InProcessStore, RedisBackend, SharedMemoryStore
+from strategy import StraddleStrategy
+from ticker_shards import TickerShards
+from websocket import WebsocketClient
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SESSION_TIME = datetime.combine(EXPIRY, datetime.min.time()) + timedelta(hours=10)
+
+
+def make_storage(name: str, redis_address: Optional[str]):
+    if name == "memory":
+        return InProcessStore()
+    if name == "shm":
+        return SharedMemoryStore()
+    if redis_address:
+        host, port = redis_address.split(":")
+        configure(host=host, port=int(port))
+        return RedisBackend()
+    if fakeredis is None:
+        return None
+    return RedisBackend(connection=fakeredis.FakeStrictRedis())
+
+
+def sync_chain(backend, n_strikes: int):
+    master = InstrumentMaster("benchmark", backend)
+    master.kite = StubKite(n_strikes)
+    _, fno_contract = make_instruments(n_strikes)
+    token_detail, contract_token = master.build_instrument_records(master.kite.instruments(), fno_contract)
+    master.redis_db.data_dump_batch(list(token_detail.items()) + list(contract_token.items()))
+
+
+def feed_client(backend, n_strikes: int, n_batches: int = 1, batch_size: int = 0) -> WebsocketClient:
+    # Synced chain and a websocket client fed by a FakeTicker, by default one batch ticking every token
+    sync_chain(backend, n_strikes)
+    client = WebsocketClient(SYMBOL, str(EXPIRY), "benchmark", "benchmark", True, storage=backend)
+    client.kws = FakeTicker(n_batches, batch_size or len(client.token_list))
+    client.assign_callBacks()
+    return client
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = np.array(samples) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def bench_ingest(storages: List[str], redis_address: Optional[str], n_strikes: int, batch_sizes: List[int]):
+    results = []
+    for storage in storages:
+        for batch_size in batch_sizes:
+            backend = make_storage(storage, redis_address)
+            if backend is None:
+                continue
+            client = feed_client(backend, n_strikes, n_batches=200, batch_size=batch_size)
+            ticker = client.kws
+            results.append(
+                {
+                    "benchmark": "ingest",
+                    "storage": storage,
+                    "n_strikes": n_strikes,
+                    "batch_size": batch_size,
+                    "ticks_per_s": ticker.n_ticks / ticker.elapsed,
+                    "batch_ms": 1000 * ticker.elapsed / ticker.n_batches,
+                }
+            )
+            backend.close(unlink=True)
+    return results
+
+
+def bench_snapshot(storages: List[str], redis_address: Optional[str], chain_sizes: List[int], repeat: int):
+    results = []
+    for storage in storages:
+        for n_strikes in chain_sizes:
+            backend = make_storage(storage, redis_address)
+            if backend is None:
+                continue
+            client = feed_client(backend, n_strikes)
+            master = client.instrumentClass
+            analytics = ChainAnalytics(master.token_details, EXPIRY, clock=lambda: SESSION_TIME)
+            fetch, greeks = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                option_chain = master.generate_optionChain(client.token_list, client.option_keys)
+                fetched = time.perf_counter()
+                analytics.attach(option_chain)
+                fetch.append(fetched - start)
+                greeks.append(time.perf_counter() - fetched)
+            for stage, samples in (("fetch", fetch), ("greeks", greeks)):
+                results.append(
+                    dict(
+                        {"benchmark": "snapshot", "storage": storage, "n_strikes": n_strikes, "stage": stage},
+                        **summarize(samples),
+                    )
+                )
+            backend.close(unlink=True)
+    return results
+
+
+def bench_codec(n_strikes: int, number: int):
+    # Encode and decode cost per record of every layout kept in redis, JSON against binary records
+    details = contract_details(n_strikes)
+    option_token = next(token for token, detail in details.items() if detail["type"] == "CE")
+    underlying_token = next(token for token, detail in details.items() if detail["type"] == "EQ")
+    batch = next(FakeTicker(1, len(details)).batches(list(details)))
+    ticks = {tick["instrument_token"]: tick for tick in batch}
+    records = {
+        "option": option_data_from_tick(ticks[option_token], details[option_token]),
+        "underlying": option_data_from_tick(ticks[underlying_token], details[underlying_token]),
+        "contract": details[option_token],
+        "chain": [
+            {"strike": detail["strike"], "type": detail["type"], "expiry": str(EXPIRY), "token": token}
+            for token, detail in details.items()
+        ],
+    }
+    codecs = {"json": (json.dumps, json.loads), "binary": (codec.encode, codec.decode)}
+    results = []
+    for record, value in records.items():
+        repeat = max(1, number // len(value)) if record == "chain" else number
+        for name, (encode, decode) in codecs.items():
+            raw = encode(value)
+            results.append(
+                {
+                    "benchmark": "codec",
+                    "record": record,
+                    "codec": name,
+                    "encode_us": 1e6 * timeit.timeit(lambda: encode(value), number=repeat) / repeat,
+                    "decode_us": 1e6 * timeit.timeit(lambda: decode(raw), number=repeat) / repeat,
+                    "bytes": len(raw),
+                }
+            )
+    return results
+
+
+def snapshots(n_strikes: int, n_snapshots: int) -> List[List[Dict]]:
+    # List snapshots as the feed builds them, the first one has every contract of the chain
+    details = contract_details(n_strikes)
+    token_list = list(details)
+    ticker = FakeTicker(n_snapshots, max(1, len(token_list) // 4))
+    ticker.subscribe(token_list)
+    latest = {}  # type: Dict[int, Dict]
+    for tick in next(FakeTicker(1, len(token_list)).batches(token_list)):
+        latest[tick["instrument_token"]] = option_data_from_tick(tick, details[tick["instrument_token"]])
+    chains = []
+    for batch in ticker.batches():
+        for tick in batch:
+            latest[tick["instrument_token"]] = option_data_from_tick(tick, details[tick["instrument_token"]])
+        chains.append([latest[token] for token in token_list])
+    return chains
+
+
+def bench_strategy(n_strikes: int, n_snapshots: int, rest_latency: float):
+    broker = StubKite(n_strikes, latency=rest_latency)
+    chains = snapshots(n_strikes, n_snapshots)
+    decision_times = []  # type: List[float]
+
+    def timed_stream() -> Iterator[List[Dict]]:
+        # Time from handing a snapshot to the strategy until it asks for the next one
+        for option_chain in chains:
+            start = time.perf_counter()
+            yield option_chain
+            decision_times.append(time.perf_counter() - start)
+
+    strategy = StraddleStrategy(
+        kite_instance=broker,
+        instrument_symbol=SYMBOL,
+        expiry_date=None,
+        access_token=None,
+        stream=timed_stream(),
+        clock=lambda: SESSION_TIME,
+        order_book=OrderBook(broker, updates=broker.updates),
+        contract_index=SessionContracts(contract_details(n_strikes)),
+        underlying_symbol=UNDERLYING_SYMBOL,
+        order_cache=None,
+    )
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        strategy.execute(
+            entry_time=SESSION_TIME - timedelta(minutes=1), exit_time=SESSION_TIME + timedelta(hours=1), n_lots=1
+        )
+    return [
+        dict({"benchmark": "strategy", "n_strikes": n_strikes, "stage": "entry"}, **summarize(decision_times[:1])),
+        dict({"benchmark": "strategy", "n_strikes": n_strikes, "stage": "monitor"}, **summarize(decision_times[1:])),
+    ]
+
+
+def bench_shards(shard_counts: List[int], n_strikes: int, interval: float, duration: float):
+    # Ticks stored per second by 1..3 ticker connections, each in its own process, all receiving from a
+    # local FakeTickerServer that pushes every subscribed token each `interval` seconds into one shm store
+    results = []
+    for n_shards in shard_counts:
+        backend = SharedMemoryStore()
+        sync_chain(backend, n_strikes)
+        client = WebsocketClient(SYMBOL, str(EXPIRY), "benchmark", "benchmark", True, storage=backend)
+        server = FakeTickerServer(interval=interval).start()
+        shards = TickerShards(client, "benchmark", "benchmark", n_shards, root=server.url)
+        workers = [Process(target=shards.run, args=(shard,), daemon=True) for shard in range(n_shards)]
+        for worker in workers:
+            worker.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and not all(shards.stats.get(shard)["batches"] for shard in range(n_shards)):
+            time.sleep(0.1)
+        # Let the connections settle before counting
+        time.sleep(1)
+        stored = sum(shards.stats.get(shard)["ticks"] for shard in range(n_shards))
+        sent = server.ticks_sent
+        start = time.monotonic()
+        time.sleep(duration)
+        elapsed = time.monotonic() - start
+        stats = [shards.stats.get(shard) for shard in range(n_shards)]
+        results.append(
+            {
+                "benchmark": "shards",
+                "n_shards": n_shards,
+                "n_tokens": len(client.token_list),
+                "sent_per_s": (server.ticks_sent - sent) / elapsed,
+                "ticks_per_s": (sum(stat["ticks"] for stat in stats) - stored) / elapsed,
+            }
+        )
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        server.stop()
+        backend.close(unlink=True)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty.strip() else "")
+
+
+def metric_key(result: Dict) -> tuple:
+    return tuple(
+        (key, value) for key, value in result.items() if not key.endswith(("_ms", "_us", "_per_s")) and key != "bytes"
+    )
+
+
+def compare(base: Dict, current: Dict, threshold: float) -> List[str]:
+    # Lower is better for timings, higher is better for throughput
+    base_results = {metric_key(result): result for result in base["results"]}
+    lines = []
+    for result in current["results"]:
+        previous = base_results.get(metric_key(result))
+        if previous is None:
+            continue
+        label = " ".join(f"{key}={value}" for key, value in metric_key(result))
+        for metric in ("ticks_per_s", "p50_ms", "p99_ms", "encode_us", "decode_us"):
+            if metric not in result or not previous.get(metric):
+                continue
+            change = result[metric] / previous[metric] - 1
+            worse = -change if metric.endswith("_per_s") else change
+            flag = "REGRESSION" if worse > threshold else "improved" if worse < -threshold else ""
+            lines.append(f"{label} {metric}: {previous[metric]:.3f} -> {result[metric]:.3f} ({change:+.1%}) {flag}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", nargs="+", default=["redis", "memory", "shm"], choices=["redis", "memory", "shm"])
+    parser.add_argument("--redis", help="host:port of a local redis-server, fakeredis is used by default")
+    parser.add_argument("--chain-sizes", nargs="+", type=int, default=[50, 100, 250, 500, 1000])
+    parser.add_argument("--ingest-strikes", type=int, default=200)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[50, 400])
+    parser.add_argument("--repeat", type=int, default=100, help="Snapshots fetched per chain size")
+    parser.add_argument("--strategy-snapshots", type=int, default=500)
+    parser.add_argument("--codec-number", type=int, default=20000, help="Records encoded and decoded per layout")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Seconds added to every StubKite call")
+    parser.add_argument("--shards", nargs="+", type=int, default=[1, 2, 3], help="Ticker connections to compare")
+    parser.add_argument("--shard-strikes", type=int, default=1000, help="Strikes streamed by the sharded tickers")
+    parser.add_argument("--shard-interval", type=float, default=0.05, help="Seconds between fake ticker pushes")
+    parser.add_argument("--shard-seconds", type=float, default=3.0, help="Seconds ticks are counted per shard count")
+    parser.add_argument("--output", help="Result file, benchmarks/results/<commit>.json by default")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if "redis" in args.storage and not args.redis and fakeredis is None:
+        logging.warning("fakeredis is not installed and --redis is not set, skipping the redis backend")
+
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{git_commit() or 'unknown'}.json"))
+    base_path = os.path.abspath(args.compare) if args.compare else None
+    # Run away from the repo so that a real contracts.idx is never picked up
+    os.chdir(tempfile.mkdtemp(prefix="opto-bench-"))
+    results = []
+    results += bench_ingest(args.storage, args.redis, args.ingest_strikes, args.batch_sizes)
+    results += bench_snapshot(args.storage, args.redis, args.chain_sizes, args.repeat)
+    results += bench_codec(args.ingest_strikes, args.codec_number)
+    results += bench_strategy(args.ingest_strikes, args.strategy_snapshots, args.rest_latency)
+    results += bench_shards(args.shards, args.shard_strikes, args.shard_interval, args.shard_seconds)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "redis": args.redis or ("fakeredis" if fakeredis is not None else None),
+        "args": vars(args),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print(json.dumps(result))
+    print(f"Saved {len(results)} results to {output}")
+    if base_path:
+        with open(base_path) as f:
+            base = json.load(f)
+        print(f"Compared with {base.get('commit')}:")
+        for line in compare(base, report, args.threshold):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
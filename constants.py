@@ -9,6 +9,23 @@ STOP_LOSS = 40
 STOP_LOSS_TRAILING_TRIGGER = 10
 TARGET = 50
 ADD_TARGETS = False
+# Absolute delta of the legs sold at entry, None sells the strike nearest to spot
+ENTRY_DELTA = None
+# Seconds after which a live snapshot is too old to act on, None acts on every snapshot
+MAX_SNAPSHOT_AGE = None
+# Tick to order latency histograms in Prometheus format, tracing stays off while both are None
+LATENCY_METRICS_FILE = None
+LATENCY_METRICS_PORT = None
+# Keep stop losses and targets in process, checked on every tick, instead of resting them at the exchange
+SYNTHETIC_STOPS = False
+# Synthetic stops are saved here and restored when the strategy restarts the same day
+SYNTHETIC_STOPS_FILE = 'synthetic_stops.json'
+# Percent beyond the last price of the limit order a synthetic stop sends, None sends a market order
+SYNTHETIC_STOP_SLIPPAGE = None
+# Strikes streamed on each side of the money, following spot, None streams every strike of the expiry
+ATM_WINDOW = None
+# Ticker mode of the strikes in the window, 'ltp' or 'quote'. Legs held are always streamed in 'full' mode
+ATM_WINDOW_MODE = 'quote'
 MINIMUM_QUANTITY = 25
 LOTS = 4
 
@@ -21,5 +38,13 @@ EXPIRY_DATE_STRING = f'{expiry_date.year%100}{expiry_date.month}{expiry_date.day
 
 DRY_RUN = False
 
+# Shared redis connection pool, see option_chain_stream/redis_pool.py
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+# Takes precedence over host and port when set
+REDIS_UNIX_SOCKET = None
+REDIS_SOCKET_TIMEOUT = None
+REDIS_CONNECT_TIMEOUT = 5
+
 ENTRY_TIME = time(9, 29, 30)
 EXIT_TIME = time(14, 59, 30)
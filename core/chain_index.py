@@ -0,0 +1,96 @@
+import math
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class ChainIndex:
+    # Built once per session from the first snapshot. Strikes are sorted once so nearest strike
+    # selection is a binary search, and symbols map to their position in the snapshot list so a
+    # price lookup is a single index instead of a scan.
+    def __init__(
+        self, option_chain: Iterable[Dict], underlying_symbol: str, expiry_date_string: str, contract_index=None
+    ):
+        self.underlying_symbol = underlying_symbol
+        self.expiry_date_string = expiry_date_string
+        # Memory mapped contract metadata, strikes are parsed from tradingsymbols when it is not built yet
+        self.contract_index = contract_index
+        self._build(option_chain)
+
+    def _contract(self, symbol: str) -> Tuple[float, str]:
+        if self.contract_index is not None:
+            detail = self.contract_index.by_tradingsymbol(symbol)
+            if detail is not None:
+                return detail["strike"], detail["type"]
+        return float(symbol.split(self.expiry_date_string)[-1][:-2]), symbol[-2:]
+
+    def _build(self, option_chain):
+        if isinstance(option_chain, list):
+            symbols = [option["symbol"] for option in option_chain]
+        else:
+            # Array backed snapshots know every contract of the chain up front
+            symbols = list(option_chain.layout.symbol_position)
+        self.positions = {symbol: position for position, symbol in enumerate(symbols)}  # type: Dict[str, int]
+        contracts = {}  # type: Dict[float, Dict[str, str]]
+        for symbol in symbols:
+            if symbol != self.underlying_symbol:
+                strike, option_type = self._contract(symbol)
+                contracts.setdefault(strike, {})[option_type] = symbol
+        # Only strikes where both legs are listed can be traded as a straddle
+        self.strikes = sorted(strike for strike, legs in contracts.items() if "CE" in legs and "PE" in legs)
+        self.call_symbols = [contracts[strike]["CE"] for strike in self.strikes]
+        self.put_symbols = [contracts[strike]["PE"] for strike in self.strikes]
+
+    def get_option(self, symbol: str, option_chain) -> Dict:
+        if not isinstance(option_chain, list):
+            # Array backed snapshots resolve symbols themselves
+            return option_chain.option(symbol)
+        position = self.positions.get(symbol)
+        if position is None or position >= len(option_chain) or option_chain[position]["symbol"] != symbol:
+            # Positions move only when a contract shows up in the snapshot for the first time
+            self._build(option_chain)
+            position = self.positions[symbol]
+        return option_chain[position]
+
+    def get_price(self, symbol: str, option_chain) -> float:
+        if not isinstance(option_chain, list):
+            return option_chain.last_price(symbol)
+        return self.get_option(symbol, option_chain)["last_price"]
+
+    def nearest_strike_index(self, price: float) -> Optional[int]:
+        if not self.strikes:
+            return None
+        idx = bisect_left(self.strikes, price)
+        if idx == len(self.strikes):
+            return idx - 1
+        if idx > 0 and price - self.strikes[idx - 1] <= self.strikes[idx] - price:
+            return idx - 1
+        return idx
+
+    def nearest_symbols(self, price: float) -> Tuple[str, str]:
+        idx = self.nearest_strike_index(price)
+        if idx is None:
+            raise ValueError("No strike with both CE and PE in the option chain")
+        return self.call_symbols[idx], self.put_symbols[idx]
+
+    def _delta_distance(self, symbol: str, option_chain, delta: float) -> float:
+        option = self.get_option(symbol, option_chain) if symbol in self.positions else None
+        option_delta = option.get("delta") if option else None
+        if option_delta is None or math.isnan(option_delta):
+            return math.inf
+        return abs(option_delta - delta)
+
+    def _closest_delta(self, symbols: List[str], option_chain, delta: float) -> Optional[str]:
+        distance, symbol = min(
+            ((self._delta_distance(symbol, option_chain, delta), symbol) for symbol in symbols),
+            default=(math.inf, None),
+        )
+        return symbol if distance < math.inf else None
+
+    def delta_symbols(self, delta: float, option_chain) -> Tuple[str, str]:
+        # Call whose delta is closest to `delta` and put whose delta is closest to -`delta`, using the
+        # greeks ChainAnalytics attached to the snapshot
+        call_symbol = self._closest_delta(self.call_symbols, option_chain, delta)
+        put_symbol = self._closest_delta(self.put_symbols, option_chain, -delta)
+        if call_symbol is None or put_symbol is None:
+            raise ValueError("No greeks attached to the option chain snapshot")
+        return call_symbol, put_symbol
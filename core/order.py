@@ -1,14 +1,23 @@
 import logging
+from typing import Optional
 
 from kiteconnect import KiteConnect
 from requests.exceptions import ReadTimeout
 
+from order_book import OrderBook
+
 
 class Order:
-    def __init__(self, kite_instance: KiteConnect, order_id: int):
+    def __init__(self, kite_instance: KiteConnect, order_id: int, order_book: Optional[OrderBook] = None):
         self.order_id = None
         self.kite_instance = kite_instance
-        order_data = kite_instance.order_history(order_id=order_id)[-1]
+        self.order_book = order_book
+        # Orders placed through a tracked product are already in the order book, no REST call needed
+        order_data = order_book.get(order_id) if order_book is not None else None
+        if order_data is None:
+            order_data = kite_instance.order_history(order_id=order_id)[-1]
+            if order_book is not None:
+                order_book.update(order_data)
         for key, value in order_data.items():
             setattr(self, key, value)
         print(self.__dict__)
@@ -16,22 +25,36 @@ class Order:
     def __str__(self):
         return self.order_id
 
-    def modify(self, price: float = None, trigger_price: float = None, order_type: str = None):
+    def modify(self, price: float = None, trigger_price: float = None, order_type: str = None, wait: bool = True):
         logging.info("Modifying order")
-        new_order_id = self.kite_instance.modify_order(
+        params = dict(
             variety=KiteConnect.VARIETY_REGULAR,
             order_id=self.order_id,
             price=price,
             trigger_price=trigger_price,
             order_type=order_type,
         )
-        return Order(self.kite_instance, new_order_id)
+        if not wait and hasattr(self.kite_instance, "submit"):
+            # Queued on a RequestDispatcher where queued modifies of the same order are merged, a modify
+            # keeps the order id
+            self.kite_instance.submit("modify_order", **params).add_done_callback(_log_failed_modify)
+            new_order_id = self.order_id
+        else:
+            new_order_id = self.kite_instance.modify_order(**params)
+        if self.order_book is not None:
+            modified = {"price": price, "trigger_price": trigger_price, "order_type": order_type}
+            self.order_book.update(
+                dict({key: value for key, value in modified.items() if value is not None}, order_id=new_order_id)
+            )
+        return Order(self.kite_instance, new_order_id, self.order_book)
 
     def cancel(self):
         logging.info("Cancelling order")
         self.kite_instance.cancel_order(variety=KiteConnect.VARIETY_REGULAR, order_id=self.order_id)
 
     def get_status(self):
+        if self.order_book is not None:
+            return self.order_book.get_status(self.order_id)
         try:
             latest_order_data = self.kite_instance.order_history(order_id=self.order_id)[-1]
             return latest_order_data.get('status')
@@ -39,6 +62,11 @@ class Order:
             return None
 
 
+def _log_failed_modify(future):
+    if future.exception() is not None:
+        logging.error(f"Order modify failed: {future.exception()}")
+
+
 class TestOrder:
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
@@ -46,6 +74,7 @@ class TestOrder:
         self.symbol = self.tradingsymbol
 
     def modify(self, **kwargs):
+        kwargs.pop("wait", None)
         logging.info(
             f"Modifying order -> {self.tradingsymbol}-{self.price}-{self.trigger_price} -> {kwargs.get('price', None)} - {kwargs.get('trigger_price', None)}"
         )
@@ -0,0 +1,67 @@
+import logging
+import time
+from queue import Empty
+from typing import Dict, Optional
+
+from kiteconnect import KiteConnect
+from requests.exceptions import ReadTimeout
+
+
+class OrderBook:
+    # Local cache of order state. It is fed by the order updates the ticker receives, which arrive
+    # on `updates` as ("order", order_data) and ("stream", connected) messages. While the stream is
+    # down every tracked order is refreshed with a single orders() call per refresh interval.
+    def __init__(self, kite_instance: KiteConnect, updates=None, refresh_interval: float = 1.0):
+        self.kite_instance = kite_instance
+        self.updates = updates
+        self.refresh_interval = refresh_interval
+        self.stream_connected = False
+        self._orders = {}  # type: Dict[str, Dict]
+        self._last_refresh = 0.0
+
+    def track(self, order_id, order_data: Dict):
+        order_id = str(order_id)
+        if order_id not in self._orders:
+            self._orders[order_id] = dict(order_data, order_id=order_id)
+
+    def update(self, order_data: Dict):
+        order_id = str(order_data["order_id"])
+        self._orders.setdefault(order_id, {}).update(order_data, order_id=order_id)
+
+    def _drain_updates(self):
+        if self.updates is None:
+            return
+        while True:
+            try:
+                kind, payload = self.updates.get_nowait()
+            except Empty:
+                return
+            if kind == "order":
+                self.update(payload)
+            elif kind == "stream":
+                self.stream_connected = payload
+
+    def refresh(self):
+        try:
+            orders = self.kite_instance.orders()
+        except ReadTimeout:
+            logging.warning("Timed out refreshing orders")
+            return
+        self._last_refresh = time.monotonic()
+        for order_data in orders:
+            if str(order_data["order_id"]) in self._orders:
+                self.update(order_data)
+
+    def sync(self):
+        self._drain_updates()
+        if not self.stream_connected and time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def get(self, order_id) -> Optional[Dict]:
+        self._drain_updates()
+        return self._orders.get(str(order_id))
+
+    def get_status(self, order_id) -> Optional[str]:
+        self.sync()
+        order_data = self._orders.get(str(order_id))
+        return order_data.get("status") if order_data else None
@@ -1,17 +1,26 @@
-from typing import Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Optional, Union
 
 from kiteconnect import KiteConnect
 import logging
-from redis import Redis
 from constants import DRY_RUN
 from order import Order, TestOrder
+from order_book import OrderBook
+from redis_pool import redis_connection
 
-cache = Redis()
+# Placed order ids, on the shared redis pool so redis_pool.configure applies even after import
+cache = redis_connection()
 
 
 class Product:
-    def __init__(self, kite_instance: KiteConnect, trading_symbol):
+    def __init__(
+        self, kite_instance: KiteConnect, trading_symbol, order_book: Optional[OrderBook] = None, order_cache=cache
+    ):
         self._kite_instance = kite_instance
+        self._order_book = order_book
+        # Remembers placed order ids across restarts, None disables it (e.g. for simulated brokers)
+        self._order_cache = order_cache
         self.exchange = None
         self.variety = None
         self.trading_symbol = trading_symbol
@@ -24,15 +33,19 @@ class Product:
         else:
             return KiteConnect.ORDER_TYPE_SLM if trigger_price else KiteConnect.ORDER_TYPE_MARKET
 
-    def _get_or_place_order(self, transaction_type, quantity, price=None, trigger_price=None):
+    def _get_or_place_order(
+        self, transaction_type, quantity, price=None, trigger_price=None, trace=None, priority: Optional[int] = None
+    ):
         order_type = self.get_order_type(price, trigger_price)
         logging.info(
             f"Placing a {'buy' if transaction_type == KiteConnect.TRANSACTION_TYPE_BUY else 'sell'} order {self.trading_symbol}-{order_type} Price:{price} Trigger Price:{trigger_price}"
         )
-        order_id = cache.get(f'{self.trading_symbol}{order_type}{KiteConnect.TRANSACTION_TYPE_BUY}').decode('utf-8')
+        order_id = None
+        if self._order_cache is not None:
+            order_id = self._order_cache.get(f'{self.trading_symbol}{order_type}{transaction_type}')
         if order_id:
-            return Order(self._kite_instance, order_id)
-        order_id = self._kite_instance.place_order(
+            return Order(self._kite_instance, order_id.decode('utf-8'), self._order_book)
+        params = dict(
             variety=self.variety,
             tradingsymbol=self.trading_symbol,
             exchange=self.exchange,
@@ -45,20 +58,47 @@ class Product:
             disclosed_quantity=quantity,
             validity=self.validity,
         )
-        cache.set(f'{self.trading_symbol}{order_type}{transaction_type}', str(order_id), ex=43200)
-        return Order(self._kite_instance, order_id)
+        if priority is not None and hasattr(self._kite_instance, "submit"):
+            # Queued on a RequestDispatcher ahead of the requests of lower priority, see rest_dispatcher.py
+            order_id = self._kite_instance.submit("place_order", priority=priority, **params).result()
+        else:
+            order_id = self._kite_instance.place_order(**params)
+        if trace is not None:
+            # Latency trace of the snapshot the order was decided on, see option_chain_stream/latency.py
+            trace.mark("order")
+        if self._order_cache is not None:
+            self._order_cache.set(f'{self.trading_symbol}{order_type}{transaction_type}', str(order_id), ex=43200)
+        if self._order_book is not None:
+            self._order_book.track(
+                order_id,
+                {
+                    "tradingsymbol": self.trading_symbol,
+                    "exchange": self.exchange,
+                    "transaction_type": transaction_type,
+                    "order_type": order_type,
+                    "price": price,
+                    "trigger_price": trigger_price,
+                    "quantity": quantity,
+                    "product": self._product,
+                    "variety": self.variety,
+                    "status": None,
+                },
+            )
+        return Order(self._kite_instance, order_id, self._order_book)
 
     def buy(
         self,
         quantity,
         price=None,
         trigger_price=None,
+        priority: Optional[int] = None,
     ) -> Union[Order, TestOrder]:
         return self._get_or_place_order(
             transaction_type=KiteConnect.TRANSACTION_TYPE_BUY,
             quantity=quantity,
             price=price,
             trigger_price=trigger_price,
+            priority=priority,
         )
 
     def sell(
@@ -66,18 +106,110 @@ class Product:
         quantity,
         price=None,
         trigger_price=None,
+        priority: Optional[int] = None,
     ) -> Union[Order, TestOrder]:
         return self._get_or_place_order(
             transaction_type=KiteConnect.TRANSACTION_TYPE_SELL,
             quantity=quantity,
             price=price,
             trigger_price=trigger_price,
+            priority=priority,
+        )
+
+    @staticmethod
+    def place_basket(legs: Dict[Hashable, "BasketLeg"], max_workers: int = 6) -> "BasketResult":
+        # Independent legs are sent concurrently so they fill as close together as possible. A leg with
+        # `after` set is sent once that leg was placed, e.g. a stop loss only after the sell it protects,
+        # and is not sent at all when that leg failed.
+        result = BasketResult()
+        if not legs:
+            return result
+
+        def place(leg: BasketLeg):
+            try:
+                return leg.place(), None
+            except Exception as e:
+                return None, e
+            finally:
+                leg.completed_at = time.monotonic()
+
+        def place_all(batch: Dict[Hashable, BasketLeg]):
+            if not batch:
+                return
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batch))) as executor:
+                futures = {key: executor.submit(place, leg) for key, leg in batch.items()}
+                for key, future in futures.items():
+                    order, error = future.result()
+                    if error is None:
+                        result.orders[key] = order
+                    else:
+                        logging.error(f"Basket leg {key} failed: {error}")
+                        result.errors[key] = error
+
+        independent = {key: leg for key, leg in legs.items() if leg.after is None}
+        place_all(independent)
+        dependent = {}
+        for key, leg in legs.items():
+            if leg.after is None:
+                continue
+            if leg.after in result.orders:
+                dependent[key] = leg
+            else:
+                logging.error(f"Basket leg {key} not placed, {leg.after} failed")
+                result.errors[key] = RuntimeError(f"Not placed, {leg.after} failed")
+        place_all(dependent)
+        completed = [leg.completed_at for leg in independent.values()]
+        result.skew = max(completed) - min(completed) if completed else 0.0
+        logging.info(
+            f"Placed basket of {len(legs)} legs with {len(result.errors)} errors, skew {result.skew * 1000:.1f} ms"
+        )
+        return result
+
+
+class BasketLeg:
+    def __init__(
+        self,
+        product: Product,
+        transaction_type: str,
+        quantity: int,
+        price=None,
+        trigger_price=None,
+        trace=None,
+        after: Optional[Hashable] = None,
+    ):
+        self.product = product
+        self.transaction_type = transaction_type
+        self.quantity = quantity
+        self.price = price
+        self.trigger_price = trigger_price
+        self.trace = trace
+        # Key of the basket leg that must be placed before this one
+        self.after = after
+        self.completed_at = None  # type: Optional[float]
+
+    def place(self) -> Union[Order, TestOrder]:
+        return self.product._get_or_place_order(
+            transaction_type=self.transaction_type,
+            quantity=self.quantity,
+            price=self.price,
+            trigger_price=self.trigger_price,
+            trace=self.trace,
         )
 
 
+class BasketResult:
+    def __init__(self):
+        self.orders = {}  # type: Dict[Hashable, Union[Order, TestOrder]]
+        self.errors = {}  # type: Dict[Hashable, Exception]
+        # Seconds between the first and the last independent leg returning
+        self.skew = 0.0
+
+
 class Stock(Product):
-    def __init__(self, kite_instance: KiteConnect, trading_symbol):
-        super().__init__(kite_instance, trading_symbol)
+    def __init__(
+        self, kite_instance: KiteConnect, trading_symbol, order_book: Optional[OrderBook] = None, order_cache=cache
+    ):
+        super().__init__(kite_instance, trading_symbol, order_book, order_cache)
         self.exchange = KiteConnect.EXCHANGE_NSE
         self.variety = KiteConnect.VARIETY_REGULAR
         self._product = KiteConnect.PRODUCT_CNC
@@ -85,8 +217,10 @@ class Stock(Product):
 
 
 class Option(Product):
-    def __init__(self, kite_instance: KiteConnect, trading_symbol):
-        super().__init__(kite_instance, trading_symbol)
+    def __init__(
+        self, kite_instance: KiteConnect, trading_symbol, order_book: Optional[OrderBook] = None, order_cache=cache
+    ):
+        super().__init__(kite_instance, trading_symbol, order_book, order_cache)
         self.exchange = KiteConnect.EXCHANGE_NFO
         self.variety = KiteConnect.VARIETY_REGULAR
         self._product = KiteConnect.PRODUCT_MIS
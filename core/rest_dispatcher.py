@@ -0,0 +1,238 @@
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from kiteconnect import KiteConnect
+
+# Priority classes, lower goes first
+EXIT = 0
+ENTRY = 1
+MODIFY = 2
+STATUS = 3
+PRIORITY_NAMES = ("exit", "entry", "modify", "status")
+
+# Broker quotas as (requests, per seconds). Order placement, modification and cancellation share one
+# quota, every other endpoint has its own.
+ORDER_LIMITS = ((10, 1.0), (200, 60.0))
+DEFAULT_LIMITS = ((10, 1.0),)
+ORDER_METHODS = ("place_order", "modify_order", "cancel_order")
+DISPATCHED_METHODS = ORDER_METHODS + ("order_history", "orders")
+
+
+def request_priority(method: str, params: Dict) -> int:
+    # Cancels and modifies to a market order close positions, trailing modifies can wait for them
+    if method == "cancel_order":
+        return EXIT
+    if method == "modify_order":
+        return EXIT if params.get("order_type") == KiteConnect.ORDER_TYPE_MARKET else MODIFY
+    if method == "place_order":
+        return ENTRY
+    return STATUS
+
+
+def merge_modify(queued: Dict, params: Dict):
+    # Latest values win, but a modify to a market order is never turned back into a limit or stop order by
+    # a later one, and a market order carries no price or trigger price
+    market = KiteConnect.ORDER_TYPE_MARKET
+    updates = {key: value for key, value in params.items() if value is not None}
+    if queued.get("order_type") == market:
+        for key in ("order_type", "price", "trigger_price"):
+            updates.pop(key, None)
+    queued.update(updates)
+    if queued.get("order_type") == market:
+        queued["price"] = queued["trigger_price"] = None
+
+
+class TokenBucket:
+    # Allows `rate` requests every `per` seconds, bursting up to `rate` requests at once
+    def __init__(self, rate: int, per: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(rate)
+        self.fill_rate = rate / per
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def delay(self, now: float) -> float:
+        # Seconds until a token is available, 0 when one is available now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.fill_rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Request:
+    def __init__(self, method: str, params: Dict, priority: int, seq: int, buckets: List[TokenBucket], now: float):
+        self.method = method
+        self.params = params
+        self.priority = priority
+        self.seq = seq
+        self.buckets = buckets
+        self.submitted = now
+        # Set the first time the rate limit held the request back
+        self.limited_at = None  # type: Optional[float]
+        # Callers of every modify merged into this one
+        self.futures = []  # type: List[Future]
+
+
+class RequestDispatcher:
+    # Sends the order and status REST calls of a KiteConnect instance from a few worker threads, in
+    # priority order and within the broker quotas. It can be passed wherever a KiteConnect is expected:
+    # the dispatched methods block until their request is sent, everything else goes straight through.
+    # A modify of an order that still has a modify queued is merged into the queued one, the latest
+    # values win unless that would turn a market modify back into a priced one, and both callers get its
+    # result.
+    def __init__(
+        self,
+        kite_instance: KiteConnect,
+        workers: int = 6,
+        order_limits: Sequence[Tuple[int, float]] = ORDER_LIMITS,
+        default_limits: Sequence[Tuple[int, float]] = DEFAULT_LIMITS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.kite_instance = kite_instance
+        self.clock = clock
+        self._order_buckets = [TokenBucket(rate, per, clock) for rate, per in order_limits]
+        self._default_buckets = [TokenBucket(rate, per, clock) for rate, per in default_limits]
+        self._queue = []  # type: List[_Request]
+        # Queued modifies by order id, merged into while they wait
+        self._modifies = {}  # type: Dict[str, _Request]
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.max_depth = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.throttle_wait = 0.0
+        self.dispatched = [0] * len(PRIORITY_NAMES)
+        self.queue_wait = [0.0] * len(PRIORITY_NAMES)
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __getattr__(self, name):
+        return getattr(self.kite_instance, name)
+
+    def submit(self, method: str, priority: Optional[int] = None, **params) -> Future:
+        # Queue a request and return a future of its result without waiting for it
+        future = Future()
+        priority = request_priority(method, params) if priority is None else priority
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Request dispatcher is closed")
+            order_id = str(params.get("order_id")) if method == "modify_order" else None
+            queued = self._modifies.get(order_id) if order_id is not None else None
+            if queued is not None:
+                merge_modify(queued.params, params)
+                queued.priority = min(queued.priority, priority)
+                queued.futures.append(future)
+                self.coalesced += 1
+                return future
+            buckets = self._order_buckets if method in ORDER_METHODS else self._default_buckets
+            request = _Request(method, params, priority, next(self._seq), buckets, self.clock())
+            request.futures.append(future)
+            self._queue.append(request)
+            if order_id is not None:
+                self._modifies[order_id] = request
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._condition.notify()
+        return future
+
+    def place_order(self, **params):
+        return self.submit("place_order", **params).result()
+
+    def modify_order(self, **params):
+        return self.submit("modify_order", **params).result()
+
+    def cancel_order(self, **params):
+        return self.submit("cancel_order", **params).result()
+
+    def order_history(self, **params):
+        return self.submit("order_history", **params).result()
+
+    def orders(self):
+        return self.submit("orders").result()
+
+    def _next_request(self) -> Tuple[Optional[_Request], Optional[float]]:
+        # Highest priority request whose quota has room, otherwise the seconds until one may have
+        now = self.clock()
+        wait = None
+        for request in sorted(self._queue, key=lambda queued: (queued.priority, queued.seq)):
+            delay = max(bucket.delay(now) for bucket in request.buckets)
+            if delay == 0:
+                for bucket in request.buckets:
+                    bucket.take()
+                self._queue.remove(request)
+                if request.method == "modify_order":
+                    self._modifies.pop(str(request.params.get("order_id")), None)
+                with self._stats_lock:
+                    self.dispatched[request.priority] += 1
+                    self.queue_wait[request.priority] += now - request.submitted
+                    if request.limited_at is not None:
+                        self.throttle_wait += now - request.limited_at
+                return request, None
+            if request.limited_at is None:
+                request.limited_at = now
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                request, wait = self._next_request()
+                while request is None:
+                    if self._closed and not self._queue:
+                        return
+                    self._condition.wait(wait)
+                    request, wait = self._next_request()
+            try:
+                result = getattr(self.kite_instance, request.method)(**request.params)
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                for future in request.futures:
+                    future.set_exception(e)
+            else:
+                for future in request.futures:
+                    future.set_result(result)
+
+    def close(self, timeout: Optional[float] = None):
+        # Send what is still queued, then stop the workers
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            depth = {name: 0 for name in PRIORITY_NAMES}
+            for request in self._queue:
+                depth[PRIORITY_NAMES[request.priority]] += 1
+        with self._stats_lock:
+            return {
+                "depth": depth,
+                "max_depth": self.max_depth,
+                "dispatched": dict(zip(PRIORITY_NAMES, self.dispatched)),
+                "queue_wait": dict(zip(PRIORITY_NAMES, self.queue_wait)),
+                "throttle_wait": self.throttle_wait,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+            }
+
+    def report(self):
+        stats = self.stats()
+        logging.info(
+            f"REST dispatcher: dispatched {stats['dispatched']}, {stats['coalesced']} modifies coalesced, "
+            f"queue depth {sum(stats['depth'].values())} (max {stats['max_depth']}), "
+            f"{stats['throttle_wait']:.3f}s held by the rate limit, {stats['errors']} errors"
+        )
@@ -1,9 +1,10 @@
 import logging
+import time
 from datetime import datetime
-from typing import List, Dict, Iterable, Tuple, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from kiteconnect import KiteConnect
-from option_chain_stream import OptionChain
+from option_chain_stream import MarketDataHub, OptionChain
 
 from constants import (
     STOP_LOSS,
@@ -16,9 +17,25 @@ from constants import (
     EXPIRY_DATE_STRING,
     TARGET,
     ADD_TARGETS,
+    ENTRY_DELTA,
+    MAX_SNAPSHOT_AGE,
+    SYNTHETIC_STOPS,
+    SYNTHETIC_STOPS_FILE,
+    SYNTHETIC_STOP_SLIPPAGE,
+    ATM_WINDOW,
+    ATM_WINDOW_MODE,
 )
+from chain_index import ChainIndex
 from order import Order
-from product import Option
+from order_book import OrderBook
+from product import BasketLeg, Option, cache
+# TARGET of the engine is the trigger kind, constants.TARGET is the target percent
+from synthetic_stops import STOP, TARGET as TARGET_TRIGGER, SyntheticStopEngine
+
+# Order statuses after which the filled quantity no longer changes
+TERMINAL_STATUSES = ("COMPLETE", "CANCELLED", "REJECTED")
+# Seconds an entry sell being unwound is given to fill, and then to cancel, before it is read as it is
+UNWIND_SETTLE_TIMEOUT = 5.0
 
 
 class StraddleStrategy:
@@ -28,21 +45,91 @@ class StraddleStrategy:
         instrument_symbol: str,
         expiry_date: str,
         access_token: str,
+        stream: Optional[Iterable] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        order_book: Optional[OrderBook] = None,
+        contract_index=None,
+        underlying_symbol: str = INSTRUMENT_SYMBOL_NAME,
+        order_cache=cache,
+        stop_loss: float = STOP_LOSS,
+        stop_loss_trailing_trigger: float = STOP_LOSS_TRAILING_TRIGGER,
+        target: float = TARGET,
+        add_targets: bool = ADD_TARGETS,
+        entry_delta: Optional[float] = ENTRY_DELTA,
+        market_data: Optional[MarketDataHub] = None,
+        max_snapshot_age: Optional[float] = MAX_SNAPSHOT_AGE,
+        synthetic_stops: bool = SYNTHETIC_STOPS,
     ):
         self.n_lots = 1
+        # Percentages, defaulting to the constants so sweeps can try alternatives
+        self.stop_loss = stop_loss
+        self.stop_loss_trailing_trigger = stop_loss_trailing_trigger
+        self.target = target
+        # Targets are only placed when set, `target` has no effect otherwise
+        self.add_targets = add_targets
+        # Sell the call and put closest to this absolute delta instead of the strike nearest to spot
+        self.entry_delta = entry_delta
         self.kite_instance = kite_instance
         self.instrument_symbol = instrument_symbol
-        option_chain = OptionChain(
-            symbol=instrument_symbol,
-            expiry=expiry_date,
-            api_key=API_KEY,
-            api_secret=API_SECRET,
-            access_token=access_token,
-            underlying=True,
-        )
-        if datetime.now() < ENTRY_TIME:
-            option_chain.sync_instruments()
-        self.stream = option_chain.create_option_chain()
+        self.underlying_symbol = underlying_symbol
+        # Replays inject their own snapshot stream, clock and broker instead of the live feed
+        self.clock = clock
+        self.order_cache = order_cache
+        # Live feeds conflate snapshots while the strategy is busy and report how old each one is
+        self.max_snapshot_age = max_snapshot_age
+        self._snapshot_age = lambda: None  # type: Callable[[], Optional[float]]
+        # Stops and targets checked on every tick in process, replays feed it ticks and keep no state file
+        self.stop_engine = None  # type: Optional[SyntheticStopEngine]
+        if synthetic_stops:
+            self.stop_engine = SyntheticStopEngine(
+                self._option,
+                lambda order_id: Order(self.kite_instance, order_id, self.order_book),
+                state_file=SYNTHETIC_STOPS_FILE if stream is None else None,
+                limit_slippage=SYNTHETIC_STOP_SLIPPAGE,
+            )
+        # Live feed told which legs are held so it streams them in FULL mode, see OptionChain.hold_legs
+        self._feed = None  # type: Optional[Union[OptionChain, MarketDataHub]]
+        if stream is None and market_data is not None:
+            # Shared feed, the hub must be started after every strategy has subscribed
+            subscription = market_data.subscribe(
+                instrument_symbol,
+                expiry_date,
+                underlying=True,
+                name=f"{instrument_symbol}-{id(self):x}",
+                conflate=True,
+                ticks=synthetic_stops,
+            )
+            self.contract_index = market_data.instrumentClass.contract_index
+            self.order_book = OrderBook(kite_instance, updates=subscription.order_updates)
+            self.stream = subscription
+            self._feed = market_data
+            self._snapshot_age = lambda: subscription.age
+            if self.stop_engine is not None:
+                self.stop_engine.listen(subscription.ticks)
+        elif stream is None:
+            option_chain = OptionChain(
+                symbol=instrument_symbol,
+                expiry=expiry_date,
+                api_key=API_KEY,
+                api_secret=API_SECRET,
+                access_token=access_token,
+                underlying=True,
+                atm_window=ATM_WINDOW,
+                window_mode=ATM_WINDOW_MODE,
+            )
+            if self.clock().time() < ENTRY_TIME:
+                option_chain.sync_instruments()
+            self.contract_index = option_chain.instrumentClass.contract_index
+            self.order_book = OrderBook(kite_instance, updates=option_chain.order_updates)
+            if self.stop_engine is not None:
+                self.stop_engine.listen(option_chain.tap_ticks())
+            self.stream = option_chain.create_option_chain(transport="latest")
+            self._feed = option_chain
+            self._snapshot_age = lambda: option_chain.snapshot_age
+        else:
+            self.contract_index = contract_index
+            self.order_book = order_book
+            self.stream = stream
         self._option_orders = {"CE": None, "PE": None}  # type: Dict[str, Optional[Order]]
         self._stop_loss_orders = {"CE": None, "PE": None}  # type: Dict[str, Optional[Order]]
         self._target_orders = {"CE": None, "PE": None}  # type: Dict[str, Optional[Order]]
@@ -50,44 +137,56 @@ class StraddleStrategy:
         self._targets = {"PE": 0.0, "CE": 0.0}
         self._put_profit = 0
         self._call_profit = 0
-        self.token_list = None
+        self.chain_index = None  # type: Optional[ChainIndex]
 
     @property
     def profit(self):
         return (self._call_profit + self._put_profit) * self.n_lots * MINIMUM_QUANTITY
 
-    def get_token_dictionary(self, option_chain: List[Dict]) -> Iterable[Dict]:
-        processed_token_list = []
-        for option in option_chain:
-            token = option["symbol"]
-            if token != INSTRUMENT_SYMBOL_NAME:
-                processed_token_list.append(
-                    {
-                        "symbol": token,
-                        "strike_price": token.split(EXPIRY_DATE_STRING)[-1][:-2],
-                        "instrument_type": "PUT" if token[-2:] == "PE" else "CALL",
-                    }
-                )
-        return processed_token_list
+    def _option(self, trading_symbol: str) -> Option:
+        return Option(self.kite_instance, trading_symbol, self.order_book, self.order_cache)
+
+    def get_token_dictionary(self, option_chain: List[Dict]) -> ChainIndex:
+        # Contracts do not change during the session, so the index is built only once
+        if self.chain_index is None:
+            self.chain_index = ChainIndex(
+                option_chain, self.underlying_symbol, EXPIRY_DATE_STRING, contract_index=self.contract_index
+            )
+        return self.chain_index
 
     def get_current_price(self, symbol: str, option_chain: List[Dict]) -> float:
-        return next(filter(lambda instrument: instrument["symbol"] == symbol, option_chain))['last_price']
+        return self.get_token_dictionary(option_chain).get_price(symbol, option_chain)
 
     def find_nearest_options(self, price: float, option_chain: List[Dict]) -> Tuple[Dict, Dict]:
-        sorted_token_list = sorted(self.token_list, key=lambda token: abs(float(token["strike_price"]) - price))
-        nearest_call_option = next(
-            filter(
-                lambda instrument: instrument["symbol"] == sorted_token_list[1]["symbol"][:-2] + "CE",
-                option_chain,
-            )
-        )
-        nearest_put_option = next(
-            filter(
-                lambda instrument: instrument["symbol"] == sorted_token_list[1]["symbol"][:-2] + "PE",
-                option_chain,
-            )
-        )
-        return nearest_call_option, nearest_put_option
+        chain_index = self.get_token_dictionary(option_chain)
+        if self.entry_delta is not None:
+            call_symbol, put_symbol = chain_index.delta_symbols(self.entry_delta, option_chain)
+        else:
+            call_symbol, put_symbol = chain_index.nearest_symbols(price)
+        return chain_index.get_option(call_symbol, option_chain), chain_index.get_option(put_symbol, option_chain)
+
+    def is_stale(self) -> bool:
+        # Acting on an old snapshot would place orders at prices the market has already left
+        if self.max_snapshot_age is None:
+            return False
+        age = self._snapshot_age()
+        if age is None or age <= self.max_snapshot_age:
+            return False
+        logging.warning(f"Skipping snapshot {age:.2f}s old, older than {self.max_snapshot_age}s")
+        return True
+
+    def _hold_legs(self, instrument_types: Iterable[str], held: bool = True):
+        if self._feed is None:
+            return
+        symbols = [
+            self._option_orders[instrument_type].tradingsymbol
+            for instrument_type in instrument_types
+            if self._option_orders[instrument_type] is not None
+        ]
+        if held:
+            self._feed.hold_legs(symbols)
+        else:
+            self._feed.release_legs(symbols)
 
     def exit_trades(self):
         print("Exiting trades", self._stop_loss_orders["CE"], self._stop_loss_orders["PE"])
@@ -99,65 +198,178 @@ class StraddleStrategy:
             self._stop_loss_orders["PE"].modify(order_type=KiteConnect.ORDER_TYPE_MARKET)
         if self._target_orders["PE"]:
             self._target_orders["PE"].cancel()
+        self._hold_legs(("CE", "PE"), held=False)
 
     def monitor_triggers(self, option_chain: List[Dict]):
         # This condition occurs when both call and put orders are pending
         # Here we will check if any stop loss has hit and mark the respective order as None
-        current_call_option_premium = self.get_current_price(self._option_orders["CE"].tradingsymbol, option_chain)
-        current_put_option_premium = self.get_current_price(self._option_orders["PE"].tradingsymbol, option_chain)
-        print(
-            f"{current_put_option_premium}-{self._stop_losses['PE']}-{current_call_option_premium}-{self._stop_losses['CE']}"
-        )
+        # A leg stopped out is released from the strike window and may be missing from the snapshot, so only
+        # the legs still open are priced
+        premiums = {
+            instrument_type: self.get_current_price(self._option_orders[instrument_type].tradingsymbol, option_chain)
+            for instrument_type in ("CE", "PE")
+            if self._stop_loss_orders[instrument_type]
+        }
+        print(f"{premiums.get('PE')}-{self._stop_losses['PE']}-{premiums.get('CE')}-{self._stop_losses['CE']}")
         if self._stop_loss_orders["PE"] and self._stop_loss_orders["PE"].get_status() == 'COMPLETE':
             logging.info("Stop loss hit for PUT")
             self._stop_loss_orders["PE"] = None
+            self._hold_legs(("PE",), held=False)
             if self._target_orders["PE"]:
                 self._target_orders["PE"].cancel()
         elif self._stop_loss_orders["CE"] and self._stop_loss_orders["CE"].get_status() == 'COMPLETE':
             logging.info("Stop loss hit for CALL")
             self._stop_loss_orders["CE"] = None
+            self._hold_legs(("CE",), held=False)
             if self._target_orders["PE"]:
                 self._target_orders["PE"].cancel()
 
+    def monitor_synthetic_stops(self, option_chain: List[Dict]):
+        self.monitor_triggers(option_chain)
+        # Once one leg is stopped out, the stop of the other leg trails its premium on every tick
+        # instead of being modified on snapshots
+        if (self._stop_loss_orders["CE"] is None) != (self._stop_loss_orders["PE"] is None):
+            instrument_type = "CE" if self._stop_loss_orders["CE"] else "PE"
+            self._stop_loss_orders[instrument_type].trail(self.stop_loss)
+
     def entry(self, option_chain):
         n_lots = self.n_lots
-        self.token_list = self.get_token_dictionary(option_chain)
+        self.get_token_dictionary(option_chain)
         # Ideally this should occur only once at the start of the day
-        underlying_stock_price = self.get_current_price(INSTRUMENT_SYMBOL_NAME, option_chain)
+        underlying_stock_price = self.get_current_price(self.underlying_symbol, option_chain)
         nearest_call_option, nearest_put_option = self.find_nearest_options(underlying_stock_price, option_chain)
-        self._option_orders["CE"] = Option(self.kite_instance, nearest_call_option["symbol"]).sell(
-            n_lots * MINIMUM_QUANTITY
-        )
-        self._option_orders["PE"] = Option(self.kite_instance, nearest_put_option["symbol"]).sell(
-            n_lots * MINIMUM_QUANTITY
-        )
-        # Keep stop loss orders
-        self._stop_loss_orders["CE"] = Option(self.kite_instance, nearest_call_option["symbol"]).buy(
-            n_lots * MINIMUM_QUANTITY, price=self._stop_losses["CE"] + 2, trigger_price=self._stop_losses["CE"]
-        )
-        self._stop_loss_orders["PE"] = Option(self.kite_instance, nearest_put_option["symbol"]).buy(
-            n_lots * MINIMUM_QUANTITY, price=self._stop_losses["PE"] + 2, trigger_price=self._stop_losses["PE"]
-        )
-        if ADD_TARGETS:
-            self._targets["CE"] = round(0.05 * int(nearest_call_option["last_price"] * (1 - TARGET / 100) / 0.05), 2)
-            self._targets["PE"] = round(0.05 * int(nearest_put_option["last_price"] * (1 - TARGET / 100) / 0.05), 2)
+        quantity = n_lots * MINIMUM_QUANTITY
+        stop_loss_factor = 1 + self.stop_loss / 100
+        self._stop_losses["CE"] = round(0.05 * int(nearest_call_option["last_price"] * stop_loss_factor / 0.05), 2)
+        self._stop_losses["PE"] = round(0.05 * int(nearest_put_option["last_price"] * stop_loss_factor / 0.05), 2)
+        call_option = self._option(nearest_call_option["symbol"])
+        put_option = self._option(nearest_put_option["symbol"])
+        legs = {
+            ("option", "CE"): BasketLeg(call_option, KiteConnect.TRANSACTION_TYPE_SELL, quantity),
+            ("option", "PE"): BasketLeg(put_option, KiteConnect.TRANSACTION_TYPE_SELL, quantity),
+            # Keep stop loss orders
+            ("stop_loss", "CE"): BasketLeg(
+                call_option,
+                KiteConnect.TRANSACTION_TYPE_BUY,
+                quantity,
+                price=self._stop_losses["CE"] + 2,
+                trigger_price=self._stop_losses["CE"],
+                after=("option", "CE"),
+            ),
+            ("stop_loss", "PE"): BasketLeg(
+                put_option,
+                KiteConnect.TRANSACTION_TYPE_BUY,
+                quantity,
+                price=self._stop_losses["PE"] + 2,
+                trigger_price=self._stop_losses["PE"],
+                after=("option", "PE"),
+            ),
+        }
+        if self.add_targets:
+            target_factor = 1 - self.target / 100
+            self._targets["CE"] = round(0.05 * int(nearest_call_option["last_price"] * target_factor / 0.05), 2)
+            self._targets["PE"] = round(0.05 * int(nearest_put_option["last_price"] * target_factor / 0.05), 2)
             # Keep target orders
-            self._target_orders["CE"] = Option(self.kite_instance, nearest_call_option["symbol"]).buy(
-                n_lots * MINIMUM_QUANTITY,
+            legs[("target", "CE")] = BasketLeg(
+                call_option,
+                KiteConnect.TRANSACTION_TYPE_BUY,
+                quantity,
                 price=self._targets["CE"] + 2,
                 trigger_price=self._targets["CE"],
+                after=("option", "CE"),
             )
-            self._target_orders["PE"] = Option(self.kite_instance, nearest_put_option["symbol"]).buy(
-                n_lots * MINIMUM_QUANTITY,
+            legs[("target", "PE")] = BasketLeg(
+                put_option,
+                KiteConnect.TRANSACTION_TYPE_BUY,
+                quantity,
                 price=self._targets["PE"] + 2,
                 trigger_price=self._targets["PE"],
+                after=("option", "PE"),
+            )
+        if self.stop_engine is not None:
+            # Stops and targets are kept in process once the legs are sold, see arm_synthetic_stops
+            legs = {key: leg for key, leg in legs.items() if key[0] == "option"}
+        # Snapshots carry a latency trace only while tracing is enabled
+        trace = getattr(option_chain, "trace", None)
+        if trace is not None:
+            trace.mark("decision")
+            for leg in legs.values():
+                leg.trace = trace
+        basket = Option.place_basket(legs)
+        if basket.errors:
+            # A straddle with a missing sell or stop loss is not traded, the legs that went through are undone
+            logging.error(f"Entry failed for {sorted(basket.errors)}, unwinding {sorted(basket.orders)}")
+            self.unwind_entry(basket, quantity)
+            return False
+        orders = {"option": self._option_orders, "stop_loss": self._stop_loss_orders, "target": self._target_orders}
+        for (kind, instrument_type), order in basket.orders.items():
+            orders[kind][instrument_type] = order
+        self._hold_legs(("CE", "PE"))
+        if self.stop_engine is not None:
+            self.arm_synthetic_stops(quantity)
+        return True
+
+    def unwind_entry(self, basket, quantity: int):
+        # Stops and targets are cancelled first so that none of them fires while the sells are bought back
+        placed = sorted(basket.orders.items(), key=lambda item: item[0][0] == "option")
+        for (kind, instrument_type), order in placed:
+            try:
+                if kind != "option":
+                    order.cancel()
+                    continue
+                # The order book may not have seen the fill yet, so the sell is read from the broker. What is
+                # still open once it had time to fill is cancelled, and exactly what filled is bought back
+                order_data = self._settle(order)
+                if order_data["status"] not in TERMINAL_STATUSES:
+                    order.cancel()
+                    order_data = self._settle(order)
+                if order_data["status"] not in TERMINAL_STATUSES:
+                    logging.error(
+                        f"Unwinding {kind} {instrument_type}: order {order.order_id} still {order_data['status']}"
+                    )
+                filled = order_data.get("filled_quantity")
+                if filled is None:
+                    filled = quantity if order_data["status"] == "COMPLETE" else 0
+                if filled:
+                    self._option(order.tradingsymbol).buy(filled)
+            except Exception as e:
+                logging.error(f"Unwinding {kind} {instrument_type} failed: {e}")
+
+    def _settle(self, order) -> Dict:
+        # Latest broker state of an order, polled until it is terminal or UNWIND_SETTLE_TIMEOUT seconds pass
+        deadline = time.monotonic() + UNWIND_SETTLE_TIMEOUT
+        while True:
+            order_data = self.kite_instance.order_history(order_id=order.order_id)[-1]
+            if order_data["status"] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return order_data
+            time.sleep(0.2)
+
+    def arm_synthetic_stops(self, quantity: int):
+        # Stops and targets of the legs sold stay in process and send an order only once crossed
+        for instrument_type, option_order in self._option_orders.items():
+            if option_order is None:
+                continue
+            self._stop_loss_orders[instrument_type] = self.stop_engine.arm(
+                option_order.tradingsymbol,
+                STOP,
+                KiteConnect.TRANSACTION_TYPE_BUY,
+                quantity,
+                self._stop_losses[instrument_type],
             )
+            if self.add_targets:
+                self._target_orders[instrument_type] = self.stop_engine.arm(
+                    option_order.tradingsymbol,
+                    TARGET_TRIGGER,
+                    KiteConnect.TRANSACTION_TYPE_BUY,
+                    quantity,
+                    self._targets[instrument_type],
+                )
 
     def execute(self, entry_time: datetime, exit_time: datetime, n_lots: int = 1):
         self.n_lots = n_lots
         started = False
         for idx, option_chain in enumerate(self.stream):
-            current_time = datetime.now()
+            current_time = self.clock()
             if current_time < entry_time:
                 print("Waiting for entry time!!")
                 continue
@@ -167,9 +379,15 @@ class StraddleStrategy:
                 print("Time to exit the trade")
                 self.exit_trades()
                 return
+            if self.is_stale():
+                continue
             started = True
             if self._option_orders["CE"] is None and self._option_orders["PE"] is None:
-                self.entry(option_chain)
+                if not self.entry(option_chain):
+                    print("Entry failed, not trading")
+                    return
+            elif self.stop_engine is not None:
+                self.monitor_synthetic_stops(option_chain)
             else:
                 # This will occur when either call or put order hits the stop loss
                 # Here we try to decrease stop loss for every 10% fall
@@ -180,15 +398,16 @@ class StraddleStrategy:
                     option_premium = self.get_current_price(current_stop_loss_order.tradingsymbol, option_chain)
                     print(
                         option_premium,
-                        (current_stop_loss * (1 - STOP_LOSS_TRAILING_TRIGGER / 100)) / (1 + STOP_LOSS / 100),
+                        (current_stop_loss * (1 - self.stop_loss_trailing_trigger / 100)) / (1 + self.stop_loss / 100),
                     )
-                    if option_premium <= (current_stop_loss * (1 - STOP_LOSS_TRAILING_TRIGGER / 100)) / (
-                        1 + STOP_LOSS / 100
+                    if option_premium <= (current_stop_loss * (1 - self.stop_loss_trailing_trigger / 100)) / (
+                        1 + self.stop_loss / 100
                     ):
-                        # Reduce the stop loss order price
-                        new_stop_loss = option_premium * (1 + STOP_LOSS / 100)
+                        # Reduce the stop loss order price, trailing modifies are not waited for so that
+                        # consecutive ones merge while exits and entries go first
+                        new_stop_loss = option_premium * (1 + self.stop_loss / 100)
                         self._option_orders[instrument_type] = current_stop_loss_order.modify(
-                            price=new_stop_loss + 2, trigger_price=new_stop_loss
+                            price=new_stop_loss + 2, trigger_price=new_stop_loss, wait=False
                         )
                         self._stop_losses[instrument_type] = new_stop_loss
                     self.monitor_triggers(option_chain)
@@ -198,9 +417,9 @@ class StraddleStrategy:
                         instrument_type = "CE" if self._stop_loss_orders["CE"] else "PE"
                         current_stop_loss_order = self._stop_loss_orders[instrument_type]
                         option_premium = self.get_current_price(current_stop_loss_order.tradingsymbol, option_chain)
-                        new_stop_loss = option_premium * (1 + STOP_LOSS / 100)
+                        new_stop_loss = option_premium * (1 + self.stop_loss / 100)
                         self._option_orders[instrument_type] = current_stop_loss_order.modify(
-                            price=new_stop_loss + 2, trigger_price=new_stop_loss
+                            price=new_stop_loss + 2, trigger_price=new_stop_loss, wait=False
                         )
                         self._stop_losses[instrument_type] = new_stop_loss
 
@@ -0,0 +1,298 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from kiteconnect import KiteConnect
+
+from order import Order
+from product import Product
+from rest_dispatcher import EXIT
+
+STOP = "stop"
+TARGET = "target"
+ARMED = "ARMED"
+FIRED = "FIRED"
+CANCELLED = "CANCELLED"
+# Exchange price step of options
+TICK_SIZE = 0.05
+
+
+def round_to_tick(price: float) -> float:
+    return round(TICK_SIZE * round(price / TICK_SIZE), 2)
+
+
+class SyntheticOrder:
+    # A stop loss or target kept in process instead of resting at the exchange. It stands in for the
+    # Order it replaces: get_status, modify and cancel work the same, but only firing it sends a request.
+    # Once fired, status calls go to the order that was placed.
+    def __init__(
+        self,
+        engine: "SyntheticStopEngine",
+        tradingsymbol: str,
+        kind: str,
+        transaction_type: str,
+        quantity: int,
+        trigger_price: float,
+        trail_percent: Optional[float] = None,
+        status: str = ARMED,
+        order_id: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.tradingsymbol = tradingsymbol
+        self.kind = kind
+        self.transaction_type = transaction_type
+        self.quantity = quantity
+        self.trigger_price = trigger_price
+        # Percent the trigger follows the price by on every tick, None keeps it fixed
+        self.trail_percent = trail_percent
+        self.status = status
+        self.order_id = order_id
+        self._order = None  # type: Optional[Order]
+        # A buy stop (closing a short) and a sell target fire when the price rises through the trigger
+        self.fires_above = (kind == STOP) == (transaction_type == KiteConnect.TRANSACTION_TYPE_BUY)
+
+    def __str__(self):
+        return f"{self.tradingsymbol}-{self.kind}@{self.trigger_price}"
+
+    def crossed(self, price: float) -> bool:
+        return price >= self.trigger_price if self.fires_above else price <= self.trigger_price
+
+    def follow(self, price: float) -> bool:
+        # Move a trailing trigger towards the price, never away from it. True when the trigger moved.
+        if self.fires_above:
+            trigger_price = round_to_tick(price * (1 + self.trail_percent / 100))
+            moved = trigger_price < self.trigger_price
+        else:
+            trigger_price = round_to_tick(price * (1 - self.trail_percent / 100))
+            moved = trigger_price > self.trigger_price
+        if moved:
+            self.trigger_price = trigger_price
+        return moved
+
+    @property
+    def order(self) -> Optional[Order]:
+        if self._order is None and self.order_id is not None:
+            self._order = self.engine.order(self.order_id)
+        return self._order
+
+    def get_status(self) -> Optional[str]:
+        if self.status == FIRED:
+            return self.order.get_status()
+        return self.status
+
+    def modify(self, price: float = None, trigger_price: float = None, order_type: str = None, wait: bool = True):
+        # A market order type fires right away, like converting a resting SL order to MARKET
+        if order_type == KiteConnect.ORDER_TYPE_MARKET:
+            self.engine.fire(self)
+        elif trigger_price is not None:
+            self.engine.move(self, trigger_price)
+        return self
+
+    def trail(self, percent: Optional[float]):
+        self.engine.trail(self, percent)
+
+    def cancel(self):
+        self.engine.cancel(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "tradingsymbol": self.tradingsymbol,
+            "kind": self.kind,
+            "transaction_type": self.transaction_type,
+            "quantity": self.quantity,
+            "trigger_price": self.trigger_price,
+            "trail_percent": self.trail_percent,
+            "status": self.status,
+            "order_id": self.order_id,
+        }
+
+
+class SyntheticStopEngine:
+    # Checks armed stops and targets against every tick of the traded symbols and fires one market, or
+    # marketable limit, order when a trigger is crossed. A symbol has at most a stop and a target, so a
+    # tick costs a dict lookup and two comparisons. Firing one trigger of a symbol cancels the others
+    # of that symbol. Triggers are saved to `state_file` on every change and reloaded on restart for the
+    # same trading day; trailing moves are saved at most every `save_interval` seconds.
+    def __init__(
+        self,
+        product: Callable[[str], Product],
+        order: Callable[[str], Order],
+        state_file: Optional[str] = None,
+        limit_slippage: Optional[float] = None,
+        save_interval: float = 1.0,
+    ):
+        self.product = product
+        self.order = order
+        self.state_file = state_file
+        # Percent beyond the last price of a marketable limit order, None fires market orders
+        self.limit_slippage = limit_slippage
+        self.save_interval = save_interval
+        self.lock = threading.RLock()
+        self.triggers = {}  # type: Dict[Tuple[str, str], SyntheticOrder]
+        self._armed = {}  # type: Dict[str, List[SyntheticOrder]]
+        self.last_prices = {}  # type: Dict[str, float]
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+
+    def _load(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return
+        with open(self.state_file) as f:
+            state = json.load(f)
+        if state.get("date") != date.today().isoformat():
+            logging.info(f"Ignoring synthetic stops saved on {state.get('date')}")
+            return
+        for data in state["triggers"]:
+            self._add(SyntheticOrder(self, **data))
+        logging.info(f"Restored {len(self.triggers)} synthetic stops from {self.state_file}")
+
+    def save(self):
+        if self.state_file is None:
+            return
+        with self.lock:
+            state = {
+                "date": date.today().isoformat(),
+                "triggers": [trigger.to_dict() for trigger in self.triggers.values()],
+            }
+            # Replaced atomically so a crash never leaves a half written file
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def _add(self, trigger: SyntheticOrder):
+        self.triggers[(trigger.tradingsymbol, trigger.kind)] = trigger
+        if trigger.status == ARMED:
+            self._armed.setdefault(trigger.tradingsymbol, []).append(trigger)
+
+    def _disarm(self, trigger: SyntheticOrder, status: str):
+        trigger.status = status
+        armed = self._armed.get(trigger.tradingsymbol, [])
+        if trigger in armed:
+            armed.remove(trigger)
+        if not armed:
+            self._armed.pop(trigger.tradingsymbol, None)
+
+    def arm(
+        self,
+        tradingsymbol: str,
+        kind: str,
+        transaction_type: str,
+        quantity: int,
+        trigger_price: float,
+        trail_percent: Optional[float] = None,
+    ) -> SyntheticOrder:
+        # A trigger restored for the symbol is returned as it is, so a restarted strategy keeps its
+        # trailed level the same way Product reuses placed order ids
+        with self.lock:
+            trigger = self.triggers.get((tradingsymbol, kind))
+            if trigger is not None and trigger.status != CANCELLED:
+                return trigger
+            trigger = SyntheticOrder(
+                self, tradingsymbol, kind, transaction_type, quantity, trigger_price, trail_percent
+            )
+            self._add(trigger)
+        logging.info(f"Armed synthetic {kind} {tradingsymbol} {transaction_type} at {trigger_price}")
+        self.save()
+        return trigger
+
+    def move(self, trigger: SyntheticOrder, trigger_price: float):
+        with self.lock:
+            if trigger.status != ARMED:
+                return
+            trigger.trigger_price = round_to_tick(trigger_price)
+        self.save()
+
+    def trail(self, trigger: SyntheticOrder, percent: Optional[float]):
+        with self.lock:
+            if trigger.trail_percent == percent:
+                return
+            trigger.trail_percent = percent
+            if percent is not None and trigger.tradingsymbol in self.last_prices:
+                trigger.follow(self.last_prices[trigger.tradingsymbol])
+        self.save()
+
+    def cancel(self, trigger: SyntheticOrder):
+        with self.lock:
+            if trigger.status == FIRED:
+                trigger.order.cancel()
+                return
+            if trigger.status != ARMED:
+                return
+            self._disarm(trigger, CANCELLED)
+        logging.info(f"Cancelled synthetic {trigger}")
+        self.save()
+
+    def fire(self, trigger: SyntheticOrder, price: Optional[float] = None):
+        with self.lock:
+            if trigger.status != ARMED:
+                return
+            price = self.last_prices.get(trigger.tradingsymbol) if price is None else price
+            product = self.product(trigger.tradingsymbol)
+            limit_price = None
+            if self.limit_slippage is not None and price is not None:
+                slippage = self.limit_slippage / 100
+                is_buy = trigger.transaction_type == KiteConnect.TRANSACTION_TYPE_BUY
+                limit_price = round_to_tick(price * (1 + slippage if is_buy else 1 - slippage))
+            logging.info(f"Synthetic {trigger} crossed at {price}, sending order at {limit_price or 'market'}")
+            try:
+                if trigger.transaction_type == KiteConnect.TRANSACTION_TYPE_BUY:
+                    order = product.buy(trigger.quantity, price=limit_price, priority=EXIT)
+                else:
+                    order = product.sell(trigger.quantity, price=limit_price, priority=EXIT)
+            except Exception as e:
+                # The trigger and the others of the symbol stay armed, the next crossing tick sends it again
+                logging.error(f"Synthetic {trigger} order failed, still armed: {e}")
+                return
+            # The other triggers of the symbol close the same position
+            for other in list(self._armed.get(trigger.tradingsymbol, [])):
+                if other is not trigger:
+                    self._disarm(other, CANCELLED)
+            self._disarm(trigger, FIRED)
+            trigger._order = order
+            trigger.order_id = str(order.order_id)
+        self.save()
+
+    def _check(self, tradingsymbol: str, price: float):
+        self.last_prices[tradingsymbol] = price
+        armed = self._armed.get(tradingsymbol)
+        if not armed:
+            return
+        for trigger in armed:
+            if trigger.trail_percent is not None and trigger.follow(price):
+                self._dirty = True
+            if trigger.crossed(price):
+                self.fire(trigger, price)
+                break
+
+    def on_tick(self, tradingsymbol: str, price: float):
+        with self.lock:
+            self._check(tradingsymbol, price)
+        if self._dirty and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def on_ticks(self, ticks: Iterable[Tuple[str, float]]):
+        with self.lock:
+            for tradingsymbol, price in ticks:
+                self._check(tradingsymbol, price)
+        if self._dirty and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def listen(self, tick_tap):
+        # Consume (tradingsymbol, last_price) batches forwarded by the ticker from a daemon thread
+        def consume():
+            while True:
+                ticks = tick_tap.get()
+                try:
+                    self.on_ticks(ticks)
+                except Exception as e:
+                    logging.error(f"Synthetic stop check failed: {e}")
+
+        threading.Thread(target=consume, daemon=True).start()
@@ -4,8 +4,26 @@ from multiprocessing import set_start_method
 
 from kiteconnect import KiteConnect
 
-from constants import INSTRUMENT_SYMBOL, EXPIRY_DATE, ENTRY_TIME, EXIT_TIME, API_KEY, ACCESS_TOKEN, API_SECRET, LOTS
+from constants import (
+    INSTRUMENT_SYMBOL,
+    EXPIRY_DATE,
+    ENTRY_TIME,
+    EXIT_TIME,
+    API_KEY,
+    ACCESS_TOKEN,
+    API_SECRET,
+    LOTS,
+    LATENCY_METRICS_FILE,
+    LATENCY_METRICS_PORT,
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_UNIX_SOCKET,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_CONNECT_TIMEOUT,
+)
+from core.rest_dispatcher import RequestDispatcher
 from core.strategy import StraddleStrategy
+from option_chain_stream import configure_redis, enable_tracing
 
 logging.basicConfig(level=logging.INFO)
 
@@ -13,6 +31,22 @@ kite = KiteConnect(api_key=API_KEY)
 
 set_start_method("fork")
 
+configure_redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    unix_socket_path=REDIS_UNIX_SOCKET,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+)
+
+# Tracing must be enabled before the feed processes are forked
+if LATENCY_METRICS_FILE or LATENCY_METRICS_PORT:
+    tracer = enable_tracing()
+    if LATENCY_METRICS_FILE:
+        tracer.export_file(LATENCY_METRICS_FILE)
+    if LATENCY_METRICS_PORT:
+        tracer.serve(LATENCY_METRICS_PORT)
+
 
 def gen_access_token():
     if ACCESS_TOKEN:
@@ -33,6 +67,11 @@ entry_time = datetime.combine(date.today(), ENTRY_TIME)
 exit_time = datetime.combine(date.today(), EXIT_TIME)
 
 
+# Order and status calls go through one prioritised, rate limited queue
+dispatcher = RequestDispatcher(kite)
+
 StraddleStrategy(
-    kite_instance=kite, instrument_symbol=INSTRUMENT_SYMBOL, expiry_date=EXPIRY_DATE, access_token=access_token
+    kite_instance=dispatcher, instrument_symbol=INSTRUMENT_SYMBOL, expiry_date=EXPIRY_DATE, access_token=access_token
 ).execute(entry_time=entry_time, exit_time=exit_time, n_lots=LOTS)
+dispatcher.close()
+dispatcher.report()
@@ -3,5 +3,19 @@ Python client for streaming option chain using Kite connect Websocket
 """
 
 from option_chain import OptionChain
+from market_data_hub import MarketDataHub
+from latency import enable_tracing
+from redis_pool import configure as configure_redis, pool_stats
+from storage import InProcessStore, RedisBackend, SharedMemoryStore, StorageBackend
 
-__all__ = ["OptionChain"]
+__all__ = [
+    "OptionChain",
+    "MarketDataHub",
+    "StorageBackend",
+    "RedisBackend",
+    "InProcessStore",
+    "SharedMemoryStore",
+    "enable_tracing",
+    "configure_redis",
+    "pool_stats",
+]
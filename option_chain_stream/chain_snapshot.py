@@ -0,0 +1,282 @@
+"""
+Array backed option chain snapshot shared between processes
+through multiprocessing shared memory instead of pickling
+"""
+
+import time
+from multiprocessing import Condition
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+
+import numpy as np
+
+from latency import Trace
+
+# Per strike columns of each snapshot slot
+COLUMNS = ('ce_last_price', 'ce_volume', 'ce_change', 'pe_last_price', 'pe_volume', 'pe_change')
+UNDERLYING_COLUMNS = ('underlying_last_price', 'underlying_change')
+# Two slots are kept so that the reader can copy a slot while the next one is written
+N_SLOTS = 2
+# Published seq, publish time in monotonic nanoseconds, the snapshot trace
+# stamps in epoch nanoseconds, 0 for stages not reached or when tracing is off,
+# then the seqlock of every slot: 2 * seq of the snapshot it holds, odd while written
+TRACE_STAGES = ('tick', 'store', 'snapshot')
+SLOT_LOCKS = 2 + len(TRACE_STAGES)
+HEADER_SIZE = 8 * (SLOT_LOCKS + N_SLOTS)
+
+
+class ChainLayout:
+    """
+    Static layout of a chain, one row per strike with CE and PE side by side
+    """
+
+    def __init__(self, token_list, token_details):
+        """
+        Param token_list:(List of integer) - Tokens of the chain
+        Param token_details:(dict) - Contract detail for every token
+        """
+        self.underlying_tokens = []
+        self.underlying_symbols = []
+        options = {}
+        for token in token_list:
+            detail = token_details[token]
+            if detail['type'] == 'EQ':
+                self.underlying_tokens.append(token)
+                self.underlying_symbols.append(detail['symbol'])
+            elif detail['type'] in ('CE', 'PE'):
+                options.setdefault(float(detail['strike']), {})[detail['type']] = (token, detail['symbol'])
+        self.strikes = np.array(sorted(options), dtype=np.float64)
+        self.n_rows = len(self.strikes)
+        self.ce_tokens = [options[strike].get('CE', (0, None))[0] for strike in self.strikes]
+        self.ce_symbols = [options[strike].get('CE', (0, None))[1] for strike in self.strikes]
+        self.pe_tokens = [options[strike].get('PE', (0, None))[0] for strike in self.strikes]
+        self.pe_symbols = [options[strike].get('PE', (0, None))[1] for strike in self.strikes]
+        # token -> (column offset, row) used when filling a slot
+        self.token_position = {}
+        for row in range(self.n_rows):
+            if self.ce_tokens[row]:
+                self.token_position[self.ce_tokens[row]] = (0, row)
+            if self.pe_tokens[row]:
+                self.token_position[self.pe_tokens[row]] = (3, row)
+        for idx, token in enumerate(self.underlying_tokens):
+            self.token_position[token] = (None, idx)
+        # tradingsymbol -> (column offset, row) for direct price lookups
+        self.symbol_position = {}
+        for token, symbol in zip(self.ce_tokens + self.pe_tokens, self.ce_symbols + self.pe_symbols):
+            if token:
+                self.symbol_position[symbol] = self.token_position[token]
+        for token, symbol in zip(self.underlying_tokens, self.underlying_symbols):
+            self.symbol_position[symbol] = self.token_position[token]
+        self.slot_length = len(COLUMNS) * self.n_rows + len(UNDERLYING_COLUMNS) * len(self.underlying_tokens)
+
+    @property
+    def size(self):
+        return HEADER_SIZE + N_SLOTS * self.slot_length * np.dtype(np.float64).itemsize
+
+
+class ChainSnapshot:
+    """
+    Arrays of one snapshot of the shared chain
+    Iterating yields the same dicts as InstrumentMaster.generate_optionChain
+    so existing consumers keep working while they migrate to the arrays
+    """
+
+    def __init__(self, layout, slot, seq):
+        self.layout = layout
+        self.seq = seq
+        self.strikes = layout.strikes
+        # 'ce'/'pe' -> greek name -> array, set by ChainAnalytics
+        self.greeks = None
+        # Latency trace of the snapshot when tracing is enabled
+        self.trace = None
+        n_rows = layout.n_rows
+        for idx, column in enumerate(COLUMNS):
+            setattr(self, column, slot[idx * n_rows : (idx + 1) * n_rows])
+        n_underlying = len(layout.underlying_tokens)
+        offset = len(COLUMNS) * n_rows
+        for idx, column in enumerate(UNDERLYING_COLUMNS):
+            setattr(self, column, slot[offset + idx * n_underlying : offset + (idx + 1) * n_underlying])
+
+    @property
+    def underlying_price(self):
+        return float(self.underlying_last_price[0]) if len(self.underlying_last_price) else float('nan')
+
+    def last_price(self, symbol):
+        """
+        Last price of a contract or underlying by tradingsymbol
+        Param symbol:(string) - Tradingsymbol of the contract
+        """
+        column, row = self.layout.symbol_position[symbol]
+        if column is None:
+            return float(self.underlying_last_price[row])
+        return float(getattr(self, COLUMNS[column])[row])
+
+    def option(self, symbol):
+        """
+        Contract entry in the same form as iterating the snapshot yields
+        Param symbol:(string) - Tradingsymbol of the contract
+        """
+        column, row = self.layout.symbol_position[symbol]
+        if column is None:
+            return {
+                'token': self.layout.underlying_tokens[row],
+                'symbol': symbol,
+                'last_price': float(self.underlying_last_price[row]),
+                'change': float(self.underlying_change[row]),
+            }
+        if column == 0:
+            return self._option_dict(self.layout.ce_tokens[row], symbol, 'ce', row)
+        return self._option_dict(self.layout.pe_tokens[row], symbol, 'pe', row)
+
+    def copy(self):
+        """
+        Independent copy of the snapshot arrays and greeks
+        """
+        slot = np.concatenate([getattr(self, column) for column in COLUMNS + UNDERLYING_COLUMNS])
+        snapshot = ChainSnapshot(self.layout, slot, self.seq)
+        snapshot.trace = self.trace
+        if self.greeks is not None:
+            snapshot.greeks = {
+                side: {name: values.copy() for name, values in columns.items()} for side, columns in self.greeks.items()
+            }
+        return snapshot
+
+    def _option_dict(self, token, symbol, side, row):
+        last_price = getattr(self, side + '_last_price')[row]
+        if np.isnan(last_price):
+            return None
+        volume = getattr(self, side + '_volume')[row]
+        option = {
+            'token': token,
+            'symbol': symbol,
+            'last_price': float(last_price),
+            'volume': None if np.isnan(volume) else int(volume),
+            'change': float(getattr(self, side + '_change')[row]),
+        }
+        if self.greeks is not None:
+            option.update((name, float(values[row])) for name, values in self.greeks[side].items())
+        return option
+
+    def __iter__(self):
+        layout = self.layout
+        for idx, token in enumerate(layout.underlying_tokens):
+            if not np.isnan(self.underlying_last_price[idx]):
+                yield {
+                    'token': token,
+                    'symbol': layout.underlying_symbols[idx],
+                    'last_price': float(self.underlying_last_price[idx]),
+                    'change': float(self.underlying_change[idx]),
+                }
+        sides = (('ce', layout.ce_tokens, layout.ce_symbols), ('pe', layout.pe_tokens, layout.pe_symbols))
+        for row in range(layout.n_rows):
+            for side, tokens, symbols in sides:
+                if tokens[row]:
+                    option = self._option_dict(tokens[row], symbols[row], side, row)
+                    if option is not None:
+                        yield option
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class SharedChainChannel:
+    """
+    Single producer channel publishing the latest chain into shared memory
+    Exposes put/get like multiprocessing.Queue so it can replace WebsocketClient.q,
+    but get always returns the newest snapshot, copied out of its slot under the slot seqlock
+    so a writer lapping a slow consumer can never hand it a torn snapshot
+    Snapshots published while the consumer was busy are counted as dropped
+    """
+
+    def __init__(self, layout):
+        """
+        Must be created before the producer process is forked
+        Param layout:(ChainLayout) - Layout of the published chain
+        """
+        self.layout = layout
+        self.shm = SharedMemory(create=True, size=layout.size)
+        self.header = np.ndarray((SLOT_LOCKS + N_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        self.header[:] = 0
+        self.slots = np.ndarray(
+            (N_SLOTS, layout.slot_length), dtype=np.float64, buffer=self.shm.buf, offset=HEADER_SIZE
+        )
+        self.slots[:] = np.nan
+        self.condition = Condition()
+        self.delivered_seq = 0
+        # Consumer side accounting, see LatestValueChannel
+        self.dropped = 0
+        self.age = None
+
+    @property
+    def seq(self):
+        return int(self.header[0])
+
+    def put(self, option_chain):
+        """
+        Write a snapshot into the next slot and publish it
+        Param option_chain:(List of dict) - Snapshot from InstrumentMaster.generate_optionChain
+        """
+        layout = self.layout
+        seq = self.seq + 1
+        slot = self.slots[seq % N_SLOTS]
+        lock = SLOT_LOCKS + seq % N_SLOTS
+        # Odd while the slot is written, readers copying it meanwhile retry
+        self.header[lock] = 2 * seq - 1
+        slot[:] = np.nan
+        n_rows = layout.n_rows
+        underlying_offset = len(COLUMNS) * n_rows
+        n_underlying = len(layout.underlying_tokens)
+        for option in option_chain:
+            position = layout.token_position.get(option['token'])
+            if position is None:
+                continue
+            column, row = position
+            if column is None:
+                slot[underlying_offset + row] = option['last_price']
+                slot[underlying_offset + n_underlying + row] = option['change']
+                continue
+            slot[column * n_rows + row] = option['last_price']
+            volume = option.get('volume')
+            slot[(column + 1) * n_rows + row] = np.nan if volume is None else volume
+            slot[(column + 2) * n_rows + row] = option['change']
+        self.header[lock] = 2 * seq
+        trace = getattr(option_chain, 'trace', None)
+        with self.condition:
+            self.header[0] = seq
+            self.header[1] = time.monotonic_ns()
+            if trace is not None:
+                self.header[2:SLOT_LOCKS] = [int(trace.stamps.get(stage, 0) * 1e9) for stage in TRACE_STAGES]
+            self.condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """
+        Block until a snapshot newer than the last delivered one is published
+        Param block:(bool) - Wait for a snapshot, False raises queue.Empty right away when none is pending
+        Param timeout:(float) - Seconds to wait, None waits forever, raises queue.Empty when it runs out
+        """
+        while 1:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.seq > self.delivered_seq, timeout if block else 0):
+                    raise Empty
+                seq = self.seq
+                published = int(self.header[1])
+                stamps = self.header[2:SLOT_LOCKS].tolist()
+            lock = SLOT_LOCKS + seq % N_SLOTS
+            if int(self.header[lock]) != 2 * seq:
+                # The writer already moved on to this slot, take the newer snapshot
+                continue
+            slot = self.slots[seq % N_SLOTS].copy()
+            if int(self.header[lock]) == 2 * seq:
+                break
+        self.dropped += seq - self.delivered_seq - 1
+        self.age = (time.monotonic_ns() - published) / 1e9
+        self.delivered_seq = seq
+        snapshot = ChainSnapshot(self.layout, slot, seq)
+        if any(stamps):
+            snapshot.trace = Trace(**{stage: stamp / 1e9 for stage, stamp in zip(TRACE_STAGES, stamps) if stamp})
+        return snapshot
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -0,0 +1,169 @@
+"""
+Versioned binary records for the values kept in redis
+Tick data and contract metadata have fixed shapes, so they are packed
+into struct records instead of JSON. Anything else stays JSON, and
+values written as JSON before are still read
+"""
+
+import json
+import struct
+
+# First byte of every binary record. JSON text starts with whitespace or a printable
+# character, so bytes below 0x09 are free to mark binary record versions
+VERSION = 1
+MAX_VERSION = 0x08
+
+# Record kinds, second byte of every binary record
+OPTION = 1
+UNDERLYING = 2
+CONTRACT = 3
+CHAIN = 4
+
+# Dict layouts packed into records, in the key order the producers build them
+OPTION_KEYS = ('token', 'symbol', 'last_price', 'volume', 'change')
+UNDERLYING_KEYS = ('token', 'symbol', 'last_price', 'change')
+CONTRACT_KEYS = ('symbol', 'strike', 'type')
+CHAIN_KEYS = ('strike', 'type', 'expiry', 'token')
+
+# LTP mode ticks carry neither volume nor change, their None is stored as these values
+NULL_VOLUME = -1
+NULL_CHANGE = float('nan')
+
+# version, kind, token, last_price, volume, change, symbol length, then the symbol
+OPTION_RECORD = struct.Struct('<BBqdqdB')
+# version, kind, token, last_price, change, symbol length, then the symbol
+UNDERLYING_RECORD = struct.Struct('<BBqddB')
+# version, kind, strike, symbol length, type length, then the symbol and the type
+CONTRACT_RECORD = struct.Struct('<BBdBB')
+# version, kind, number of entries, number of distinct strings, then each string prefixed by its length
+CHAIN_HEADER = struct.Struct('<BBIB')
+# strike, token, type and expiry as positions in the string table
+CHAIN_ENTRY = struct.Struct('<dqBB')
+
+
+def _encode_chain(value):
+    # Types and expiries repeat across the chain, they are stored once in a string table
+    strings = {}
+    entries = []
+    for entry in value:
+        if type(entry) is not dict or tuple(entry) != CHAIN_KEYS:
+            return None
+        option_type = strings.setdefault(entry['type'], len(strings))
+        expiry = strings.setdefault(entry['expiry'], len(strings))
+        entries.append(CHAIN_ENTRY.pack(entry['strike'], entry['token'], option_type, expiry))
+    parts = [CHAIN_HEADER.pack(VERSION, CHAIN, len(value), len(strings))]
+    for string in strings:
+        encoded = string.encode()
+        parts.append(struct.pack('<B', len(encoded)) + encoded)
+    return b''.join(parts + entries)
+
+
+def encode(value):
+    """
+    Pack a value into a binary record when it has a known layout, JSON otherwise
+    Param value:(object) - JSON compatible value
+    """
+    try:
+        if type(value) is dict:
+            keys = tuple(value)
+            if keys == OPTION_KEYS:
+                symbol = value['symbol'].encode()
+                return (
+                    OPTION_RECORD.pack(
+                        VERSION,
+                        OPTION,
+                        value['token'],
+                        value['last_price'],
+                        NULL_VOLUME if value['volume'] is None else value['volume'],
+                        NULL_CHANGE if value['change'] is None else value['change'],
+                        len(symbol),
+                    )
+                    + symbol
+                )
+            if keys == UNDERLYING_KEYS:
+                symbol = value['symbol'].encode()
+                return (
+                    UNDERLYING_RECORD.pack(
+                        VERSION,
+                        UNDERLYING,
+                        value['token'],
+                        value['last_price'],
+                        NULL_CHANGE if value['change'] is None else value['change'],
+                        len(symbol),
+                    )
+                    + symbol
+                )
+            if keys == CONTRACT_KEYS:
+                symbol = value['symbol'].encode()
+                option_type = value['type'].encode()
+                return (
+                    CONTRACT_RECORD.pack(VERSION, CONTRACT, value['strike'], len(symbol), len(option_type))
+                    + symbol
+                    + option_type
+                )
+        elif type(value) is list and value:
+            record = _encode_chain(value)
+            if record is not None:
+                return record
+    except (struct.error, TypeError, AttributeError):
+        # Values outside the record layout, e.g. a string price or a very long symbol
+        pass
+    return json.dumps(value).encode()
+
+
+def _decode_chain(raw):
+    _, _, count, n_strings = CHAIN_HEADER.unpack_from(raw)
+    offset = CHAIN_HEADER.size
+    strings = []
+    for _ in range(n_strings):
+        length = raw[offset]
+        strings.append(raw[offset + 1 : offset + 1 + length].decode())
+        offset += 1 + length
+    return [
+        {'strike': strike, 'type': strings[option_type], 'expiry': strings[expiry], 'token': token}
+        for strike, token, option_type, expiry in CHAIN_ENTRY.iter_unpack(
+            raw[offset : offset + count * CHAIN_ENTRY.size]
+        )
+    ]
+
+
+def decode(raw):
+    """
+    Read a value written by encode, or a JSON value written by earlier releases
+    Param raw:(bytes) - Stored value
+    """
+    version = raw[0]
+    if version > MAX_VERSION:
+        return json.loads(raw)
+    if version != VERSION:
+        raise ValueError('Unsupported record version - {}'.format(version))
+    kind = raw[1]
+    if kind == OPTION:
+        _, _, token, last_price, volume, change, symbol_length = OPTION_RECORD.unpack_from(raw)
+        symbol = raw[OPTION_RECORD.size : OPTION_RECORD.size + symbol_length].decode()
+        return {
+            'token': token,
+            'symbol': symbol,
+            'last_price': last_price,
+            'volume': volume if volume != NULL_VOLUME else None,
+            # NaN is the only value not equal to itself
+            'change': change if change == change else None,
+        }
+    if kind == UNDERLYING:
+        _, _, token, last_price, change, symbol_length = UNDERLYING_RECORD.unpack_from(raw)
+        symbol = raw[UNDERLYING_RECORD.size : UNDERLYING_RECORD.size + symbol_length].decode()
+        return {
+            'token': token,
+            'symbol': symbol,
+            'last_price': last_price,
+            'change': change if change == change else None,
+        }
+    if kind == CONTRACT:
+        _, _, strike, symbol_length, type_length = CONTRACT_RECORD.unpack_from(raw)
+        offset = CONTRACT_RECORD.size
+        symbol = raw[offset : offset + symbol_length].decode()
+        option_type = raw[offset + symbol_length : offset + symbol_length + type_length].decode()
+        return {'symbol': symbol, 'strike': strike, 'type': option_type}
+    if kind == CHAIN:
+        return _decode_chain(raw)
+    raise ValueError('Unknown record kind - {}'.format(kind))
@@ -0,0 +1,250 @@
+"""
+Memory mapped contract index for static contract metadata
+Maps (underlying, expiry, strike, type) <-> token, tradingsymbol and lot size
+with open addressing hash tables so every process can resolve contracts
+without a network hop
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'OPTOCIX1'
+FORMAT_VERSION = 1
+# magic, version, record count, hash table size
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 24
+EMPTY = -1
+
+RECORD_DTYPE = np.dtype(
+    [
+        ('token', '<u4'),
+        ('underlying', 'S16'),
+        ('tradingsymbol', 'S32'),
+        ('expiry', '<i4'),
+        ('strike', '<f8'),
+        ('type', 'S4'),
+        ('lot_size', '<i4'),
+        # One past the last record sharing this record's (underlying, expiry)
+        ('group_end', '<i4'),
+    ]
+)
+TABLES = ('token', 'contract', 'tradingsymbol', 'group')
+
+
+def expiry_key(expiry):
+    """
+    Param expiry:(string) - Expiry as YYYY-MM-DD, empty for underlying contracts
+    """
+    expiry = str(expiry)
+    return int(expiry.replace('-', '')) if expiry[:1].isdigit() else 0
+
+
+def _hash(*parts):
+    return zlib.crc32('|'.join(str(part) for part in parts).encode())
+
+
+def _contract_hash(underlying, expiry, strike, option_type):
+    return _hash(underlying, expiry, '{:.2f}'.format(strike), option_type)
+
+
+def _table_size(n_records):
+    size = 16
+    while size < 2 * n_records:
+        size *= 2
+    return size
+
+
+def _insert(table, key_hash, value):
+    mask = len(table) - 1
+    slot = key_hash & mask
+    while table[slot] != EMPTY:
+        slot = (slot + 1) & mask
+    table[slot] = value
+
+
+def _encode_field(name, value):
+    # numpy silently truncates longer strings, the truncated key would then never match a lookup
+    encoded = value.encode()
+    if len(encoded) > RECORD_DTYPE[name].itemsize:
+        raise ValueError(
+            '{} longer than the {} bytes of the contract index - {}'.format(name, RECORD_DTYPE[name].itemsize, value)
+        )
+    return encoded
+
+
+def build_contract_index(path, contractToken, tokenDetail, lotSize):
+    """
+    Write the contract index file atomically
+    Param path:(string) - Index file path
+    Param contractToken:(dict) - F&O symbol -> list of strike detail
+    Param tokenDetail:(dict) - Instrument token -> contract detail
+    Param lotSize:(dict) - Instrument token -> lot size
+    """
+    rows = []
+    for underlying, contracts in contractToken.items():
+        for contract in contracts:
+            rows.append(
+                (
+                    contract['token'],
+                    underlying,
+                    tokenDetail[contract['token']]['symbol'],
+                    expiry_key(contract['expiry']),
+                    float(contract['strike']),
+                    contract['type'],
+                    lotSize.get(contract['token'], 0),
+                )
+            )
+    rows.sort(key=lambda row: (row[1], row[3], row[4], row[5]))
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    table_size = _table_size(len(rows))
+    tables = {name: np.full(table_size, EMPTY, dtype='<i4') for name in TABLES}
+    seen_tokens = set()
+    seen_tradingsymbols = set()
+    group_start = 0
+    for idx, row in enumerate(rows):
+        token, underlying, tradingsymbol, expiry, strike, option_type, lot_size = row
+        records[idx] = (
+            token,
+            _encode_field('underlying', underlying),
+            _encode_field('tradingsymbol', tradingsymbol),
+            expiry,
+            strike,
+            _encode_field('type', option_type),
+            lot_size,
+            0,
+        )
+        # A contract can be listed under more than one underlying, the first one wins for reverse lookups
+        if token not in seen_tokens:
+            seen_tokens.add(token)
+            _insert(tables['token'], _hash(token), idx)
+        if tradingsymbol not in seen_tradingsymbols:
+            seen_tradingsymbols.add(tradingsymbol)
+            _insert(tables['tradingsymbol'], _hash(tradingsymbol), idx)
+        _insert(tables['contract'], _contract_hash(underlying, expiry, strike, option_type), idx)
+        if idx + 1 == len(rows) or rows[idx + 1][1] != underlying or rows[idx + 1][3] != expiry:
+            records['group_end'][group_start : idx + 1] = idx + 1
+            _insert(tables['group'], _hash(underlying, expiry), group_start)
+            group_start = idx + 1
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(rows), table_size).ljust(HEADER_SIZE, b'\0'))
+        f.write(records.tobytes())
+        for name in TABLES:
+            f.write(tables[name].tobytes())
+    os.replace(tmp_path, path)
+
+
+class ContractIndex:
+    """
+    Read only view over a contract index file
+    """
+
+    def __init__(self, path):
+        """
+        Param path:(string) - Index file built with build_contract_index
+        """
+        with open(path, 'rb') as f:
+            magic, version, n_records, table_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Unsupported contract index - {}'.format(path))
+        self.path = path
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n_records,))
+        offset = HEADER_SIZE + n_records * RECORD_DTYPE.itemsize
+        self.tables = {}
+        for name in TABLES:
+            self.tables[name] = np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(table_size,))
+            offset += table_size * 4
+        self._mask = table_size - 1
+
+    def __len__(self):
+        return len(self.records)
+
+    def _probe(self, table_name, key_hash, matches):
+        table = self.tables[table_name]
+        slot = key_hash & self._mask
+        while True:
+            idx = int(table[slot])
+            if idx == EMPTY:
+                return None
+            if matches(self.records[idx]):
+                return idx
+            slot = (slot + 1) & self._mask
+
+    def _detail(self, idx):
+        record = self.records[idx]
+        expiry = int(record['expiry'])
+        return {
+            'token': int(record['token']),
+            'underlying': record['underlying'].decode(),
+            'symbol': record['tradingsymbol'].decode(),
+            'expiry': '{}-{:02d}-{:02d}'.format(expiry // 10000, expiry // 100 % 100, expiry % 100) if expiry else '',
+            'strike': float(record['strike']),
+            'type': record['type'].decode(),
+            'lot_size': int(record['lot_size']),
+        }
+
+    def by_token(self, token):
+        """
+        Param token:(integer) - Instrument token
+        """
+        idx = self._probe('token', _hash(token), lambda record: record['token'] == token)
+        return None if idx is None else self._detail(idx)
+
+    def by_tradingsymbol(self, tradingsymbol):
+        """
+        Param tradingsymbol:(string) - Contract tradingsymbol
+        """
+        encoded = tradingsymbol.encode()
+        idx = self._probe('tradingsymbol', _hash(tradingsymbol), lambda record: record['tradingsymbol'] == encoded)
+        return None if idx is None else self._detail(idx)
+
+    def lookup(self, underlying, expiry, strike, option_type):
+        """
+        Param underlying:(string) - F&O symbol, e.g. BANKNIFTY
+        Param expiry:(string) - Expiry as YYYY-MM-DD
+        Param strike:(float) - Strike price
+        Param option_type:(string) - CE or PE
+        """
+        encoded = (underlying.encode(), expiry_key(expiry), float(strike), option_type.encode())
+        idx = self._probe(
+            'contract',
+            _contract_hash(underlying, encoded[1], float(strike), option_type),
+            lambda record: (record['underlying'], record['expiry'], record['strike'], record['type']) == encoded,
+        )
+        return None if idx is None else self._detail(idx)
+
+    def token_detail(self, token):
+        """
+        Contract detail in the same form as InstrumentDumpFetch.fetch_token
+        Param token:(integer) - Instrument token
+        """
+        detail = self.by_token(token)
+        if detail is None:
+            return None
+        return {'symbol': detail['symbol'], 'strike': detail['strike'], 'type': detail['type']}
+
+    def _group(self, underlying, expiry):
+        encoded = (underlying.encode(), expiry)
+        start = self._probe(
+            'group', _hash(underlying, expiry), lambda record: (record['underlying'], record['expiry']) == encoded
+        )
+        if start is None:
+            return self.records[:0]
+        return self.records[start : int(self.records[start]['group_end'])]
+
+    def tokens_for(self, underlying, expiry, include_underlying=False):
+        """
+        Tokens of every strike of an expiry
+        Param underlying:(string) - F&O symbol, e.g. BANKNIFTY
+        Param expiry:(string) - Expiry as YYYY-MM-DD
+        Param include_underlying:(bool) - Include the EQ/index contracts of the symbol
+        """
+        tokens = []
+        if include_underlying:
+            tokens.extend(int(token) for token in self._group(underlying, 0)['token'])
+        tokens.extend(int(token) for token in self._group(underlying, expiry_key(expiry))['token'])
+        return tokens
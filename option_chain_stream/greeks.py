@@ -0,0 +1,307 @@
+"""
+Implied volatility and Black-Scholes greeks for a whole option chain
+computed in a single vectorized NumPy pass per snapshot
+"""
+
+from datetime import datetime, time
+
+import numpy as np
+
+GREEKS = ('iv', 'delta', 'gamma', 'theta', 'vega')
+# Annualised risk free rate used when none is given
+RISK_FREE_RATE = 0.07
+# Options stop trading at market close on the expiry day
+EXPIRY_TIME = time(15, 30)
+SECONDS_PER_YEAR = 365 * 24 * 3600
+# Volatility bracket and tolerance of the implied volatility solver
+MIN_VOLATILITY = 1e-4
+MAX_VOLATILITY = 5.0
+MIN_START_VOLATILITY = 0.01
+MAX_START_VOLATILITY = 2.0
+LOG_PRICE_TOLERANCE = 1e-7
+MAX_ITERATIONS = 50
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    """
+    Standard normal CDF to double precision (Hart 1968), NumPy has no erf
+    Param x:(ndarray) - Points to evaluate
+    """
+    x_abs = np.abs(x)
+    numerator = 3.52624965998911e-02 * x_abs + 0.700383064443688
+    for coefficient in (6.37396220353165, 33.912866078383, 112.079291497871, 221.213596169931, 220.206867912376):
+        numerator *= x_abs
+        numerator += coefficient
+    denominator = 8.83883476483184e-02 * x_abs + 1.75566716318264
+    for coefficient in (
+        16.064177579207,
+        86.7807322029461,
+        296.564248779674,
+        637.333633378831,
+        793.826512519948,
+        440.413735824752,
+    ):
+        denominator *= x_abs
+        denominator += coefficient
+    tail = np.exp(-0.5 * x_abs * x_abs) * numerator / denominator
+    return np.where(x > 0, 1.0 - tail, tail)
+
+
+def _price_and_vega(spot, discounted_strike, log_moneyness, sqrt_t, volatility, sign):
+    # sign is +1 for calls and -1 for puts, log_moneyness is log(spot / strike) + rate * expiry.
+    # Both CDFs go through a single call, the per call overhead dominates at chain sizes
+    volatility_t = volatility * sqrt_t
+    d1 = log_moneyness / volatility_t + 0.5 * volatility_t
+    n = len(d1)
+    cdf = norm_cdf(np.concatenate([sign * d1, sign * (d1 - volatility_t)]))
+    price = sign * (spot * cdf[:n] - discounted_strike * cdf[n:])
+    return price, spot * sqrt_t * norm_pdf(d1), cdf
+
+
+def black_scholes_price(spot, strike, expiry_years, rate, volatility, is_call):
+    """
+    Black-Scholes price of European options
+    Param spot:(float) - Underlying price
+    Param strike:(ndarray) - Strike prices
+    Param expiry_years:(float) - Time to expiry in years
+    Param rate:(float) - Annualised risk free rate
+    Param volatility:(ndarray) - Annualised volatility
+    Param is_call:(ndarray of bool) - True for calls, False for puts
+    """
+    strike = np.asarray(strike, dtype=np.float64)
+    discounted_strike = strike * np.exp(-rate * expiry_years)
+    volatility = np.broadcast_to(np.asarray(volatility, dtype=np.float64), strike.shape)
+    sign = np.where(is_call, 1.0, -1.0)
+    log_moneyness = np.log(spot / strike) + rate * expiry_years
+    return _price_and_vega(spot, discounted_strike, log_moneyness, np.sqrt(expiry_years), volatility, sign)[0]
+
+
+def implied_volatility(price, spot, strike, expiry_years, rate, is_call, initial=None):
+    """
+    Implied volatility of every option at once
+    Every price is first turned into the price of the out of the money option of
+    its strike through put-call parity, then a bracketed Newton solver runs on
+    log prices, which converges in a few steps even far out of the money.
+    Steps leaving the bracket fall back to bisection and converged options drop
+    out of the arrays so later iterations only work on the stragglers
+    Returns NaN where the price is outside the no arbitrage bounds
+    Param price:(ndarray) - Option prices
+    Param spot:(float) - Underlying price
+    Param strike:(ndarray) - Strike prices
+    Param expiry_years:(float) - Time to expiry in years
+    Param rate:(float) - Annualised risk free rate
+    Param is_call:(ndarray of bool) - True for calls, False for puts
+    Param initial:(ndarray) - Starting volatilities, e.g. the previous snapshot's, NaN where unknown
+    """
+    price = np.asarray(price, dtype=np.float64)
+    strike = np.asarray(strike, dtype=np.float64)
+    is_call = np.asarray(is_call, dtype=bool)
+    iv = np.full(price.shape, np.nan)
+    if not np.isfinite(spot) or spot <= 0:
+        return iv
+    discounted_strike = strike * np.exp(-rate * expiry_years)
+    otm_call = discounted_strike >= spot
+    # Intrinsic value is the no arbitrage lower bound, what is left is the out of the money price
+    intrinsic = np.where(is_call, spot - discounted_strike, discounted_strike - spot)
+    otm_price = price - np.maximum(intrinsic, 0.0)
+    upper = np.where(otm_call, spot, discounted_strike)
+    with np.errstate(invalid='ignore'):
+        active = np.flatnonzero((otm_price > 0) & (otm_price < upper))
+
+    log_price = np.log(otm_price[active])
+    discounted_strike = discounted_strike[active]
+    log_moneyness = np.log(spot / strike[active]) + rate * expiry_years
+    sign = np.where(otm_call[active], 1.0, -1.0)
+    sqrt_t = np.sqrt(expiry_years)
+    low = np.full(active.shape, MIN_VOLATILITY)
+    high = np.full(active.shape, MAX_VOLATILITY)
+    # Corrado-Miller approximation on the equivalent call price as the starting point
+    forward_gap = spot - discounted_strike
+    premium = otm_price[active] + np.maximum(forward_gap, 0.0) - 0.5 * forward_gap
+    root = np.sqrt(np.maximum(premium * premium - forward_gap * forward_gap / np.pi, 0.0))
+    volatility = np.sqrt(2 * np.pi) * (premium + root) / ((spot + discounted_strike) * sqrt_t)
+    volatility = np.clip(volatility, MIN_START_VOLATILITY, MAX_START_VOLATILITY)
+    if initial is not None:
+        # Volatility barely moves between snapshots, a warm start needs a couple of steps
+        initial = np.asarray(initial, dtype=np.float64)[active]
+        with np.errstate(invalid='ignore'):
+            volatility = np.where((initial > MIN_VOLATILITY) & (initial < MAX_VOLATILITY), initial, volatility)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(MAX_ITERATIONS):
+            model_price, vega, _ = _price_and_vega(spot, discounted_strike, log_moneyness, sqrt_t, volatility, sign)
+            difference = np.log(model_price) - log_price
+            pending = np.abs(difference) >= LOG_PRICE_TOLERANCE
+            n_pending = np.count_nonzero(pending)
+            if n_pending < len(pending):
+                converged = ~pending
+                iv[active[converged]] = volatility[converged]
+                if not n_pending:
+                    break
+                active, log_price, discounted_strike, log_moneyness, sign, low, high = (
+                    active[pending],
+                    log_price[pending],
+                    discounted_strike[pending],
+                    log_moneyness[pending],
+                    sign[pending],
+                    low[pending],
+                    high[pending],
+                )
+                volatility, difference, model_price, vega = (
+                    volatility[pending],
+                    difference[pending],
+                    model_price[pending],
+                    vega[pending],
+                )
+            # Price increases with volatility, so the sign of the error narrows the bracket
+            above = difference > 0
+            np.copyto(high, volatility, where=above)
+            np.copyto(low, volatility, where=~above)
+            step = volatility - difference * model_price / vega
+            volatility = np.where((step > low) & (step < high), step, 0.5 * (low + high))
+        else:
+            # Whatever is left after the last iteration is within the final bracket
+            iv[active] = volatility
+    return iv
+
+
+def greeks(price, spot, strike, expiry_years, rate, is_call, initial=None):
+    """
+    Implied volatility, delta, gamma, theta per calendar day and vega per
+    volatility point for every option of a chain
+    Param price:(ndarray) - Option prices
+    Param spot:(float) - Underlying price
+    Param strike:(ndarray) - Strike prices
+    Param expiry_years:(float) - Time to expiry in years
+    Param rate:(float) - Annualised risk free rate
+    Param is_call:(ndarray of bool) - True for calls, False for puts
+    Param initial:(ndarray) - Starting volatilities for the solver, NaN where unknown
+    Returns greek name -> ndarray, NaN where no implied volatility exists
+    """
+    strike = np.asarray(strike, dtype=np.float64)
+    is_call = np.asarray(is_call, dtype=bool)
+    iv = implied_volatility(price, spot, strike, expiry_years, rate, is_call, initial)
+    sqrt_t = np.sqrt(expiry_years)
+    discounted_strike = strike * np.exp(-rate * expiry_years)
+    # Contracts without an implied volatility come out as NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_moneyness = np.log(spot / strike) + rate * expiry_years
+        _, vega, cdf = _price_and_vega(spot, discounted_strike, log_moneyness, sqrt_t, iv, 1.0)
+    n = len(strike)
+    call_delta, call_exercise = cdf[:n], cdf[n:]
+    time_decay = -0.5 * vega * iv / expiry_years
+    carry = rate * discounted_strike * np.where(is_call, call_exercise, 1.0 - call_exercise)
+    return {
+        'iv': iv,
+        'delta': np.where(is_call, call_delta, call_delta - 1.0),
+        'gamma': vega / (spot * spot * iv * expiry_years),
+        'theta': np.where(is_call, time_decay - carry, time_decay + carry) / 365,
+        'vega': vega / 100,
+    }
+
+
+class ChainAnalytics:
+    """
+    Analytics stage attaching implied volatility and greeks to chain snapshots
+    List snapshots get the greeks as extra keys of every option dict,
+    ChainSnapshot views get ce/pe arrays aligned with their strikes
+    """
+
+    def __init__(self, token_details, expiry, rate=RISK_FREE_RATE, clock=datetime.now):
+        """
+        Param token_details:(dict) - Contract detail for every token of the chain
+        Param expiry:(string or date) - Expiry date of the chain, YYYY-MM-DD if string
+        Param rate:(float) - Annualised risk free rate
+        Param clock:(callable) - Returns the current datetime, the simulated clock in replays
+        """
+        if isinstance(expiry, str):
+            expiry = datetime.strptime(expiry, '%Y-%m-%d').date()
+        elif isinstance(expiry, datetime):
+            expiry = expiry.date()
+        self.expiry = datetime.combine(expiry, EXPIRY_TIME)
+        self.rate = rate
+        self.clock = clock
+        self.strikes = {}
+        self.is_call = {}
+        self.underlying_tokens = set()
+        for token, detail in token_details.items():
+            if detail['type'] in ('CE', 'PE'):
+                self.strikes[token] = float(detail['strike'])
+                self.is_call[token] = detail['type'] == 'CE'
+            elif detail['type'] == 'EQ':
+                self.underlying_tokens.add(token)
+        # Positions of the options in list snapshots, rebuilt only when the contracts in the list change
+        self.list_tokens = None
+        self.option_rows = None
+        self.underlying_row = None
+        self.list_strikes = None
+        self.list_is_call = None
+        # Implied volatilities of the previous snapshot warm start the solver
+        self.last_list_iv = None
+        self.last_snapshot_iv = None
+
+    def expiry_years(self):
+        # Floor at a minute so expiry day snapshots after the close still solve
+        return max((self.expiry - self.clock()).total_seconds(), 60.0) / SECONDS_PER_YEAR
+
+    def attach(self, option_chain):
+        """
+        Compute greeks for the snapshot and attach them to it
+        Param option_chain:(List of dict or ChainSnapshot) - Chain snapshot
+        Returns the same snapshot
+        """
+        if option_chain is None:
+            return option_chain
+        if isinstance(option_chain, list):
+            self._attach_list(option_chain)
+        else:
+            self._attach_snapshot(option_chain)
+        return option_chain
+
+    def _index_list(self, tokens):
+        self.list_tokens = tokens
+        rows = [row for row, token in enumerate(tokens) if token in self.strikes]
+        self.option_rows = np.array(rows, dtype=np.intp)
+        self.list_strikes = np.array([self.strikes[tokens[row]] for row in rows], dtype=np.float64)
+        self.list_is_call = np.array([self.is_call[tokens[row]] for row in rows], dtype=bool)
+        self.underlying_row = next((row for row, token in enumerate(tokens) if token in self.underlying_tokens), None)
+        self.last_list_iv = None
+
+    def _attach_list(self, option_chain):
+        tokens = [option['token'] for option in option_chain]
+        if tokens != self.list_tokens:
+            self._index_list(tokens)
+        if not len(self.option_rows):
+            return
+        prices = np.array([option['last_price'] for option in option_chain], dtype=np.float64)
+        spot = prices[self.underlying_row] if self.underlying_row is not None else np.nan
+        values = greeks(
+            prices[self.option_rows],
+            spot,
+            self.list_strikes,
+            self.expiry_years(),
+            self.rate,
+            self.list_is_call,
+            self.last_list_iv,
+        )
+        self.last_list_iv = values['iv']
+        columns = [values[name].tolist() for name in GREEKS]
+        for row, greek_values in zip(self.option_rows.tolist(), zip(*columns)):
+            option_chain[row].update(zip(GREEKS, greek_values))
+
+    def _attach_snapshot(self, snapshot):
+        n_rows = len(snapshot.strikes)
+        price = np.concatenate([snapshot.ce_last_price, snapshot.pe_last_price])
+        strike = np.concatenate([snapshot.strikes, snapshot.strikes])
+        is_call = np.arange(2 * n_rows) < n_rows
+        values = greeks(
+            price, snapshot.underlying_price, strike, self.expiry_years(), self.rate, is_call, self.last_snapshot_iv
+        )
+        self.last_snapshot_iv = values['iv']
+        snapshot.greeks = {
+            'ce': {name: values[name][:n_rows] for name in GREEKS},
+            'pe': {name: values[name][n_rows:] for name in GREEKS},
+        }
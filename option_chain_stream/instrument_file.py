@@ -7,87 +7,191 @@ Segregate all option contract along with all strike detail
 and store it in Redis
 """
 
+import logging
 import os
+import time
 import pandas as pd
 import requests
 from kiteconnect import KiteConnect
-from tqdm import tqdm
 
 from redis_instrument import InstrumentDumpFetch
+from instrument_snapshot import InstrumentSnapshot
+from contract_index import ContractIndex, build_contract_index
+
+
+def option_data_from_tick(tick, contract_detail):
+    """
+    Option chain entry stored for a tick
+    Param tick:(dict) - Tick as received from KiteTicker
+    Param contract_detail:(dict) - Contract detail of the tick's token
+    """
+    # For EQ underlying instrument don't fetch OI and volume(for INDICES) value
+    # LTP mode ticks carry neither change nor volume, they are stored as None
+    if contract_detail['type'] == 'EQ':
+        return {
+            'token': tick['instrument_token'],
+            'symbol': contract_detail['symbol'],
+            'last_price': tick['last_price'],
+            'change': tick.get('change'),
+        }
+    return {
+        'token': tick['instrument_token'],
+        'symbol': contract_detail['symbol'],
+        'last_price': tick['last_price'],
+        'volume': tick.get('volume_traded'),
+        'change': tick.get('change'),
+    }
 
 
 class InstrumentMaster:
-    def __init__(self, api_key):
+    def __init__(self, api_key, storage=None):
+        """
+        Param api_key:(string) - Kite api key
+        Param storage:(string or StorageBackend) - 'redis', 'memory', 'shm' or a backend instance, redis by default
+        """
         self.fno_file = 'https://archives.nseindia.com/content/fo/fo_mktlots.csv'
         self.kite = KiteConnect(api_key=api_key)
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'
         }
-        self.redis_db = InstrumentDumpFetch()
+        self.redis_db = InstrumentDumpFetch(storage)
+        self.snapshot_file = 'instruments.snapshot.gz'
+        self.index_file = 'contracts.idx'
+        self._contract_index = None
+        # Token metadata is static for the session, keep it in memory once loaded
+        self.token_details = {}
 
-    def filter_redis_dump(self):
+    def filter_redis_dump(self, incremental=True):
         """
         Filter only option contract from master instrument and
         dump it to redis
+        Param incremental:(bool) - Write only contracts changed since the last saved snapshot
         """
-        contractToken = {}
         # Fetch instrument file
-        # Filter only F&O contracts
+        phase_start = time.monotonic()
         instruments = self.kite.instruments()
-        # Dump token:{symbol,strike} data to redis
-        for contract in tqdm(instruments):
-            token_detail = {
-                'symbol': contract['tradingsymbol'],
-                'strike': contract['strike'],
-                'type': contract['instrument_type'],
-            }
-            self.redis_db.data_dump(contract['instrument_token'], token_detail)
+        phase_start = self._log_phase('Fetched {} instruments'.format(len(instruments)), phase_start)
 
         # Download and read F&O enabled list of contract
         response = requests.get(self.fno_file, headers=self.headers)
         with open(os.path.join('fo_mktlots.csv'), 'wb') as f:
             f.write(response.content)
-        # Filter only contract symbol from marketlot file
         fno_contract = pd.read_csv('fo_mktlots.csv')
-        optionInstrument = []
-        underInstrument = []
-        for index, row in fno_contract.iterrows():
-            underlying_name = row['UNDERLYING                          '].rstrip()
+        phase_start = self._log_phase('Downloaded F&O market lot file', phase_start)
+
+        tokenDetail, contractToken = self.build_instrument_records(instruments, fno_contract)
+        snapshot = InstrumentSnapshot(tokenDetail, contractToken)
+        phase_start = self._log_phase('Grouped contracts for {} symbols'.format(len(contractToken)), phase_start)
+
+        previous = InstrumentSnapshot.load(self.snapshot_file) if incremental else None
+        # The local snapshot only describes redis if redis was last synced from it
+        if previous is not None and self.redis_db.fetch_sync_digest() != previous.digest:
+            previous = None
+        if previous is not None and previous.digest == snapshot.digest:
+            phase_start = self._log_phase('Instrument master unchanged, skipped redis sync', phase_start)
+            if not os.path.exists(self.index_file):
+                self.build_contract_index(instruments, snapshot, phase_start)
+            return
+        if previous is None:
+            # Dump token:{symbol,strike} and symbol:[contracts] data to redis
+            changed = list(tokenDetail.items()) + list(contractToken.items())
+            removed = []
+        else:
+            changed, removed = snapshot.diff(previous)
+        self.redis_db.data_dump_batch(changed)
+        self.redis_db.delete_batch(removed)
+        self.redis_db.store_sync_digest(snapshot.digest)
+        phase_start = self._log_phase(
+            'Stored {} changed and removed {} expired keys'.format(len(changed), len(removed)), phase_start
+        )
+        snapshot.save(self.snapshot_file)
+        phase_start = self._log_phase('Saved instrument snapshot', phase_start)
+        self.build_contract_index(instruments, snapshot, phase_start)
+
+    def build_contract_index(self, instruments, snapshot, phase_start):
+        """
+        Write the memory mapped contract index used for static contract lookups
+        Param instruments:(List of dict) - Instrument master from kite
+        Param snapshot:(InstrumentSnapshot) - Grouped instrument master
+        """
+        lotSize = {contract['instrument_token']: contract['lot_size'] for contract in instruments}
+        build_contract_index(self.index_file, snapshot.contractToken, snapshot.tokenDetail, lotSize)
+        # Reopen on next access so the new file is mapped
+        self._contract_index = None
+        self._log_phase('Built contract index', phase_start)
+
+    @property
+    def contract_index(self):
+        """
+        Memory mapped contract index, None until the first sync has built it
+        """
+        if self._contract_index is None and os.path.exists(self.index_file):
+            self._contract_index = ContractIndex(self.index_file)
+        return self._contract_index
+
+    def _log_phase(self, message, phase_start):
+        now = time.monotonic()
+        logging.info('{} in {:.2f}s'.format(message, now - phase_start))
+        return now
+
+    def build_instrument_records(self, instruments, fno_contract):
+        """
+        Group the instrument master in a single pass
+        Param instruments:(List of dict) - Instrument master from kite
+        Param fno_contract:(DataFrame) - F&O market lot file
+        Returns token -> contract detail and F&O symbol -> list of its strike detail
+        """
+        tokenDetail = {}
+        byName = {}
+        byTradingsymbol = {}
+        for idx, contract in enumerate(instruments):
+            tokenDetail[contract['instrument_token']] = {
+                'symbol': contract['tradingsymbol'],
+                'strike': contract['strike'],
+                'type': contract['instrument_type'],
+            }
+            # Only option contracts and NSE equities belong to a chain
+            if contract['segment'] == 'NFO-OPT' or (
+                contract['instrument_type'] == 'EQ' and contract['exchange'] == 'NSE'
+            ):
+                byName.setdefault(contract['name'], []).append(idx)
+                byTradingsymbol.setdefault(contract['tradingsymbol'], []).append(idx)
+
+        # Filter only contract symbol from marketlot file
+        fno_contract.columns = fno_contract.columns.str.strip()
+        contractToken = {}
+        symbols = fno_contract['SYMBOL'].str.rstrip()
+        underlying_names = fno_contract['UNDERLYING'].str.rstrip()
+        for symbol, underlying_name in zip(symbols, underlying_names):
             # Remove these suffix to match with kite instrument master
             if 'LTD' in underlying_name:
                 underlying_name = underlying_name.replace('LTD', '')
             elif 'LIMITED' in underlying_name:
                 underlying_name = underlying_name.replace('LIMITED', '')
+            underlying_name = underlying_name.rstrip()
 
-            optionInstrument.append({'symbol': row['SYMBOL    '].rstrip(), 'underlying': underlying_name.rstrip()})
-
-        for optContract in tqdm(optionInstrument):
-            # Create list of strike price for specific symbol
-            contractToken[optContract['symbol']] = []
-            for contract in instruments:
-                if (
-                    contract['name'] == optContract['symbol']
-                    or contract['tradingsymbol'] == optContract['symbol']
-                    or contract['name'] == optContract['underlying']
-                ) and (
-                    contract['segment'] == 'NFO-OPT'
-                    or (contract['instrument_type'] == 'EQ' and contract['exchange'] == 'NSE')
-                ):
-                    contractToken[optContract['symbol']].append(
-                        {
-                            'strike': contract['strike'],
-                            'type': contract['instrument_type'],
-                            'expiry': str(contract['expiry']),
-                            'token': contract['instrument_token'],
-                        }
-                    )
-            self.redis_db.data_dump(optContract['symbol'], contractToken[optContract['symbol']])
+            # Create list of strike price for specific symbol, in instrument master order
+            matches = set(byName.get(symbol, ()))
+            matches.update(byTradingsymbol.get(symbol, ()))
+            matches.update(byName.get(underlying_name, ()))
+            contractToken[symbol] = [
+                {
+                    'strike': instruments[idx]['strike'],
+                    'type': instruments[idx]['instrument_type'],
+                    'expiry': str(instruments[idx]['expiry']),
+                    'token': instruments[idx]['instrument_token'],
+                }
+                for idx in sorted(matches)
+            ]
+        return tokenDetail, contractToken
 
     def fetch_contract(self, symbol, expiry, underlying):
         """
         Fetch strike and token detail for requested symbol
         Param symbol:(string) - Option contract symbol
         """
+        if self.contract_index is not None:
+            return self.contract_index.tokens_for(symbol, expiry, underlying)
         token_list = []
         # Fetch all active opt and EQ contracts for requested symbol
         optionData = self.redis_db.symbol_data(symbol)
@@ -107,7 +211,32 @@ class InstrumentMaster:
         Fetch contract name for requested instrument token
         Param token:(integer) - Instrument token
         """
-        return self.redis_db.fetch_token(token)
+        try:
+            return self.token_details[token]
+        except KeyError:
+            token_detail = self.contract_index.token_detail(token) if self.contract_index is not None else None
+            if token_detail is None:
+                token_detail = self.redis_db.fetch_token(token)
+            self.token_details[token] = token_detail
+            return token_detail
+
+    def load_token_details(self, token_list):
+        """
+        Load contract detail for all requested tokens into memory in one round trip
+        Param token_list:(List of integer) - Instrument tokens
+        """
+        missing_tokens = [token for token in token_list if token not in self.token_details]
+        if self.contract_index is not None:
+            for token in missing_tokens:
+                token_detail = self.contract_index.token_detail(token)
+                if token_detail is not None:
+                    self.token_details[token] = token_detail
+            missing_tokens = [token for token in missing_tokens if token not in self.token_details]
+        for token, token_detail in zip(missing_tokens, self.redis_db.fetch_tokens(missing_tokens)):
+            if token_detail is None:
+                raise Exception('Key not found - {}'.format(token))
+            self.token_details[token] = token_detail
+        return self.token_details
 
     def store_option_data(self, tradingsymbol, token, optionData):
         """
@@ -118,16 +247,29 @@ class InstrumentMaster:
         """
         return self.redis_db.store_optiondata(tradingsymbol, token, optionData)
 
-    def generate_optionChain(self, token_list):
+    def store_option_data_batch(self, optionRecords):
+        """
+        Store option chain data for a batch of ticks
+        Param optionRecords:(List of tuple) - (tradingsymbol, token, optionData) for each tick
+        """
+        return self.redis_db.store_optiondata_batch(optionRecords)
+
+    def option_data_keys(self, token_list):
+        """
+        Resolve the option data key of every token in the chain
+        Param token_list:(List of integer) - List of token
+        """
+        return [
+            self.redis_db.option_data_key(self.fetch_token_detail(instrumentToken)['symbol'], instrumentToken)
+            for instrumentToken in token_list
+        ]
+
+    def generate_optionChain(self, token_list, optionKeys=None):
         """
-        Fetch all option contracts for requested symbol
+        Fetch all option contracts for requested symbol in a single request
         Param token:(List of string) - List of token
+        Param optionKeys:(List of string) - Keys resolved once with option_data_keys
         """
-        optionChain = []
-        # Iterate though list of tokens for respective symbol and fetch respective strike data
-        for instrumentToken in token_list:
-            # Fetch market depth data for respective strike
-            optionInstrument = self.fetch_token_detail(instrumentToken)
-            optionData = self.redis_db.fetch_option_data(optionInstrument['symbol'], instrumentToken)
-            optionChain.append(optionData)
-        return optionChain
+        if optionKeys is None:
+            optionKeys = self.option_data_keys(token_list)
+        return self.redis_db.fetch_option_data_batch(optionKeys)
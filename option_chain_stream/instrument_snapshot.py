@@ -0,0 +1,85 @@
+"""
+Versioned on disk copy of the last synced instrument master
+Used to write only the contracts that changed since the previous sync
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+FORMAT_VERSION = 1
+
+
+class InstrumentSnapshot:
+    def __init__(self, tokenDetail, contractToken):
+        """
+        Param tokenDetail:(dict) - Instrument token -> contract detail
+        Param contractToken:(dict) - F&O symbol -> list of strike detail
+        """
+        self.tokenDetail = tokenDetail
+        self.contractToken = contractToken
+        self.digest = self.compute_digest()
+
+    def compute_digest(self):
+        digest = hashlib.sha1()
+        for token in sorted(self.tokenDetail):
+            digest.update(json.dumps([token, self.tokenDetail[token]], sort_keys=True).encode())
+        for symbol in sorted(self.contractToken):
+            digest.update(json.dumps([symbol, self.contractToken[symbol]], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def diff(self, previous):
+        """
+        Keys to write and keys to delete to go from previous snapshot to this one
+        Param previous:(InstrumentSnapshot) - Snapshot already present in redis
+        """
+        changed = []
+        for token, detail in self.tokenDetail.items():
+            if previous.tokenDetail.get(token) != detail:
+                changed.append((token, detail))
+        for symbol, contracts in self.contractToken.items():
+            if previous.contractToken.get(symbol) != contracts:
+                changed.append((symbol, contracts))
+        removed = [token for token in previous.tokenDetail if token not in self.tokenDetail]
+        removed += [symbol for symbol in previous.contractToken if symbol not in self.contractToken]
+        return changed, removed
+
+    def save(self, path):
+        """
+        Write the snapshot atomically
+        Param path:(string) - Snapshot file path
+        """
+        payload = {
+            'version': FORMAT_VERSION,
+            'digest': self.digest,
+            'tokens': list(self.tokenDetail.items()),
+            'symbols': self.contractToken,
+        }
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(payload, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a snapshot, returns None when missing or written by another format version
+        Param path:(string) - Snapshot file path
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rt') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring unreadable instrument snapshot {} - {}'.format(path, e))
+            return None
+        if payload.get('version') != FORMAT_VERSION:
+            return None
+        snapshot = cls({token: detail for token, detail in payload['tokens']}, payload['symbols'])
+        if snapshot.digest != payload['digest']:
+            logging.warning('Ignoring corrupt instrument snapshot {}'.format(path))
+            return None
+        return snapshot
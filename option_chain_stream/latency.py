@@ -0,0 +1,240 @@
+"""
+Latency tracing from the exchange tick to the order submission
+Off by default, enable_tracing must be called before the websocket
+client is created so the forked processes share the histograms
+"""
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+# Stages a snapshot and the orders placed on it go through, in order
+STAGES = ('tick', 'store', 'snapshot', 'deliver', 'decision', 'order')
+# One histogram per stage measuring the time since the previous stage, plus tick to order
+INTERVALS = STAGES[1:] + ('end_to_end',)
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_NAME = 'option_chain_stage_latency_seconds'
+
+# Process wide tracer inherited by the forked processes, None while tracing is disabled
+_tracer = None
+
+
+class LatencyTracer:
+    """
+    Rolling latency histograms in shared memory, one per interval
+    Observations go to the window of the current time, windows older than
+    window * n_windows seconds are cleared before they are reused
+    """
+
+    def __init__(self, buckets=BUCKETS, window=10, n_windows=6):
+        """
+        Param buckets:(Tuple of float) - Bucket upper bounds in seconds, +Inf is added
+        Param window:(float) - Seconds covered by one window
+        Param n_windows:(integer) - Windows kept, the histograms cover window * n_windows seconds
+        """
+        self.buckets = tuple(buckets)
+        self.window = window
+        self.n_windows = n_windows
+        # Per interval and window: bucket counts with +Inf, sum and count
+        self.width = len(self.buckets) + 3
+        self.values = np.frombuffer(RawArray('d', len(INTERVALS) * n_windows * self.width)).reshape(
+            len(INTERVALS), n_windows, self.width
+        )
+        self.epochs = np.frombuffer(RawArray('q', n_windows), dtype=np.int64)
+        self.epochs[:] = -1
+        self.lock = Lock()
+
+    def observe(self, interval, seconds):
+        """
+        Param interval:(string) - One of INTERVALS
+        Param seconds:(float) - Observed latency
+        """
+        epoch = int(time.monotonic() // self.window)
+        slot = epoch % self.n_windows
+        row = self.values[INTERVALS.index(interval), slot]
+        with self.lock:
+            if self.epochs[slot] != epoch:
+                self.values[:, slot] = 0.0
+                self.epochs[slot] = epoch
+            row[bisect_left(self.buckets, seconds)] += 1
+            row[-2] += seconds
+            row[-1] += 1
+
+    def histograms(self):
+        """
+        Cumulative bucket counts, sum and count of every interval over the rolling windows
+        """
+        epoch = int(time.monotonic() // self.window)
+        with self.lock:
+            live = (self.epochs > epoch - self.n_windows) & (self.epochs >= 0)
+            totals = self.values[:, live].sum(axis=1)
+        return {
+            interval: (np.cumsum(totals[idx, :-2]).tolist(), float(totals[idx, -2]), int(totals[idx, -1]))
+            for idx, interval in enumerate(INTERVALS)
+        }
+
+    def prometheus_text(self):
+        """
+        Histograms in the Prometheus text format, exported as gauges since the windows roll
+        """
+        lines = [
+            '# HELP {} Seconds spent reaching each stage from the previous one over the last {}s'.format(
+                METRIC_NAME, self.window * self.n_windows
+            ),
+            '# TYPE {} gauge'.format(METRIC_NAME),
+        ]
+        bounds = ['{:g}'.format(bound) for bound in self.buckets] + ['+Inf']
+        for interval, (counts, total, count) in self.histograms().items():
+            for bound, cumulative in zip(bounds, counts):
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(METRIC_NAME, interval, bound, int(cumulative)))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(METRIC_NAME, interval, total))
+            lines.append('{}_count{{stage="{}"}} {}'.format(METRIC_NAME, interval, count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the histograms to a file for the node exporter textfile collector
+        Param path:(string) - Target .prom file, replaced atomically
+        """
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def export_file(self, path, interval=10):
+        """
+        Keep writing the histograms to a file from a daemon thread
+        Param path:(string) - Target .prom file
+        Param interval:(float) - Seconds between writes
+        """
+
+        def export():
+            while 1:
+                try:
+                    self.write(path)
+                except OSError as e:
+                    logging.error('Latency metrics write failed: {}'.format(e))
+                time.sleep(interval)
+
+        threading.Thread(target=export, daemon=True).start()
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve the histograms on http://host:port/metrics from a daemon thread
+        Param port:(integer) - Port to listen on
+        Param host:(string) - Interface to listen on, local only by default
+        """
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = tracer.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def enable_tracing(**kwargs):
+    """
+    Turn tracing on for this process and the processes forked after it
+    Keyword arguments are passed to LatencyTracer
+    """
+    global _tracer
+    _tracer = LatencyTracer(**kwargs)
+    return _tracer
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+class Trace:
+    """
+    Wall clock time of each stage reached by a snapshot, travels with the snapshot
+    to the strategy and from there with the order intent
+    """
+
+    def __init__(self, **stamps):
+        """
+        Param stamps:(float) - Epoch seconds of the stages already reached, keyed by stage
+        """
+        self.stamps = stamps
+
+    def mark(self, stage, now=None):
+        """
+        Record reaching a stage and observe the time since the previous stage reached
+        Param stage:(string) - One of STAGES
+        Param now:(float) - Epoch seconds, the current time by default
+        """
+        now = time.time() if now is None else now
+        self.stamps[stage] = now
+        if _tracer is None:
+            return
+        for previous in reversed(STAGES[: STAGES.index(stage)]):
+            if previous in self.stamps:
+                _tracer.observe(stage, now - self.stamps[previous])
+                break
+        if stage == 'order' and 'tick' in self.stamps:
+            _tracer.observe('end_to_end', now - self.stamps['tick'])
+
+
+class TracedChain(list):
+    """
+    List snapshot carrying its trace through queues, consumers treat it as a plain list
+    """
+
+    def __init__(self, option_chain, trace):
+        super().__init__(option_chain)
+        self.trace = trace
+
+
+def tick_time(ticks):
+    """
+    Newest exchange timestamp of a tick batch in epoch seconds, None when no tick carries one
+    Kite timestamps are naive exchange times, the box is expected to run in the exchange timezone
+    Param ticks:(List of dict) - Ticks as received from KiteTicker
+    """
+    stamps = [tick['exchange_timestamp'] for tick in ticks if tick.get('exchange_timestamp') is not None]
+    return max(stamps).timestamp() if stamps else None
+
+
+def trace_batch(last_batch, ticks, stored):
+    """
+    Observe the tick to store latency of a stored batch and remember its times for the next snapshot
+    Param last_batch:(Array) - Tick and store time of the newest stored batch, shared with the snapshot process
+    Param ticks:(List of dict) - Ticks of the batch
+    Param stored:(float) - Epoch seconds the batch write returned
+    """
+    tick = tick_time(ticks)
+    if tick is not None and _tracer is not None:
+        _tracer.observe('store', stored - tick)
+    last_batch[0] = tick or 0.0
+    last_batch[1] = stored
+
+
+def trace_snapshot(option_chain, last_batch):
+    """
+    Attach a trace to a freshly fetched snapshot
+    Param option_chain:(List of dict) - Snapshot from InstrumentMaster.generate_optionChain
+    Param last_batch:(Array) - Tick and store time of the newest stored batch, 0 when unknown
+    """
+    trace = Trace(**{stage: stamp for stage, stamp in zip(('tick', 'store'), last_batch) if stamp})
+    trace.mark('snapshot')
+    return TracedChain(option_chain, trace)
@@ -0,0 +1,109 @@
+"""
+Conflating channel that keeps only the newest snapshot
+A slow consumer gets the latest chain instead of working
+through a backlog of stale ones
+"""
+
+import pickle
+import struct
+import time
+from multiprocessing import Condition
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+
+# published seq, delivered seq, dropped count, payload length, publish time
+HEADER = struct.Struct('<QQQQd')
+
+
+class LatestValueChannel:
+    """
+    Single slot channel in shared memory, exposes put/get like multiprocessing.Queue
+    so it can replace WebsocketClient.q. Every put overwrites the pending snapshot,
+    get returns the newest one and counts the snapshots it superseded as dropped
+    """
+
+    def __init__(self, capacity=4 << 20):
+        """
+        Must be created before the producer process is forked
+        Param capacity:(integer) - Largest pickled snapshot in bytes
+        """
+        self.capacity = capacity
+        self.shm = SharedMemory(create=True, size=HEADER.size + capacity)
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, 0, 0, 0, 0, 0.0)
+        self.condition = Condition()
+        # Seconds between publishing and delivering the last snapshot, set in the consumer
+        self.age = None
+
+    def _header(self):
+        with self.condition:
+            return HEADER.unpack_from(self.buf, 0)
+
+    @property
+    def seq(self):
+        return self._header()[0]
+
+    @property
+    def dropped(self):
+        """
+        Snapshots overwritten before the consumer got to them
+        """
+        return self._header()[2]
+
+    def qsize(self):
+        """
+        1 while a snapshot is waiting for the consumer, 0 otherwise
+        """
+        with self.condition:
+            return int(self._pending())
+
+    def put(self, option_chain):
+        """
+        Publish a snapshot, replacing the one not consumed yet
+        Param option_chain:(object) - Picklable snapshot
+        """
+        payload = pickle.dumps(option_chain, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.capacity:
+            raise ValueError('Snapshot of {} bytes exceeds the channel capacity {}'.format(len(payload), self.capacity))
+        with self.condition:
+            seq, delivered, dropped, _, _ = HEADER.unpack_from(self.buf, 0)
+            self.buf[HEADER.size : HEADER.size + len(payload)] = payload
+            HEADER.pack_into(self.buf, 0, seq + 1, delivered, dropped, len(payload), time.monotonic())
+            self.condition.notify_all()
+
+    def put_nowait(self, option_chain):
+        """
+        Same as put, publishing never waits for the consumer
+        """
+        self.put(option_chain)
+
+    def get(self, block=True, timeout=None):
+        """
+        Block until a snapshot newer than the last delivered one is published
+        Param block:(bool) - Wait for a snapshot, False raises queue.Empty right away when none is pending
+        Param timeout:(float) - Seconds to wait, None waits forever, raises queue.Empty when it runs out
+        """
+        with self.condition:
+            if not self.condition.wait_for(self._pending, timeout if block else 0):
+                raise Empty
+            seq, delivered, dropped, length, published = HEADER.unpack_from(self.buf, 0)
+            payload = bytes(self.buf[HEADER.size : HEADER.size + length])
+            HEADER.pack_into(self.buf, 0, seq, seq, dropped + seq - delivered - 1, length, published)
+        self.age = time.monotonic() - published
+        return pickle.loads(payload)
+
+    def get_nowait(self):
+        """
+        Same as get(block=False)
+        """
+        return self.get(block=False)
+
+    def _pending(self):
+        seq, delivered = HEADER.unpack_from(self.buf, 0)[:2]
+        return seq > delivered
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -0,0 +1,336 @@
+"""
+Single market data feed shared by many strategies
+One ticker connection, or a few sharing a large universe, and one snapshot
+process serve every subscribed (symbol, expiry) chain, each subscriber gets its own queue
+"""
+
+import logging
+import time
+from multiprocessing import Queue, Value
+from queue import Full
+
+from greeks import ChainAnalytics
+from latest_channel import LatestValueChannel
+from latency import trace_snapshot
+from strike_window import MODE_QUOTE, StrikeWindow, SubscriptionManager
+from ticker_shards import TickerShards
+from websocket import WebsocketClient
+
+
+class Subscription:
+    """
+    Snapshot stream of one chain for one subscriber
+    Iterating yields snapshots like OptionChain.create_option_chain
+    """
+
+    def __init__(self, name, chain, maxsize=0, greeks=True, conflate=False, ticks=False):
+        """
+        Param name:(string) - Subscriber name shown in the hub stats
+        Param chain:(tuple) - (symbol, expiry, underlying) key of the subscribed chain
+        Param maxsize:(integer) - Snapshots kept for a slow subscriber before new ones are dropped, 0 is unbounded
+        Param greeks:(bool) - Attach implied volatility and greeks to every snapshot
+        Param conflate:(bool) - Keep only the newest snapshot, older ones not consumed yet are dropped
+        Param ticks:(bool) - Also forward (symbol, last price) of every tick batch the hub receives on `ticks`
+        """
+        self.name = name
+        self.chain = chain
+        self.maxsize = maxsize
+        self.greeks = greeks
+        self.conflate = conflate
+        self.q = LatestValueChannel() if conflate else Queue(maxsize)
+        # Order updates are fanned out to every subscriber for its own order book
+        self.order_updates = Queue()
+        self.ticks = Queue() if ticks else None
+        self.published = Value('L', 0)
+        self.dropped = Value('L', 0)
+        self.analytics = None
+
+    @property
+    def depth(self):
+        """
+        Snapshots published but not consumed yet
+        """
+        return self.q.qsize()
+
+    @property
+    def dropped_count(self):
+        """
+        Snapshots dropped because the queue was full or superseded by a newer one
+        """
+        return self.dropped.value + (self.q.dropped if self.conflate else 0)
+
+    @property
+    def age(self):
+        """
+        Seconds between publishing and delivering the last snapshot, None without conflation
+        """
+        return self.q.age if self.conflate else None
+
+    def publish(self, option_chain):
+        try:
+            self.q.put_nowait(option_chain)
+        except Full:
+            with self.dropped.get_lock():
+                self.dropped.value += 1
+            return
+        with self.published.get_lock():
+            self.published.value += 1
+
+    def get(self, timeout=None):
+        """
+        Next snapshot of the chain
+        Param timeout:(float) - Seconds to wait, None waits forever, raises queue.Empty when it runs out
+        """
+        option_chain = self.q.get(timeout=timeout)
+        trace = getattr(option_chain, 'trace', None)
+        if trace is not None:
+            trace.mark('deliver')
+        if self.analytics is not None:
+            self.analytics.attach(option_chain)
+        return option_chain
+
+    def __iter__(self):
+        while 1:
+            yield self.get()
+
+
+class MarketDataHub(WebsocketClient):
+    """
+    Owns the ticker connection and snapshot publishing for all subscribed chains
+    Chains requested by several subscribers are fetched and subscribed once,
+    and tokens shared between chains are subscribed on the ticker once
+    Reuses the WebsocketClient tick, order update and connection callbacks
+    """
+
+    def __init__(
+        self,
+        api_key,
+        access_token,
+        record_dir=None,
+        report_interval=60,
+        storage=None,
+        atm_window=None,
+        window_mode=MODE_QUOTE,
+        shards=1,
+        ticker_root=None,
+    ):
+        """
+        Param api_key:(string) - Kite api key
+        Param access_token:(string) - Kite access token
+        Param record_dir:(string) - Directory to capture every tick in
+        Param report_interval:(float) - Seconds between subscriber queue depth reports
+        Param storage:(string or StorageBackend) - 'redis', 'memory', 'shm' or a backend instance, redis by default
+        Param atm_window:(integer) - Strikes subscribed on each side of the money for every chain, chains must
+        include their underlying. None subscribes every strike in FULL mode
+        Param window_mode:(string) - 'ltp' or 'quote', mode of the strikes in the window, held legs are FULL
+        Param shards:(integer) - Ticker connections the tokens are split across, each in its own process.
+        More than one needs a 'redis' or 'shm' store
+        Param ticker_root:(string) - Websocket endpoint, e.g. ws://127.0.0.1:port of a local fake ticker server
+        """
+        self.init_feed(api_key, access_token, storage, record_dir, ticker_root=ticker_root)
+        self.api_key = api_key
+        self.access_token = access_token
+        self.shards = shards
+        self.ticker_root = ticker_root
+        # Created on start when the tokens are split across several connections
+        self.ticker_shards = None
+        # (symbol, expiry, underlying) -> chain tokens and snapshot keys
+        self.chains = {}
+        self.subscriptions = []
+        self.expiry = None
+        self.report_interval = report_interval
+        self.atm_window = atm_window
+        self.window_mode = window_mode
+        self.started = False
+
+    def sync_instruments(self, incremental=True):
+        """
+        Sync master instrument to redis, once for every chain of the hub
+        Param incremental:(bool) - Write only contracts changed since the previous sync
+        """
+        self.instrumentClass.filter_redis_dump(incremental)
+
+    def subscribe(
+        self, symbol, expiry, underlying=False, name=None, maxsize=0, greeks=True, conflate=False, ticks=False
+    ):
+        """
+        Subscribe to the snapshots of a chain, must be called before start
+        Param symbol:(string) - Option contract symbol
+        Param expiry:(string) - Expiry date of the chain
+        Param underlying:(bool) - Include the underlying EQ contract in the chain
+        Param name:(string) - Subscriber name shown in the hub stats
+        Param maxsize:(integer) - Snapshots kept for a slow subscriber before new ones are dropped, 0 is unbounded
+        Param greeks:(bool) - Attach implied volatility and greeks to every snapshot
+        Param conflate:(bool) - Deliver only the newest snapshot, dropping the ones a slow subscriber missed
+        Param ticks:(bool) - Forward (symbol, last price) of every tick batch on the subscription `ticks` queue
+        """
+        if self.started:
+            raise RuntimeError('Subscriptions must be made before the hub is started')
+        key = (symbol, str(expiry), underlying)
+        if key not in self.chains:
+            token_list = self.instrumentClass.fetch_contract(symbol, str(expiry), underlying)
+            self.instrumentClass.load_token_details(token_list)
+            self.chains[key] = {
+                'token_list': token_list,
+                'option_keys': self.instrumentClass.option_data_keys(token_list),
+                'window': (
+                    StrikeWindow(token_list, self.instrumentClass.token_details, self.atm_window)
+                    if self.atm_window is not None
+                    else None
+                ),
+            }
+            # Tokens shared by several chains, e.g. the underlying, are subscribed once
+            self.token_list = list(dict.fromkeys(self.token_list + token_list))
+        subscription = Subscription(
+            name or '{}-{}'.format(symbol, len(self.subscriptions)), key, maxsize, greeks, conflate, ticks
+        )
+        if greeks:
+            subscription.analytics = ChainAnalytics(self.instrumentClass.token_details, expiry)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def on_order_update(self, ws, data):
+        for subscription in self.subscriptions:
+            subscription.order_updates.put(('order', data))
+
+    def publish_order_stream_status(self, connected):
+        for subscription in self.subscriptions:
+            subscription.order_updates.put(('stream', connected))
+
+    def hold_legs(self, symbols):
+        if self.ticker_shards is not None:
+            self.ticker_shards.hold(symbols)
+        else:
+            super().hold_legs(symbols)
+
+    def release_legs(self, symbols):
+        if self.ticker_shards is not None:
+            self.ticker_shards.release(symbols)
+        else:
+            super().release_legs(symbols)
+
+    def publish_ticks(self, option_records):
+        taps = [subscription.ticks for subscription in self.subscriptions if subscription.ticks is not None]
+        if taps:
+            ticks = [(symbol, option_data['last_price']) for symbol, _, option_data in option_records]
+            for tap in taps:
+                tap.put(ticks)
+
+    def publish(self):
+        """
+        Fetch every subscribed chain once and hand it to all of its subscribers
+        """
+        for key, chain in self.chains.items():
+            subscribers = [subscription for subscription in self.subscriptions if subscription.chain == key]
+            if not subscribers:
+                continue
+            option_keys = chain['window'].select(chain['option_keys']) if chain['window'] else chain['option_keys']
+            option_chain = self.instrumentClass.generate_optionChain(chain['token_list'], option_keys)
+            if self.last_batch is not None:
+                option_chain = trace_snapshot(option_chain, self.last_batch)
+            for subscription in subscribers:
+                subscription.publish(option_chain)
+
+    def stats(self):
+        """
+        Queue depth, published and dropped snapshot count of every subscriber
+        """
+        return [
+            {
+                'name': subscription.name,
+                'symbol': subscription.chain[0],
+                'expiry': subscription.chain[1],
+                'depth': subscription.depth,
+                'published': subscription.published.value,
+                'dropped': subscription.dropped_count,
+            }
+            for subscription in self.subscriptions
+        ]
+
+    def report(self):
+        for stat in self.stats():
+            logging.info(
+                "Subscriber {name} ({symbol} {expiry}): depth {depth}, published {published}, "
+                "dropped {dropped}".format(**stat)
+            )
+        if self.ticker_shards is not None:
+            self.ticker_shards.report()
+
+    def publish_loop(self, publish_on='interval', min_interval=0.2, max_staleness=1.0):
+        """
+        Publish all chains every second, or as ticks arrive coalescing bursts
+        Param publish_on:(string) - 'interval' to poll every second, 'ticks' to publish as ticks arrive
+        Param min_interval:(float) - Minimum seconds between snapshots when publishing on ticks
+        Param max_staleness:(float) - Heartbeat interval when publishing on ticks
+        """
+        published_version = None
+        last_publish = 0.0
+        last_report = time.monotonic()
+        while 1:
+            if publish_on == 'ticks':
+                self.tick_event.wait(timeout=max_staleness)
+                delay = min_interval - (time.monotonic() - last_publish)
+                if delay > 0:
+                    time.sleep(delay)
+                self.tick_event.clear()
+                version = self.tick_version.value
+                if version == published_version and time.monotonic() - last_publish < max_staleness:
+                    continue
+                published_version = version
+            else:
+                time.sleep(1)
+            self.publish()
+            last_publish = time.monotonic()
+            if last_publish - last_report >= self.report_interval:
+                self.report()
+                last_report = last_publish
+
+    def shard_groups(self):
+        """
+        Chains kept on one ticker connection, every expiry of a symbol together so that its underlying is
+        subscribed once and moves the strike windows on the same connection. None without strike windows,
+        the tokens are then split evenly
+        """
+        if self.atm_window is None:
+            return None
+        groups = {}
+        for (symbol, _, _), chain in self.chains.items():
+            tokens, windows = groups.setdefault(symbol, ([], []))
+            tokens.extend(chain['token_list'])
+            windows.append(chain['window'])
+        return list(groups.values())
+
+    def start(self, publish_on='interval', min_interval=0.2, max_staleness=1.0):
+        """
+        Start the ticker and the snapshot process, shared by every subscription
+        Param publish_on:(string) - 'interval' to snapshot every second,
+        'ticks' to snapshot as soon as new ticks are stored
+        Param min_interval:(float) - Minimum seconds between snapshots when publishing on ticks
+        Param max_staleness:(float) - Seconds after which an unchanged snapshot is republished
+        """
+        if publish_on not in ('interval', 'ticks'):
+            raise ValueError('Unknown publish mode - {}'.format(publish_on))
+        if not self.chains:
+            raise ValueError('No chain subscribed to the hub')
+        if self.shards > 1:
+            self.ticker_shards = TickerShards(
+                self,
+                self.api_key,
+                self.access_token,
+                self.shards,
+                self.ticker_root,
+                self.shard_groups(),
+                self.window_mode,
+            )
+        self.started = True
+        if self.ticker_shards is not None:
+            self.ticker_shards.start()
+        else:
+            if self.atm_window is not None:
+                self.subscription_manager = SubscriptionManager(
+                    [chain['window'] for chain in self.chains.values()], self.window_mode
+                )
+            self.start_worker(self.assign_callBacks)
+        # Delay to let intial ticks reach redis before the first snapshot
+        time.sleep(2)
+        self.start_worker(self.publish_loop, (publish_on, min_interval, max_staleness))
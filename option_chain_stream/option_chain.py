@@ -1,9 +1,14 @@
 """
 @author: rakeshr
 """
+
+from multiprocessing import Queue
+
 from kiteconnect import KiteConnect
 from websocket import WebsocketClient
 from instrument_file import InstrumentMaster
+from greeks import ChainAnalytics
+from storage import make_backend
 
 
 class OptionChain:
@@ -12,8 +17,27 @@ class OptionChain:
     """
 
     def __init__(
-        self, symbol, expiry, api_key, api_secret=None, request_token=None, access_token=None, underlying=False
+        self,
+        symbol,
+        expiry,
+        api_key,
+        api_secret=None,
+        request_token=None,
+        access_token=None,
+        underlying=False,
+        record_dir=None,
+        storage=None,
+        atm_window=None,
+        window_mode='quote',
     ):
+        """
+        Param storage:(string or StorageBackend) - Where instruments and ticks are kept, 'redis' (default),
+        'memory' to run the ticker and the snapshots in this process, 'shm' for shared memory
+        between the forked processes, or a backend instance
+        Param atm_window:(integer) - Strikes subscribed on each side of the money, the window follows spot and
+        needs underlying=True. None subscribes every strike in FULL mode
+        Param window_mode:(string) - 'ltp' or 'quote', mode of the strikes in the window, held legs are FULL
+        """
         self.symbol = symbol
         self.expiry = expiry
         self.api_key = api_key
@@ -21,17 +45,70 @@ class OptionChain:
         self.request_token = request_token
         self.access_token = access_token
         self.underlying = underlying
-        self.instrumentClass = InstrumentMaster(self.api_key)
+        # Capture every tick of the session under this directory when set
+        self.record_dir = record_dir
+        self.atm_window = atm_window
+        self.window_mode = window_mode
+        # One backend for the instrument sync and the websocket client, the in-process
+        # and shared memory stores only see what was written through the same instance
+        self.storage = make_backend(storage)
+        self.instrumentClass = InstrumentMaster(self.api_key, self.storage)
+        # Order updates pushed by the ticker, consumed by the strategy order book
+        self.order_updates = Queue()
+        # (symbol, last price) batches forwarded by the ticker, only after tap_ticks was called
+        self.tick_tap = None
+        # Seconds between publishing and delivering the last snapshot, None for the 'queue' transport
+        self.snapshot_age = None
 
-    def sync_instruments(self):
+    @property
+    def dropped_snapshots(self):
+        """
+        Snapshots superseded before the consumer got to them, always 0 for the 'queue' transport
+        """
+        return getattr(self.socketClient.q, 'dropped', 0)
+
+    def tap_ticks(self):
+        """
+        Queue receiving (symbol, last price) of every tick batch before it is stored,
+        must be called before create_option_chain
+        """
+        if self.tick_tap is None:
+            self.tick_tap = Queue()
+        return self.tick_tap
+
+    def hold_legs(self, symbols):
+        """
+        Stream the legs of an open position in FULL mode, no-op without an ATM window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        self.socketClient.hold_legs(symbols)
+
+    def release_legs(self, symbols):
+        """
+        Return closed legs to the window, no-op without an ATM window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        self.socketClient.release_legs(symbols)
+
+    def sync_instruments(self, incremental=True):
         """
         Sync master instrument to redis
+        Param incremental:(bool) - Write only contracts changed since the previous sync
         """
-        self.instrumentClass.filter_redis_dump()
+        self.instrumentClass.filter_redis_dump(incremental)
 
-    def create_option_chain(self):
+    def create_option_chain(
+        self, publish_on='interval', min_interval=0.2, max_staleness=1.0, transport='queue', greeks=True
+    ):
         """
         Wrapper method to fetch sreaming option chain for requested symbol/expiry
+        Param publish_on:(string) - 'interval' to snapshot every second,
+        'ticks' to snapshot as soon as new ticks are stored
+        Param min_interval:(float) - Minimum seconds between snapshots when publishing on ticks
+        Param max_staleness:(float) - Seconds after which an unchanged snapshot is republished
+        Param transport:(string) - 'queue' yields lists of dicts, 'latest' yields only the newest
+        list of dicts when the consumer falls behind, 'shm' yields ChainSnapshot views over shared memory
+        Param greeks:(bool) - Attach implied volatility, delta, gamma, theta and vega to every snapshot
         """
         # Assign/generate access_token using request_token and api_secret
         if self.api_secret and self.request_token:
@@ -41,9 +118,29 @@ class OptionChain:
         elif self.access_token:
             self.access_token = self.access_token
 
-        self.socketClient = WebsocketClient(self.symbol, self.expiry, self.api_key, self.access_token, self.underlying)
+        self.socketClient = WebsocketClient(
+            self.symbol,
+            self.expiry,
+            self.api_key,
+            self.access_token,
+            self.underlying,
+            self.order_updates,
+            self.record_dir,
+            self.storage,
+            self.tick_tap,
+            self.atm_window,
+            self.window_mode,
+        )
         # create streaming websocket data
-        self.socketClient.queue_callBacks()
+        self.socketClient.queue_callBacks(publish_on, min_interval, max_staleness, transport)
+        analytics = ChainAnalytics(self.socketClient.instrumentClass.token_details, self.expiry) if greeks else None
         # Keep fetching streaming Queue
         while 1:
-            yield self.socketClient.q.get()
+            option_chain = self.socketClient.q.get()
+            self.snapshot_age = getattr(self.socketClient.q, 'age', None)
+            trace = getattr(option_chain, 'trace', None)
+            if trace is not None:
+                trace.mark('deliver')
+            if analytics is not None:
+                analytics.attach(option_chain)
+            yield option_chain
@@ -6,15 +6,18 @@ Dump all exchange instruments/contract data to Redis
 Retrive strike and instrument token detail from redis for each symbol search
 """
 
-import redis
-import json
+from storage import make_backend
+
+SYNC_DIGEST_KEY = 'instruments:digest'
 
 class InstrumentDumpFetch():
     
-    def __init__(self):
-        # Default redis port connection
-        # Port no and host be edited by user or will make both as acceptable argument in later release 
-        self.conn = redis.StrictRedis(host='localhost', port=6379)
+    def __init__(self, backend=None):
+        """
+        Param backend:(string or StorageBackend) - 'redis', 'memory', 'shm' or a backend instance,
+        redis on the default port by default
+        """
+        self.backend = make_backend(backend)
 
     def data_dump(self, symbol, instrument_data):
         """
@@ -22,16 +25,42 @@ class InstrumentDumpFetch():
         Param symbol:(string) - Option contract symbol
         Param instrument_data:(dictionary) - List of dict for specific option contract containing all strike, etc 
         """
-        self.conn.set(symbol, json.dumps(instrument_data))
+        self.backend.set(symbol, instrument_data)
+
+    def data_dump_batch(self, instrument_items):
+        """
+        Dump many keys with batched writes
+        Param instrument_items:(Iterable of tuple) - (key, instrument_data) pairs
+        """
+        self.backend.set_many(instrument_items)
+
+    def delete_batch(self, symbols):
+        """
+        Delete many keys with batched writes
+        Param symbols:(List) - Keys to delete
+        """
+        self.backend.delete(symbols)
+
+    def fetch_sync_digest(self):
+        """
+        Digest of the instrument snapshot last written to redis
+        """
+        return self.backend.get(SYNC_DIGEST_KEY)
+
+    def store_sync_digest(self, digest):
+        """
+        Record the digest of the instrument snapshot written to redis
+        Param digest:(string) - InstrumentSnapshot digest
+        """
+        self.backend.set(SYNC_DIGEST_KEY, digest)
 
     def symbol_data(self, symbol):    
         """
         Return instrument detail for required symbol
         Param symbol:(string) - Option contract symbol to be searched
         """
-        try:
-            contract_detail = json.loads(self.conn.get(symbol))
-        except TypeError:
+        contract_detail = self.backend.get(symbol)
+        if contract_detail is None:
             raise Exception('Key not found - {}'.format(symbol))
         return contract_detail
 
@@ -40,12 +69,19 @@ class InstrumentDumpFetch():
         Fetch contract name for requested instrument token
         Param token:(integer) - Instrument token 
         """
-        try:
-            token_instrument = json.loads(self.conn.get(token))
-        except Exception as e:
-            raise Exception('Error {}'.format(e))
+        token_instrument = self.backend.get(token)
+        if token_instrument is None:
+            raise Exception('Error Key not found - {}'.format(token))
         return token_instrument
 
+    def fetch_tokens(self, tokens):
+        """
+        Fetch contract name for a batch of instrument tokens in one round trip
+        Param tokens:(List of integer) - Instrument tokens
+        Missing tokens are returned as None
+        """
+        return self.backend.mget(tokens)
+
     def store_optiondata(self, tradingsymbol, token, optionData):
         """
         Store option chain data for requested symbol
@@ -53,9 +89,22 @@ class InstrumentDumpFetch():
         Param token:(integer) - Instrument token
         Param optionData:(dict) - Complete data dump for specific option symbol
         """
-        optionChainKey = '{}:{}'.format(tradingsymbol, token)
+        optionChainKey = self.option_data_key(tradingsymbol, token)
+        try:
+            self.backend.set(optionChainKey, optionData)
+        except Exception as e:
+            raise Exception('Error - {}'.format(e))
+
+    def store_optiondata_batch(self, optionRecords):
+        """
+        Store a batch of option chain data in one batched write
+        Param optionRecords:(List of tuple) - (tradingsymbol, token, optionData) for each tick
+        """
         try:
-            self.conn.set(optionChainKey, json.dumps(optionData))
+            self.backend.set_many(
+                (self.option_data_key(tradingsymbol, token), optionData)
+                for tradingsymbol, token, optionData in optionRecords
+            )
         except Exception as e:
             raise Exception('Error - {}'.format(e))
 
@@ -65,9 +114,27 @@ class InstrumentDumpFetch():
         Param symbol:(string) - Option contract symbol
         Param token:(integer) - Instrument token
         """
-        optionContractKey = '{}:{}'.format(tradingsymbol, token)
+        optionContractKey = self.option_data_key(tradingsymbol, token)
+        token_data = self.backend.get(optionContractKey)
+        if token_data is None:
+            raise Exception('Error - Key not found - {}'.format(optionContractKey))
+        return token_data
+
+    def option_data_key(self, tradingsymbol, token):
+        """
+        Key under which option data for a contract is stored
+        Param symbol:(string) - Option contract symbol
+        Param token:(integer) - Instrument token
+        """
+        return '{}:{}'.format(tradingsymbol, token)
+
+    def fetch_option_data_batch(self, optionContractKeys):
+        """
+        Fetch stored option data for a precomputed list of keys in one batched read
+        Param optionContractKeys:(List of string) - Keys from option_data_key
+        Keys without any tick yet are skipped
+        """
         try:
-            token_data = json.loads(self.conn.get(optionContractKey))
+            return [token_data for token_data in self.backend.mget(optionContractKeys) if token_data is not None]
         except Exception as e:
             raise Exception('Error - {}'.format(e))
-        return token_data
\ No newline at end of file
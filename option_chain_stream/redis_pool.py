@@ -0,0 +1,202 @@
+"""
+Process wide redis connection pool shared by the feed, instrument and order modules
+configure() sets host, port or unix socket and timeouts once, every client
+returned by redis_connection() checks connections out of the same pool.
+A forked process gets a fresh pool and fresh stats on its first command
+"""
+
+import os
+import threading
+import time
+
+import redis
+from redis.connection import Connection, UnixDomainSocketConnection
+
+DEFAULT_CONFIG = {
+    'host': 'localhost',
+    'port': 6379,
+    'db': 0,
+    'unix_socket_path': None,
+    'socket_timeout': None,
+    'socket_connect_timeout': None,
+    # Connections kept by one process, further checkouts wait for a release
+    'max_connections': 50,
+    # Seconds a checkout waits for a free connection before raising ConnectionError
+    'pool_timeout': 20,
+}
+
+
+class PoolStats:
+    """
+    Connection churn of the pool in this process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.created = 0
+        self.connects = 0
+        self.reconnects = 0
+
+    def as_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'created': self.created,
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+        }
+
+
+_stats = PoolStats()
+
+
+class _CountingConnection:
+    """
+    Counts socket connects, a connection connecting again after a drop is a reconnect
+    """
+
+    def _connect(self):
+        sock = super()._connect()
+        with _stats.lock:
+            _stats.connects += 1
+            if getattr(self, 'connected_before', False):
+                _stats.reconnects += 1
+        self.connected_before = True
+        return sock
+
+
+class TCPConnection(_CountingConnection, Connection):
+    pass
+
+
+class UnixSocketConnection(_CountingConnection, UnixDomainSocketConnection):
+    pass
+
+
+class SharedConnectionPool(redis.BlockingConnectionPool):
+    """
+    Blocking pool recording checkouts and waits, reconfigured in place so that clients
+    created before configure() was called pick up the new settings
+    """
+
+    def __init__(self, config):
+        super().__init__(**self._pool_kwargs(config))
+
+    @staticmethod
+    def _pool_kwargs(config):
+        kwargs = {
+            'max_connections': config['max_connections'],
+            'timeout': config['pool_timeout'],
+            'db': config['db'],
+            'socket_timeout': config['socket_timeout'],
+            'socket_connect_timeout': config['socket_connect_timeout'],
+        }
+        if config['unix_socket_path']:
+            kwargs.update(connection_class=UnixSocketConnection, path=config['unix_socket_path'])
+        else:
+            kwargs.update(connection_class=TCPConnection, host=config['host'], port=config['port'])
+        return kwargs
+
+    def reconfigure(self, config):
+        """
+        Drop every connection and use the new settings for the next ones
+        Param config:(dict) - Pool settings, see DEFAULT_CONFIG
+        """
+        kwargs = self._pool_kwargs(config)
+        self.disconnect()
+        self.max_connections = kwargs.pop('max_connections')
+        self.timeout = kwargs.pop('timeout')
+        self.connection_class = kwargs.pop('connection_class')
+        # Keep the defaults redis adds to the connection settings, switching between tcp and unix socket
+        # drops the address settings of the other transport
+        connection_kwargs = {
+            key: value for key, value in self.connection_kwargs.items() if key not in ('host', 'port', 'path')
+        }
+        connection_kwargs.update(kwargs)
+        self.connection_kwargs = connection_kwargs
+        self.reset()
+
+    def get_connection(self, *args, **kwargs):
+        # An empty queue means every connection is checked out and this checkout blocks
+        waiting = self.pool.empty() and self.pid == os.getpid()
+        start = time.monotonic()
+        connection = super().get_connection(*args, **kwargs)
+        with _stats.lock:
+            _stats.checkouts += 1
+            if waiting:
+                _stats.waits += 1
+                _stats.wait_time += time.monotonic() - start
+        return connection
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with _stats.lock:
+            _stats.created += 1
+        return connection
+
+
+_config = dict(DEFAULT_CONFIG)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _after_fork():
+    # Locks held by other threads at fork time would never be released in the child
+    global _pool_lock
+    _pool_lock = threading.Lock()
+    _stats.__init__()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def configure(**settings):
+    """
+    Set the redis connection settings of this process and the processes forked after it
+    Param settings:(dict) - Keys of DEFAULT_CONFIG, e.g. host, port, unix_socket_path, socket_timeout
+    """
+    unknown = set(settings) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError('Unknown redis settings - {}'.format(sorted(unknown)))
+    _config.update(settings)
+    with _pool_lock:
+        if _pool is not None:
+            _pool.reconfigure(_config)
+
+
+def connection_pool():
+    """
+    The shared pool, created on first use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SharedConnectionPool(_config)
+        return _pool
+
+
+def redis_connection():
+    """
+    Redis client backed by the shared pool, cheap to create since it holds no connection itself
+    """
+    return redis.StrictRedis(connection_pool=connection_pool())
+
+
+def pool_stats():
+    """
+    Checkouts, waits, created connections and reconnects of this process since it started or forked
+    """
+    with _stats.lock:
+        stats = _stats.as_dict()
+    if _pool is not None:
+        stats['max_connections'] = _pool.max_connections
+        # Connections inherited from the parent are dropped on the first checkout after a fork
+        stats['open_connections'] = len(_pool._connections) if _pool.pid == os.getpid() else 0
+    return stats
@@ -0,0 +1,436 @@
+"""
+Key value storage backends behind InstrumentDumpFetch
+Redis keeps the original behaviour, the in-process store serves a single
+process pipeline and the shared memory store serves forked processes
+on the same box without a socket round trip
+"""
+
+import json
+import os
+import pickle
+import struct
+import time
+import weakref
+import zlib
+from contextlib import nullcontext
+from multiprocessing import RLock
+from multiprocessing.shared_memory import SharedMemory
+
+import codec
+from redis_pool import redis_connection
+
+STORAGE_BACKENDS = ('redis', 'memory', 'shm')
+
+
+class StorageBackend:
+    """
+    Interface of a backend, values are JSON compatible objects
+    Keys are compared as strings, so token 123 and '123' are the same key
+    """
+
+    # Whether a value written in one process can be read from another one
+    process_shared = False
+
+    def get(self, key):
+        """
+        Param key:(string or integer) - Key to read
+        Returns the value or None when the key is not set
+        """
+        raise NotImplementedError
+
+    def mget(self, keys):
+        """
+        Param keys:(List) - Keys to read
+        Returns the values in key order, None for keys that are not set
+        """
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        """
+        Param key:(string or integer) - Key to write
+        Param value:(object) - JSON compatible value
+        """
+        raise NotImplementedError
+
+    def set_many(self, items):
+        """
+        Param items:(Iterable of tuple) - (key, value) pairs
+        """
+        for key, value in items:
+            self.set(key, value)
+
+    def delete(self, keys):
+        """
+        Param keys:(List) - Keys to delete, keys that are not set are ignored
+        """
+        raise NotImplementedError
+
+    def close(self, unlink=False):
+        """
+        Param unlink:(bool) - Also release resources shared with other processes
+        """
+
+
+class RedisBackend(StorageBackend):
+    """
+    Tick data and contract metadata are stored as binary records in redis, other values as JSON
+    Values written as JSON by earlier releases are read either way
+    """
+
+    process_shared = True
+
+    def __init__(self, chunk_size=5000, encoding='binary', connection=None):
+        """
+        Param chunk_size:(integer) - Number of writes or deletes sent per round trip
+        Param encoding:(string) - 'binary' for codec records, 'json' to keep writing JSON for older readers
+        Param connection:(Redis) - Client to use, one on the shared pool set up with redis_pool.configure by default
+        """
+        if encoding not in ('binary', 'json'):
+            raise ValueError('Unknown encoding - {}'.format(encoding))
+        self.conn = connection if connection is not None else redis_connection()
+        self.chunk_size = chunk_size
+        self.encode = codec.encode if encoding == 'binary' else json.dumps
+
+    def get(self, key):
+        value = self.conn.get(key)
+        return codec.decode(value) if value is not None else None
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        decode = codec.decode
+        return [decode(value) if value is not None else None for value in self.conn.mget(keys)]
+
+    def set(self, key, value):
+        self.conn.set(key, self.encode(value))
+
+    def set_many(self, items):
+        encode = self.encode
+        pipe = self.conn.pipeline(transaction=False)
+        for idx, (key, value) in enumerate(items, 1):
+            pipe.set(key, encode(value))
+            if idx % self.chunk_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def delete(self, keys):
+        keys = list(keys)
+        for idx in range(0, len(keys), self.chunk_size):
+            self.conn.delete(*keys[idx : idx + self.chunk_size])
+
+
+class InProcessStore(StorageBackend):
+    """
+    Plain dict, for pipelines running the ticker and the snapshots in one process
+    Values are kept by reference, writers replace values instead of updating them
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(str(key))
+
+    def mget(self, keys):
+        get = self.data.get
+        return [get(str(key)) for key in keys]
+
+    def set(self, key, value):
+        self.data[str(key)] = value
+
+    def set_many(self, items):
+        self.data.update((str(key), value) for key, value in items)
+
+    def delete(self, keys):
+        for key in keys:
+            self.data.pop(str(key), None)
+
+
+# seq, key hash, key length, value length, arena offset of values not stored inline
+SLOT_HEADER = struct.Struct('<QIHxxIQ')
+# arena bytes used, number of slots, number of keys
+STORE_HEADER = struct.Struct('<QQQ')
+MAX_KEY_SIZE = 64
+SLOT_SIZE = 256
+INLINE_SIZE = SLOT_SIZE - SLOT_HEADER.size - MAX_KEY_SIZE
+DELETED = 0xFFFFFFFF
+# Slots kept for every key while the table can grow, the free ones take the keys
+# written after the processes fork, e.g. the option data of every subscribed token
+SLOTS_PER_KEY = 4
+# Seconds a reader waits on a slot left mid write, e.g. by a writer process that died
+READ_TIMEOUT = 1.0
+
+# Shared memory stores of this process that can still be resized, none can once it forks
+_GROWABLE = weakref.WeakSet()
+
+
+def _stop_growing():
+    for store in _GROWABLE:
+        # Waits for a resize in progress, the child must not map a half moved table
+        with store.lock:
+            store.growable = False
+    _GROWABLE.clear()
+
+
+os.register_at_fork(before=_stop_growing)
+
+
+def _power_of_two(value):
+    return 1 << max(value - 1, 0).bit_length()
+
+
+class SharedMemoryStore(StorageBackend):
+    """
+    Open addressing slot table in shared memory, must be created before the processes fork
+    Values are pickled, all processes sharing the table belong to the same application
+    Small values such as option data live inline in their slot, larger ones such as
+    symbol contract lists live in an arena, in power of two blocks that an overwrite
+    reuses when the new value fits. Until the process first forks, e.g. while the
+    instruments are synced, the table and the arena grow with what is written, after
+    that their size is fixed and a full arena is compacted in place.
+    Slots do not move once shared, so every process caches key -> slot once. Each slot
+    carries a sequence number that is odd while it is written, readers retry until they
+    see the same even number before and after copying the value. Inline updates assume a
+    single writer per key, like the ticker process for option data, new keys and arena
+    values, which compaction moves, are written under a lock. While the table can grow,
+    a resize swaps the buffer, so readers take the lock as well until the process forks
+    """
+
+    process_shared = True
+
+    def __init__(self, n_keys=1 << 12, arena_size=1 << 20):
+        """
+        Param n_keys:(integer) - Keys expected, the table grows past them until the process forks
+        Param arena_size:(integer) - Initial bytes for values that do not fit a slot
+        """
+        # Reentrant, a resize re-inserts the keys through the locked insert paths
+        self.lock = RLock()
+        self.growable = True
+        _GROWABLE.add(self)
+        self._allocate(_power_of_two(n_keys * SLOTS_PER_KEY), arena_size)
+
+    def _allocate(self, n_slots, arena_size):
+        self.n_slots = n_slots
+        self.slots_offset = STORE_HEADER.size
+        self.arena_offset = self.slots_offset + n_slots * SLOT_SIZE
+        self.arena_size = arena_size
+        self.shm = SharedMemory(create=True, size=self.arena_offset + arena_size)
+        self.buf = self.shm.buf
+        self.buf[: self.arena_offset] = bytes(self.arena_offset)
+        STORE_HEADER.pack_into(self.buf, 0, 0, n_slots, 0)
+        # key -> slot position, valid until the table is resized
+        self.positions = {}
+
+    def _resize(self, n_slots, extra=0):
+        """
+        Move the live keys to a new table and arena, only while no other process maps the store
+        Holds the lock, which every access takes while the store is growable
+        Param n_slots:(integer) - Slot count of the new table
+        Param extra:(integer) - Arena bytes needed on top of the live values
+        """
+        with self.lock:
+            items = list(self._items())
+            live = sum(_power_of_two(len(encoded)) for _, encoded in items if len(encoded) > INLINE_SIZE)
+            old = self.shm
+            self.buf = None
+            self._allocate(n_slots, max(self.arena_size, _power_of_two(2 * (live + extra))))
+            for key, encoded in items:
+                self._store(self._position(key, create=True), encoded)
+            old.close()
+            old.unlink()
+
+    def _guard(self):
+        """
+        The lock while a resize may swap the table under the caller, no lock once the process forked
+        """
+        return self.lock if self.growable else nullcontext()
+
+    def _items(self):
+        buf = self.buf
+        for idx in range(self.n_slots):
+            position = self.slots_offset + idx * SLOT_SIZE
+            _, _, key_length, value_length, _ = SLOT_HEADER.unpack_from(buf, position)
+            if key_length and value_length != DELETED:
+                key_start = position + SLOT_HEADER.size
+                yield bytes(buf[key_start : key_start + key_length]).decode(), self._read(position)
+
+    def _position(self, key, create=False):
+        position = self.positions.get(key)
+        if position is not None:
+            return position
+        encoded = key.encode()
+        if len(encoded) > MAX_KEY_SIZE:
+            raise ValueError('Key longer than {} bytes - {}'.format(MAX_KEY_SIZE, key))
+        key_hash = zlib.crc32(encoded)
+        mask = self.n_slots - 1
+        idx = key_hash & mask
+        buf = self.buf
+        for _ in range(self.n_slots):
+            position = self.slots_offset + idx * SLOT_SIZE
+            _, slot_hash, key_length, _, _ = SLOT_HEADER.unpack_from(buf, position)
+            if key_length == 0:
+                if not create:
+                    return None
+                if self.growable and (STORE_HEADER.unpack_from(buf, 0)[2] + 1) * SLOTS_PER_KEY > self.n_slots:
+                    self._resize(self.n_slots * 2)
+                    return self._position(key, create)
+                with self.lock:
+                    # Another process may have claimed the slot since it was read
+                    _, slot_hash, key_length, _, _ = SLOT_HEADER.unpack_from(buf, position)
+                    if key_length == 0:
+                        key_start = position + SLOT_HEADER.size
+                        buf[key_start : key_start + len(encoded)] = encoded
+                        SLOT_HEADER.pack_into(buf, position, 0, key_hash, len(encoded), DELETED, 0)
+                        used, n_slots, n_keys = STORE_HEADER.unpack_from(buf, 0)
+                        STORE_HEADER.pack_into(buf, 0, used, n_slots, n_keys + 1)
+                        self.positions[key] = position
+                        return position
+            if slot_hash == key_hash and key_length == len(encoded):
+                key_start = position + SLOT_HEADER.size
+                if bytes(buf[key_start : key_start + key_length]) == encoded:
+                    self.positions[key] = position
+                    return position
+            idx = (idx + 1) & mask
+        raise ValueError('Shared memory store is full, {} slots'.format(self.n_slots))
+
+    def _read(self, position):
+        buf = self.buf
+        deadline = None
+        while True:
+            seq, _, _, value_length, value_offset = SLOT_HEADER.unpack_from(buf, position)
+            if seq & 1:
+                # Let the writer finish, a slot that stays odd was left by a writer that died
+                if deadline is None:
+                    deadline = time.monotonic() + READ_TIMEOUT
+                elif time.monotonic() > deadline:
+                    raise RuntimeError('Shared memory store slot {} left mid write'.format(position))
+                time.sleep(0)
+                continue
+            if value_length == DELETED:
+                value = None
+            elif value_offset:
+                value = bytes(buf[value_offset : value_offset + value_length])
+            else:
+                value_start = position + SLOT_HEADER.size + MAX_KEY_SIZE
+                value = bytes(buf[value_start : value_start + value_length])
+            if SLOT_HEADER.unpack_from(buf, position)[0] == seq:
+                return value
+
+    def _arena_block(self, size):
+        """
+        Offset of a new arena block, compacts the arena when it is full. Called with the lock held
+        Param size:(integer) - Block size, a power of two
+        """
+        buf = self.buf
+        used, n_slots, n_keys = STORE_HEADER.unpack_from(buf, 0)
+        if used + size > self.arena_size:
+            used = self._compact()
+            if used + size > self.arena_size:
+                raise ValueError('Shared memory store arena is full, {} bytes'.format(self.arena_size))
+        STORE_HEADER.pack_into(buf, 0, used + size, n_slots, n_keys)
+        return self.arena_offset + used
+
+    def _compact(self):
+        """
+        Move the arena values to the start of the arena, dropping overwritten and deleted ones
+        Called with the lock held, returns the arena bytes still used
+        """
+        buf = self.buf
+        blocks = []
+        for idx in range(self.n_slots):
+            position = self.slots_offset + idx * SLOT_SIZE
+            value_offset = SLOT_HEADER.unpack_from(buf, position)[4]
+            if value_offset:
+                blocks.append((value_offset, position))
+        used = 0
+        # Blocks only move towards the start, so a block never overwrites one that is still to move
+        for value_offset, position in sorted(blocks):
+            seq, key_hash, key_length, value_length, _ = SLOT_HEADER.unpack_from(buf, position)
+            target = self.arena_offset + used
+            if target != value_offset:
+                SLOT_HEADER.pack_into(buf, position, seq + 1, key_hash, key_length, value_length, value_offset)
+                buf[target : target + value_length] = bytes(buf[value_offset : value_offset + value_length])
+                SLOT_HEADER.pack_into(buf, position, seq + 2, key_hash, key_length, value_length, target)
+            used += _power_of_two(value_length)
+        _, n_slots, n_keys = STORE_HEADER.unpack_from(buf, 0)
+        STORE_HEADER.pack_into(buf, 0, used, n_slots, n_keys)
+        return used
+
+    def _store(self, position, encoded):
+        """
+        Write a value to its slot, with the lock held when the slot has or gets an arena value
+        """
+        buf = self.buf
+        value_offset = 0
+        if len(encoded) > INLINE_SIZE:
+            _, _, _, value_length, value_offset = SLOT_HEADER.unpack_from(buf, position)
+            if not value_offset or len(encoded) > _power_of_two(value_length):
+                value_offset = self._arena_block(_power_of_two(len(encoded)))
+        # Compacting may have moved the slot value and bumped its sequence number
+        seq, key_hash, key_length, _, _ = SLOT_HEADER.unpack_from(buf, position)
+        SLOT_HEADER.pack_into(buf, position, seq + 1, key_hash, key_length, len(encoded), value_offset)
+        value_start = value_offset or position + SLOT_HEADER.size + MAX_KEY_SIZE
+        buf[value_start : value_start + len(encoded)] = encoded
+        SLOT_HEADER.pack_into(buf, position, seq + 2, key_hash, key_length, len(encoded), value_offset)
+
+    def get(self, key):
+        with self._guard():
+            position = self._position(str(key))
+            if position is None:
+                return None
+            value = self._read(position)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        key = str(key)
+        encoded = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._guard():
+            if self.growable and len(encoded) > INLINE_SIZE:
+                size = _power_of_two(len(encoded))
+                if STORE_HEADER.unpack_from(self.buf, 0)[0] + size > self.arena_size:
+                    # Grow instead of compacting while no other process maps the arena
+                    self._resize(self.n_slots, size)
+            position = self._position(key, create=True)
+            if len(encoded) > INLINE_SIZE or SLOT_HEADER.unpack_from(self.buf, position)[4]:
+                with self.lock:
+                    self._store(position, encoded)
+            else:
+                self._store(position, encoded)
+
+    def delete(self, keys):
+        with self._guard():
+            buf = self.buf
+            for key in keys:
+                position = self._position(str(key))
+                if position is None:
+                    continue
+                if SLOT_HEADER.unpack_from(buf, position)[4]:
+                    with self.lock:
+                        self._clear(position)
+                else:
+                    self._clear(position)
+
+    def _clear(self, position):
+        seq, key_hash, key_length, _, _ = SLOT_HEADER.unpack_from(self.buf, position)
+        SLOT_HEADER.pack_into(self.buf, position, seq + 2, key_hash, key_length, DELETED, 0)
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def make_backend(storage=None):
+    """
+    Param storage:(string or StorageBackend) - 'redis', 'memory', 'shm' or a backend instance, redis by default
+    """
+    if storage is None or storage == 'redis':
+        return RedisBackend()
+    if isinstance(storage, StorageBackend):
+        return storage
+    if storage == 'memory':
+        return InProcessStore()
+    if storage == 'shm':
+        return SharedMemoryStore()
+    raise ValueError('Unknown storage backend - {}'.format(storage))
@@ -0,0 +1,217 @@
+"""
+Ticker subscriptions following the underlying price
+Only the strikes around the money are subscribed, in LTP or QUOTE mode,
+and the legs the strategy holds in FULL mode. The window moves with
+spot and the snapshot processes read it from shared memory
+"""
+
+import logging
+from bisect import bisect_left
+from multiprocessing import Array, Queue, Value
+from queue import Empty
+
+MODE_LTP = 'ltp'
+MODE_QUOTE = 'quote'
+MODE_FULL = 'full'
+
+
+class StrikeWindow:
+    """
+    ATM +- width strikes of one chain, the underlying is always part of the window
+    """
+
+    def __init__(self, token_list, token_details, width):
+        """
+        Param token_list:(List of integer) - Tokens of the chain, the underlying included
+        Param token_details:(dict) - Contract detail for every token
+        Param width:(integer) - Strikes kept on each side of the strike nearest to spot
+        """
+        self.token_list = list(token_list)
+        self.width = width
+        self.underlying_tokens = [token for token in self.token_list if token_details[token]['type'] == 'EQ']
+        if not self.underlying_tokens:
+            raise ValueError('A strike window needs the underlying in the chain')
+        strike_tokens = {}
+        for token in self.token_list:
+            if token_details[token]['type'] in ('CE', 'PE'):
+                strike_tokens.setdefault(float(token_details[token]['strike']), []).append(token)
+        self.strikes = sorted(strike_tokens)
+        self.strike_tokens = [strike_tokens[strike] for strike in self.strikes]
+        self.symbol_tokens = {token_details[token]['symbol']: token for token in self.token_list}
+        self.atm_index = None
+        # Tokens of token_list in the window, written by the ticker process and read by the snapshot process
+        self.mask = Array('b', len(self.token_list), lock=False)
+        self.version = Value('L', 0)
+        self._selected_version = None
+        self._selected = None
+
+    def update(self, price):
+        """
+        Recenter on the strike nearest to the underlying price, True when the window moved
+        Param price:(float) - Underlying last price
+        """
+        idx = bisect_left(self.strikes, price)
+        if idx == len(self.strikes):
+            idx -= 1
+        elif idx > 0 and price - self.strikes[idx - 1] <= self.strikes[idx] - price:
+            idx -= 1
+        if idx == self.atm_index:
+            return False
+        self.atm_index = idx
+        return True
+
+    def tokens(self):
+        """
+        Underlying tokens and the tokens of the strikes in the window, only the underlying before its first tick
+        """
+        tokens = set(self.underlying_tokens)
+        if self.atm_index is not None:
+            for strike_tokens in self.strike_tokens[
+                max(0, self.atm_index - self.width) : self.atm_index + self.width + 1
+            ]:
+                tokens.update(strike_tokens)
+        return tokens
+
+    @property
+    def atm_strike(self):
+        return self.strikes[self.atm_index] if self.atm_index is not None else None
+
+    def publish(self, subscribed):
+        """
+        Share the subscribed tokens of the chain with the snapshot process
+        Param subscribed:(set) - Every subscribed token, tokens of other chains are ignored
+        """
+        mask = [token in subscribed for token in self.token_list]
+        if mask == list(map(bool, self.mask)):
+            return
+        self.mask[:] = mask
+        with self.version.get_lock():
+            self.version.value += 1
+
+    def select(self, items):
+        """
+        Entries of the subscribed tokens, recomputed only after the window moved
+        Every entry until the ticker connected and subscribed the first window
+        Param items:(list) - Values aligned with token_list, e.g. the option data keys
+        """
+        version = self.version.value
+        if version == 0:
+            return items
+        if version != self._selected_version:
+            self._selected = [item for item, subscribed in zip(items, self.mask) if subscribed]
+            self._selected_version = version
+        return self._selected
+
+
+class SubscriptionManager:
+    """
+    Keeps the ticker subscribed to the strike windows of every chain and the held legs
+    Lives in the ticker process, held legs are sent to it from the strategy process
+    """
+
+    def __init__(self, windows, mode=MODE_QUOTE):
+        """
+        Param windows:(List of StrikeWindow) - Window of every chain
+        Param mode:(string) - 'ltp' or 'quote', mode of the window tokens, held legs are always 'full'
+        """
+        if mode not in (MODE_LTP, MODE_QUOTE):
+            raise ValueError('Unknown window mode - {}'.format(mode))
+        self.windows = windows
+        self.mode = mode
+        # ('hold', symbols) and ('release', symbols) messages from the strategy process
+        self.leg_updates = Queue()
+        self.held = set()
+        # Subscribed token -> mode
+        self.modes = {}
+        self.by_underlying = {}
+        self.symbol_tokens = {}
+        for window in windows:
+            for token in window.underlying_tokens:
+                self.by_underlying.setdefault(token, []).append(window)
+            self.symbol_tokens.update(window.symbol_tokens)
+
+    def hold(self, symbols):
+        """
+        Switch the legs of an open position to FULL mode, they stay subscribed outside the window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        self.leg_updates.put(('hold', list(symbols)))
+
+    def release(self, symbols):
+        """
+        Return closed legs to the window mode, or unsubscribe them when outside the window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        self.leg_updates.put(('release', list(symbols)))
+
+    def _drain_legs(self):
+        changed = False
+        while 1:
+            try:
+                kind, symbols = self.leg_updates.get_nowait()
+            except Empty:
+                return changed
+            tokens = {self.symbol_tokens[symbol] for symbol in symbols if symbol in self.symbol_tokens}
+            if kind == 'hold':
+                self.held |= tokens
+            else:
+                self.held -= tokens
+            changed = True
+
+    def desired_modes(self):
+        modes = {}
+        for window in self.windows:
+            for token in window.tokens():
+                modes[token] = self.mode
+        for token in self.held:
+            modes[token] = MODE_FULL
+        return modes
+
+    def apply(self, ws):
+        """
+        Subscribe, switch modes and unsubscribe so the ticker matches the windows and held legs
+        Param ws:(KiteTicker) - Connected ticker
+        """
+        modes = self.desired_modes()
+        added = [token for token in modes if token not in self.modes]
+        removed = [token for token in self.modes if token not in modes]
+        if added:
+            ws.subscribe(added)
+        for mode in (MODE_LTP, MODE_QUOTE, MODE_FULL):
+            tokens = [
+                token for token, token_mode in modes.items() if token_mode == mode and self.modes.get(token) != mode
+            ]
+            if tokens:
+                ws.set_mode(mode, tokens)
+        if removed:
+            ws.unsubscribe(removed)
+        self.modes = modes
+        subscribed = set(modes)
+        for window in self.windows:
+            window.publish(subscribed)
+        logging.info(
+            'Subscriptions at ATM {}: {} tokens, {} held, +{} -{}'.format(
+                [window.atm_strike for window in self.windows], len(modes), len(self.held), len(added), len(removed)
+            )
+        )
+
+    def on_connect(self, ws):
+        # A new connection starts without subscriptions
+        self._drain_legs()
+        self.modes = {}
+        self.apply(ws)
+
+    def on_ticks(self, ws, ticks):
+        """
+        Move the windows with the underlying and pick up held leg changes
+        Param ws:(KiteTicker) - Connected ticker
+        Param ticks:(List of dict) - Ticks as received from KiteTicker
+        """
+        changed = self._drain_legs()
+        for tick in ticks:
+            windows = self.by_underlying.get(tick['instrument_token'])
+            if windows is not None:
+                for window in windows:
+                    changed = window.update(tick['last_price']) or changed
+        if changed:
+            self.apply(ws)
@@ -0,0 +1,209 @@
+"""
+Append only columnar tick capture, one directory per session
+Every column is a flat little endian array so readers can mmap it directly
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+FORMAT_VERSION = 1
+COLUMNS = {
+    'token': '<u4',
+    'exchange_timestamp': '<i8',  # milliseconds since epoch
+    'last_price': '<f8',
+    'volume': '<i8',
+    'change': '<f8',
+}
+META_FILE = 'meta.json'
+
+
+def session_path(root, session=None):
+    """
+    Param root:(string) - Directory holding all recorded sessions
+    Param session:(date) - Trading day, today by default
+    """
+    return os.path.join(root, str(session or date.today()))
+
+
+def _epoch_ms(timestamp):
+    if isinstance(timestamp, datetime):
+        return int(timestamp.timestamp() * 1000)
+    return None
+
+
+class TickRecorder:
+    """
+    Appends ticks of a session to per column files
+    Writes go through the file buffer and are flushed every flush_interval seconds
+    """
+
+    def __init__(self, root, contracts=None, session=None, flush_interval=1.0, expiry=None):
+        """
+        Param root:(string) - Directory holding all recorded sessions
+        Param contracts:(dict) - Token -> contract detail, saved so the session can be replayed on its own
+        Param session:(date) - Trading day, today by default
+        Param flush_interval:(float) - Seconds between flushes of the column files
+        Param expiry:(string) - Expiry of the recorded chain, lets replays compute greeks
+        """
+        self.path = session_path(root, session)
+        os.makedirs(self.path, exist_ok=True)
+        self.write_meta(contracts or {}, expiry)
+        self.align_columns()
+        self.files = {column: open(os.path.join(self.path, column + '.bin'), 'ab') for column in COLUMNS}
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def write_meta(self, contracts, expiry=None):
+        meta_path = os.path.join(self.path, META_FILE)
+        meta = {'version': FORMAT_VERSION, 'columns': COLUMNS, 'contracts': {}}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['version'] != FORMAT_VERSION:
+                raise ValueError('Session {} was recorded with format {}'.format(self.path, meta['version']))
+        meta['contracts'].update({str(token): detail for token, detail in contracts.items()})
+        if expiry is not None:
+            meta['expiry'] = str(expiry)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def align_columns(self):
+        """
+        Cut every column back to the rows all of them hold before appending. A recorder stopped
+        between column writes leaves them ragged, and rows appended after that would not line up
+        Returns the number of rows kept
+        """
+        paths = {column: os.path.join(self.path, column + '.bin') for column in COLUMNS}
+        sizes = {column: os.path.getsize(path) if os.path.exists(path) else 0 for column, path in paths.items()}
+        rows = min(sizes[column] // np.dtype(dtype).itemsize for column, dtype in COLUMNS.items())
+        for column, dtype in COLUMNS.items():
+            size = rows * np.dtype(dtype).itemsize
+            if sizes[column] > size:
+                logging.warning(
+                    'Truncating {} of session {} from {} to {} bytes, {} rows'.format(
+                        column, self.path, sizes[column], size, rows
+                    )
+                )
+                os.truncate(paths[column], size)
+        return rows
+
+    def record(self, ticks):
+        """
+        Append a batch of ticks as received by KiteTicker.on_ticks
+        Param ticks:(List of dict) - Tick batch
+        """
+        if not ticks:
+            return
+        received_ms = int(time.time() * 1000)
+        columns = {
+            'token': [tick['instrument_token'] for tick in ticks],
+            'exchange_timestamp': [
+                _epoch_ms(tick.get('exchange_timestamp') or tick.get('last_trade_time')) or received_ms
+                for tick in ticks
+            ],
+            'last_price': [tick['last_price'] for tick in ticks],
+            'volume': [tick.get('volume_traded', 0) for tick in ticks],
+            'change': [tick.get('change', 0.0) for tick in ticks],
+        }
+        for column, dtype in COLUMNS.items():
+            self.files[column].write(np.asarray(columns[column], dtype=dtype).tobytes())
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush()
+            self.last_flush = now
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class TickReader:
+    """
+    Memory mapped read access to a recorded session
+    """
+
+    def __init__(self, path):
+        """
+        Param path:(string) - Session directory written by TickRecorder
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        # Columns can be ragged if the recorder stopped mid batch, only complete rows are read
+        lengths = [
+            os.path.getsize(os.path.join(path, column + '.bin')) // np.dtype(dtype).itemsize
+            for column, dtype in COLUMNS.items()
+        ]
+        length = min(lengths)
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            if length:
+                columns[column] = np.memmap(os.path.join(path, column + '.bin'), dtype=dtype, mode='r', shape=(length,))
+            else:
+                columns[column] = np.zeros(0, dtype=dtype)
+        self._load(path, meta, columns)
+
+    @classmethod
+    def from_columns(cls, path, meta, columns):
+        """
+        Reader over columns already in memory, e.g. attached from shared memory
+        Param path:(string) - Session directory the columns were read from
+        Param meta:(dict) - Session metadata
+        Param columns:(dict) - Column name -> array
+        """
+        reader = cls.__new__(cls)
+        reader._load(path, meta, columns)
+        return reader
+
+    def _load(self, path, meta, columns):
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported tick session format - {}'.format(meta['version']))
+        self.path = path
+        self.meta = meta
+        self.contracts = {int(token): detail for token, detail in meta['contracts'].items()}
+        self.columns = columns
+        self.length = min(len(values) for values in columns.values())
+        self._prefix_max = None
+        self._suffix_min = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def _bounds(self, start_ms, end_ms):
+        # Exchange timestamps are only nearly sorted across tokens, so the slice is bounded with
+        # running extremes: rows before `lo` are all older than start, rows after `hi` all newer than end
+        if self._prefix_max is None:
+            timestamps = self.columns['exchange_timestamp']
+            self._prefix_max = np.maximum.accumulate(timestamps)
+            self._suffix_min = np.minimum.accumulate(timestamps[::-1])[::-1]
+        lo = int(np.searchsorted(self._prefix_max, start_ms, side='left'))
+        hi = int(np.searchsorted(self._suffix_min, end_ms, side='right'))
+        return lo, max(lo, hi)
+
+    def time_range(self, start, end):
+        """
+        Ticks with start <= exchange timestamp <= end
+        Param start:(datetime or integer) - Range start, epoch milliseconds if integer
+        Param end:(datetime or integer) - Range end, epoch milliseconds if integer
+        Returns column name -> array, views into the file when no reordering has to be filtered out
+        """
+        start_ms = _epoch_ms(start) if isinstance(start, datetime) else int(start)
+        end_ms = _epoch_ms(end) if isinstance(end, datetime) else int(end)
+        lo, hi = self._bounds(start_ms, end_ms)
+        timestamps = self.columns['exchange_timestamp'][lo:hi]
+        mask = (timestamps >= start_ms) & (timestamps <= end_ms)
+        if mask.all():
+            return {column: values[lo:hi] for column, values in self.columns.items()}
+        return {column: values[lo:hi][mask] for column, values in self.columns.items()}
@@ -0,0 +1,236 @@
+"""
+Ticker connections sharing the subscriptions of a large universe
+Tokens are split across several KiteTicker connections, each decoding and
+storing its ticks in its own process, into the same store the snapshot
+process reads. Every shard keeps health and throughput counters in shared memory
+"""
+
+import logging
+import sys
+import time
+from multiprocessing import Array
+
+import kiteconnect.ticker
+from kiteconnect import KiteTicker
+from strike_window import MODE_QUOTE, SubscriptionManager
+
+# Kite allows three ticker connections per api key, each with up to 3000 tokens
+MAX_CONNECTIONS = 3
+MAX_TOKENS_PER_CONNECTION = 3000
+# Counters kept for every shard, in this order
+FIELDS = ('connected', 'tokens', 'connects', 'reconnects', 'errors', 'batches', 'ticks', 'last_tick')
+
+
+def fresh_reactor():
+    """
+    Install a new twisted reactor in a forked process. The reactor imported before forking shares
+    its epoll instance and waker with the parent and every sibling, so each shard needs its own
+    """
+    sys.modules.pop('twisted.internet.reactor', None)
+    from twisted.internet import default
+
+    default.install()
+    from twisted.internet import reactor
+
+    kiteconnect.ticker.reactor = reactor
+    return reactor
+
+
+def assign_shards(sizes, n_shards):
+    """
+    Shard of every token group, largest groups first to the shard with the fewest tokens
+    Param sizes:(List of integer) - Tokens in every group that must share a connection
+    Param n_shards:(integer) - Number of connections
+    """
+    loads = [0] * n_shards
+    shards = [0] * len(sizes)
+    for group in sorted(range(len(sizes)), key=lambda group: sizes[group], reverse=True):
+        shard = loads.index(min(loads))
+        shards[group] = shard
+        loads[shard] += sizes[group]
+    return shards
+
+
+class ShardStats:
+    """
+    Per shard counters in shared memory, written by the shard processes and read by the hub
+    """
+
+    def __init__(self, n_shards):
+        self.n_shards = n_shards
+        self.values = Array('d', n_shards * len(FIELDS), lock=False)
+        # Ticks and time of the previous report, only used by the reporting process
+        self._reported = [0.0] * n_shards
+        self._reported_at = time.monotonic()
+
+    def add(self, shard, field, value=1):
+        self.values[shard * len(FIELDS) + FIELDS.index(field)] += value
+
+    def set(self, shard, field, value):
+        self.values[shard * len(FIELDS) + FIELDS.index(field)] = value
+
+    def value(self, shard, field):
+        return self.values[shard * len(FIELDS) + FIELDS.index(field)]
+
+    def get(self, shard):
+        """
+        Counters of one shard as a dict
+        Param shard:(integer) - Shard index
+        """
+        start = shard * len(FIELDS)
+        stat = dict(zip(FIELDS, self.values[start : start + len(FIELDS)]))
+        stat['shard'] = shard
+        stat['connected'] = bool(stat['connected'])
+        for field in ('tokens', 'connects', 'reconnects', 'errors', 'batches', 'ticks'):
+            stat[field] = int(stat[field])
+        # Seconds since the last tick, None before the first one
+        stat['tick_age'] = time.time() - stat.pop('last_tick') if stat['batches'] else None
+        return stat
+
+    def report(self):
+        now = time.monotonic()
+        elapsed = now - self._reported_at
+        for shard in range(self.n_shards):
+            stat = self.get(shard)
+            stat['ticks_per_s'] = (stat['ticks'] - self._reported[shard]) / elapsed if elapsed > 0 else 0.0
+            stat['state'] = 'connected' if stat['connected'] else 'disconnected'
+            self._reported[shard] = stat['ticks']
+            logging.info(
+                'Ticker shard {shard} {state}: {tokens} tokens, {ticks_per_s:.1f} ticks/s, {ticks} ticks in '
+                '{batches} batches, {connects} connects, {reconnects} reconnects, {errors} errors'.format(**stat)
+            )
+        self._reported_at = now
+
+
+class TickerShards:
+    """
+    Runs the ticker callbacks of a client on several connections, one process each
+    Chains with a strike window stay on one connection with their underlying, so that the window
+    follows spot on the same connection. Without windows the tokens are split evenly
+    Only the first shard forwards order updates and the order stream status
+    """
+
+    def __init__(self, client, api_key, access_token, n_shards, root=None, groups=None, window_mode=MODE_QUOTE):
+        """
+        Param client:(WebsocketClient) - Client whose callbacks, store and snapshot path are shared by the shards
+        Param api_key:(string) - Kite api key
+        Param access_token:(string) - Kite access token
+        Param n_shards:(integer) - Ticker connections, at most MAX_CONNECTIONS
+        Param root:(string) - Websocket endpoint, e.g. of a local fake ticker server, Kite by default
+        Param groups:(List of tuple) - (tokens, strike windows) kept on one connection, None splits
+        client.token_list evenly
+        Param window_mode:(string) - 'ltp' or 'quote', mode of the strikes in the windows of the groups
+        """
+        if not 1 <= n_shards <= MAX_CONNECTIONS:
+            raise ValueError('Ticker shards must be between 1 and {}'.format(MAX_CONNECTIONS))
+        if not client.process_shared:
+            raise ValueError('Ticker shards need a store shared between processes, redis or shm')
+        if client.record_dir is not None and n_shards > 1:
+            raise ValueError('Recording ticks is not supported with several ticker shards')
+        self.client = client
+        self.api_key = api_key
+        self.access_token = access_token
+        self.root = root
+        self.stats = ShardStats(n_shards)
+        self.managers = [None] * n_shards
+        if groups is None:
+            size = -(-len(client.token_list) // n_shards)
+            self.token_lists = [client.token_list[idx * size : (idx + 1) * size] for idx in range(n_shards)]
+        else:
+            shards = assign_shards([len(tokens) for tokens, _ in groups], n_shards)
+            self.token_lists = [[] for _ in range(n_shards)]
+            windows = [[] for _ in range(n_shards)]
+            for shard, (tokens, group_windows) in zip(shards, groups):
+                self.token_lists[shard].extend(tokens)
+                windows[shard].extend(group_windows)
+            # A token in several groups of a shard, e.g. an underlying, is subscribed once
+            self.token_lists = [list(dict.fromkeys(tokens)) for tokens in self.token_lists]
+            # Managers are created here so that the strategy process can send held legs to them
+            self.managers = [
+                SubscriptionManager(shard_windows, window_mode) if shard_windows else None for shard_windows in windows
+            ]
+        for shard, tokens in enumerate(self.token_lists):
+            if len(tokens) > MAX_TOKENS_PER_CONNECTION:
+                raise ValueError(
+                    'Ticker shard {} has {} tokens, more than {} a connection allows'.format(
+                        shard, len(tokens), MAX_TOKENS_PER_CONNECTION
+                    )
+                )
+            self.stats.set(shard, 'tokens', len(tokens))
+
+    def hold(self, symbols):
+        """
+        Send held legs to every shard with a strike window, each picks the symbols of its chains
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        for manager in self.managers:
+            if manager is not None:
+                manager.hold(symbols)
+
+    def release(self, symbols):
+        """
+        Return closed legs to the window of every shard
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        for manager in self.managers:
+            if manager is not None:
+                manager.release(symbols)
+
+    def run(self, shard):
+        """
+        Connect one shard, runs in its own process
+        Param shard:(integer) - Shard index
+        """
+        fresh_reactor()
+        client = self.client
+        stats = self.stats
+        client.kws = KiteTicker(self.api_key, self.access_token, debug=True, root=self.root)
+        client.token_list = self.token_lists[shard]
+        client.subscription_manager = self.managers[shard]
+        if shard:
+            # Every connection receives the order updates of the account, one forwards them
+            client.on_order_update = lambda ws, data: None
+            client.publish_order_stream_status = lambda connected: None
+        on_ticks, on_connect = client.on_ticks, client.on_connect
+        on_close, on_error = client.on_close, client.on_error
+
+        def count_ticks(ws, ticks):
+            on_ticks(ws, ticks)
+            stats.add(shard, 'batches')
+            stats.add(shard, 'ticks', len(ticks))
+            stats.set(shard, 'last_tick', time.time())
+
+        def count_connect(ws, response):
+            stats.set(shard, 'connected', 1)
+            # Kite calls on_reconnect only once a retry has failed, so every connection after the first counts
+            if stats.value(shard, 'connects'):
+                stats.add(shard, 'reconnects')
+            stats.add(shard, 'connects')
+            on_connect(ws, response)
+
+        def count_close(ws, code, reason):
+            stats.set(shard, 'connected', 0)
+            on_close(ws, code, reason)
+
+        def count_error(ws, code, reason):
+            stats.set(shard, 'connected', 0)
+            stats.add(shard, 'errors')
+            on_error(ws, code, reason)
+
+        client.on_ticks = count_ticks
+        client.on_connect = count_connect
+        client.on_close = count_close
+        client.on_error = count_error
+        logging.info('Ticker shard {} streaming {} tokens'.format(shard, len(client.token_list)))
+        client.assign_callBacks()
+
+    def start(self):
+        for shard, tokens in enumerate(self.token_lists):
+            if not tokens:
+                # Fewer chain groups than shards
+                logging.warning('Ticker shard {} has no tokens and is not connected'.format(shard))
+                continue
+            self.client.start_worker(self.run, (shard,))
+
+    def report(self):
+        self.stats.report()
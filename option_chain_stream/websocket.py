@@ -7,66 +7,252 @@ for requested option symbol
 """
 
 import logging, time
-from multiprocessing import Process, Queue
+from multiprocessing import Array, Event, Process, Queue, Value
+from threading import Thread
 from kiteconnect import KiteTicker
-from instrument_file import InstrumentMaster
+from instrument_file import InstrumentMaster, option_data_from_tick
+from chain_snapshot import ChainLayout, SharedChainChannel
+from latest_channel import LatestValueChannel
+from latency import trace_batch, trace_snapshot, tracing_enabled
+from redis_pool import pool_stats
+from strike_window import MODE_QUOTE, StrikeWindow, SubscriptionManager
+from tick_recorder import TickRecorder
+
+
+class IngestStats:
+    """
+    Tick ingestion throughput and per batch write latency, reported periodically
+    """
+
+    def __init__(self, report_interval=10):
+        self.report_interval = report_interval
+        self.reset(time.monotonic())
+
+    def reset(self, now):
+        self.window_start = now
+        self.ticks = 0
+        self.batches = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+
+    def record(self, n_ticks, write_time):
+        """
+        Record one stored tick batch
+        Param n_ticks:(integer) - Number of ticks in the batch
+        Param write_time:(float) - Seconds spent writing the batch
+        """
+        self.ticks += n_ticks
+        self.batches += 1
+        self.write_time += write_time
+        self.max_write_time = max(self.max_write_time, write_time)
+        now = time.monotonic()
+        if now - self.window_start >= self.report_interval:
+            self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.window_start
+        logging.info(
+            "Ingested {:.1f} ticks/s over {} batches, batch write avg {:.2f} ms max {:.2f} ms".format(
+                self.ticks / elapsed,
+                self.batches,
+                1000 * self.write_time / self.batches,
+                1000 * self.max_write_time,
+            )
+        )
+        stats = pool_stats()
+        if stats['checkouts']:
+            logging.info(
+                "Redis pool: {checkouts} checkouts, {waits} waits ({wait_time:.3f}s), {created} connections created, "
+                "{reconnects} reconnects".format(**stats)
+            )
+        self.reset(now)
 
 
 class WebsocketClient:
-    def __init__(self, symbol, expiry, api_key, acess_token, underlying):
-        # Create kite ticker instance
-        self.kws = KiteTicker(api_key, acess_token, debug=True)
+    def __init__(
+        self,
+        symbol,
+        expiry,
+        api_key,
+        acess_token,
+        underlying,
+        order_updates=None,
+        record_dir=None,
+        storage=None,
+        tick_tap=None,
+        atm_window=None,
+        window_mode=MODE_QUOTE,
+    ):
+        self.init_feed(api_key, acess_token, storage, record_dir, order_updates, tick_tap)
         self.symbol = symbol
         self.expiry = expiry
         self.underlying = underlying
-        self.instrumentClass = InstrumentMaster(api_key)
         self.token_list = self.instrumentClass.fetch_contract(self.symbol, str(self.expiry), self.underlying)
+        # Resolve contract detail for every subscribed token once instead of per tick
+        self.instrumentClass.load_token_details(self.token_list)
+        # Snapshot keys are fixed for the chain, resolve them once
+        self.option_keys = self.instrumentClass.option_data_keys(self.token_list)
+        # Subscribe only ATM +- atm_window strikes in window_mode and the held legs in FULL mode, None subscribes
+        # every strike in FULL mode
+        self.window = None
+        if atm_window is not None:
+            self.window = StrikeWindow(self.token_list, self.instrumentClass.token_details, atm_window)
+            self.subscription_manager = SubscriptionManager([self.window], window_mode)
         self.q = Queue()
 
+    def init_feed(
+        self, api_key, access_token, storage=None, record_dir=None, order_updates=None, tick_tap=None, ticker_root=None
+    ):
+        """
+        Ticker connection and tick ingest state shared by every client of the feed, chain setup is left to the caller
+        Param api_key:(string) - Kite api key
+        Param access_token:(string) - Kite access token
+        Param storage:(string or StorageBackend) - 'redis', 'memory', 'shm' or a backend instance, redis by default
+        Param record_dir:(string) - Directory to capture every tick in
+        Param order_updates:(Queue) - Order updates from the ticker are forwarded here
+        Param tick_tap:(Queue) - Symbol and last price of every tick batch are forwarded here
+        Param ticker_root:(string) - Websocket endpoint, the Kite ticker by default
+        """
+        # Create kite ticker instance
+        self.kws = KiteTicker(api_key, access_token, debug=True, root=ticker_root)
+        self.instrumentClass = InstrumentMaster(api_key, storage)
+        self.token_list = []
+        # Created once the subscribed strikes are known, None subscribes every token in FULL mode
+        self.subscription_manager = None
+        self.ingest_stats = IngestStats()
+        # Shared with the snapshot process so it can publish as soon as ticks are stored
+        self.tick_version = Value('L', 0)
+        self.tick_event = Event()
+        # Tick and store time of the newest batch, only kept while latency tracing is enabled
+        self.last_batch = Array('d', 2, lock=False) if tracing_enabled() else None
+        # Order updates from the ticker are forwarded here for the strategy process order book
+        self.order_updates = order_updates
+        # Symbol and last price of every tick batch are forwarded here when set, for in-process stop checks
+        self.tick_tap = tick_tap
+        # Directory to capture every tick in, the recorder itself is opened in the ticker process
+        self.record_dir = record_dir
+        self.recorder = None
+
     def form_option_chain(self, q):
         """
         Wrapper method around fetch and create option chain
         """
         while 1:
             time.sleep(1)
-            complete_option_data = self.instrumentClass.generate_optionChain(self.token_list)
+            complete_option_data = self.instrumentClass.generate_optionChain(self.token_list, self.snapshot_keys())
+            if self.last_batch is not None:
+                complete_option_data = trace_snapshot(complete_option_data, self.last_batch)
+            q.put(complete_option_data)
+
+    def form_option_chain_on_ticks(self, q, min_interval=0.2, max_staleness=1.0):
+        """
+        Publish option chain whenever new ticks are stored, coalescing bursts
+        Param q:(Queue) - Queue the snapshots are put on
+        Param min_interval:(float) - Minimum seconds between two snapshots
+        Param max_staleness:(float) - Seconds after which the last snapshot is republished
+        even if no tick arrived, so the consumer keeps getting a heartbeat
+        """
+        published_version = None
+        last_publish = 0.0
+        while 1:
+            self.tick_event.wait(timeout=max_staleness)
+            # Let ticks arriving within the minimum interval coalesce into one snapshot
+            delay = min_interval - (time.monotonic() - last_publish)
+            if delay > 0:
+                time.sleep(delay)
+            self.tick_event.clear()
+            version = self.tick_version.value
+            if version == published_version and time.monotonic() - last_publish < max_staleness:
+                continue
+            complete_option_data = self.instrumentClass.generate_optionChain(self.token_list, self.snapshot_keys())
+            if self.last_batch is not None:
+                complete_option_data = trace_snapshot(complete_option_data, self.last_batch)
             q.put(complete_option_data)
+            published_version = version
+            last_publish = time.monotonic()
 
     def on_ticks(self, ws, ticks):
         """
-        Push each tick to DB
+        Push each tick batch to DB in a single write
         """
+        if self.recorder is not None:
+            self.recorder.record(ticks)
+        optionRecords = []
         for tick in ticks:
             contract_detail = self.instrumentClass.fetch_token_detail(tick['instrument_token'])
-            # For EQ underlying instrument don't fetch OI and volume(for INDICES) value
-            if contract_detail['type'] == 'EQ':
-                optionData = {
-                    'token': tick['instrument_token'],
-                    'symbol': contract_detail['symbol'],
-                    'last_price': tick['last_price'],
-                    'change': tick['change'],
-                }
-            else:
-                optionData = {
-                    'token': tick['instrument_token'],
-                    'symbol': contract_detail['symbol'],
-                    'last_price': tick['last_price'],
-                    'volume': tick['volume_traded'],
-                    'change': tick['change'],
-                }
-
-            # Store each tick to redis with symbol and token as key pair
-            self.instrumentClass.store_option_data(contract_detail['symbol'], tick['instrument_token'], optionData)
+            optionData = option_data_from_tick(tick, contract_detail)
+            optionRecords.append((contract_detail['symbol'], tick['instrument_token'], optionData))
+        self.publish_ticks(optionRecords)
+
+        # Store the batch to redis with symbol and token as key pair
+        write_start = time.monotonic()
+        self.instrumentClass.store_option_data_batch(optionRecords)
+        self.ingest_stats.record(len(optionRecords), time.monotonic() - write_start)
+        if self.last_batch is not None:
+            trace_batch(self.last_batch, ticks, time.time())
+        with self.tick_version.get_lock():
+            self.tick_version.value += 1
+        self.tick_event.set()
+        if self.subscription_manager is not None:
+            self.subscription_manager.on_ticks(ws, ticks)
+
+    def snapshot_keys(self):
+        """
+        Option data keys of the subscribed tokens, every token of the chain without an ATM window
+        """
+        return self.window.select(self.option_keys) if self.window is not None else self.option_keys
+
+    def hold_legs(self, symbols):
+        """
+        Stream the legs of an open position in FULL mode, no-op without an ATM window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        if self.subscription_manager is not None:
+            self.subscription_manager.hold(symbols)
+
+    def release_legs(self, symbols):
+        """
+        Stop streaming closed legs in FULL mode, no-op without an ATM window
+        Param symbols:(List of string) - Tradingsymbols of the legs
+        """
+        if self.subscription_manager is not None:
+            self.subscription_manager.release(symbols)
+
+    def publish_ticks(self, option_records):
+        """
+        Forward symbol and last price of a tick batch before it is stored
+        Param option_records:(List of tuple) - (symbol, token, option data) of every tick
+        """
+        if self.tick_tap is not None:
+            self.tick_tap.put([(symbol, option_data['last_price']) for symbol, _, option_data in option_records])
 
     def on_connect(self, ws, response):
-        ws.subscribe(self.token_list)
-        ws.set_mode(ws.MODE_FULL, self.token_list)
+        if self.subscription_manager is not None:
+            self.subscription_manager.on_connect(ws)
+        else:
+            ws.subscribe(self.token_list)
+            ws.set_mode(ws.MODE_FULL, self.token_list)
+        self.publish_order_stream_status(True)
+
+    def on_order_update(self, ws, data):
+        if self.order_updates is not None:
+            self.order_updates.put(('order', data))
+
+    def publish_order_stream_status(self, connected):
+        """
+        Let the order book know whether it can rely on pushed order updates
+        Param connected:(bool) - Ticker connection state
+        """
+        if self.order_updates is not None:
+            self.order_updates.put(('stream', connected))
 
     def on_close(self, ws, code, reason):
         logging.error("closed connection on close: {} {}".format(code, reason))
+        self.publish_order_stream_status(False)
 
     def on_error(self, ws, code, reason):
         logging.error("closed connection on error: {} {}".format(code, reason))
+        self.publish_order_stream_status(False)
 
     def on_noreconnect(self, ws):
         logging.error("Reconnecting the websocket failed")
@@ -75,26 +261,65 @@ class WebsocketClient:
         logging.debug("Reconnecting the websocket: {}".format(attempt_count))
 
     def assign_callBacks(self):
+        if self.record_dir is not None:
+            contracts = {token: self.instrumentClass.fetch_token_detail(token) for token in self.token_list}
+            self.recorder = TickRecorder(self.record_dir, contracts, expiry=self.expiry)
         # Assign all the callbacks
         self.kws.on_ticks = self.on_ticks
         self.kws.on_connect = self.on_connect
+        self.kws.on_order_update = self.on_order_update
         self.kws.on_close = self.on_close
         self.kws.on_error = self.on_error
         self.kws.on_noreconnect = self.on_noreconnect
         self.kws.on_reconnect = self.on_reconnect
-        self.kws.connect()
+        # The ticker shares the process with the snapshot loop when the store is not process shared
+        self.kws.connect(threaded=not self.process_shared)
+
+    @property
+    def process_shared(self):
+        """
+        Whether the ticker and the snapshot loop can run in separate processes
+        """
+        return self.instrumentClass.redis_db.backend.process_shared
+
+    def start_worker(self, target, args=()):
+        """
+        Run the ticker or the snapshot loop in its own process, or in a thread of this
+        process when ticks are stored in the in-process store
+        Param target:(callable) - Worker function
+        Param args:(tuple) - Worker arguments
+        """
+        if self.process_shared:
+            Process(target=target, args=args).start()
+        else:
+            Thread(target=target, args=args, daemon=True).start()
 
-    def queue_callBacks(self):
+    def queue_callBacks(self, publish_on='interval', min_interval=0.2, max_staleness=1.0, transport='queue'):
         """
         Wrapper around ticker callbacks with multiprocess Queue
+        Param publish_on:(string) - 'interval' to poll every second, 'ticks' to publish as ticks arrive
+        Param min_interval:(float) - Minimum seconds between snapshots when publishing on ticks
+        Param max_staleness:(float) - Heartbeat interval when publishing on ticks
+        Param transport:(string) - 'queue' to pickle snapshots through a Queue,
+        'latest' to deliver only the newest snapshot and drop the ones a slow consumer missed,
+        'shm' to publish array snapshots through shared memory, also newest only
         """
+        if publish_on not in ('ticks', 'interval'):
+            raise ValueError('Unknown publish mode - {}'.format(publish_on))
+        if transport == 'shm':
+            self.q = SharedChainChannel(ChainLayout(self.token_list, self.instrumentClass.token_details))
+        elif transport == 'latest':
+            self.q = LatestValueChannel()
+        elif transport != 'queue':
+            raise ValueError('Unknown snapshot transport - {}'.format(transport))
         # Process to keep updating real time tick to DB
-        Process(
-            target=self.assign_callBacks,
-        ).start()
+        self.start_worker(self.assign_callBacks)
         # Delay to let intial instrument DB sync
         # For option chain to fetch value
         # Required only during initial run
         time.sleep(2)
         # Process to fetch option chain in real time from Redis
-        Process(target=self.form_option_chain, args=(self.q,)).start()
+        if publish_on == 'ticks':
+            self.start_worker(self.form_option_chain_on_ticks, (self.q, min_interval, max_staleness))
+        else:
+            self.start_worker(self.form_option_chain, (self.q,))
@@ -0,0 +1,41 @@
+import math
+
+import pytest
+
+import codec
+
+OPTION = {"token": 12345, "symbol": "NIFTY2321617000CE", "last_price": 101.5, "volume": 2500, "change": -1.25}
+UNDERLYING = {"token": 256265, "symbol": "NIFTY 50", "last_price": 17950.0, "change": 0.4}
+CONTRACT = {"symbol": "NIFTY2321617000CE", "strike": 17000.0, "type": "CE"}
+CHAIN = [{"strike": 17000.0, "type": "CE", "expiry": "2023-02-16", "token": 12345}]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        OPTION,
+        dict(OPTION, volume=None, change=None),
+        dict(OPTION, volume=0, change=0.0),
+        UNDERLYING,
+        dict(UNDERLYING, change=None),
+        CONTRACT,
+        CHAIN,
+    ],
+)
+def test_known_layouts_are_binary(value):
+    record = codec.encode(value)
+    assert record[0] == codec.VERSION
+    assert codec.decode(record) == value
+
+
+def test_ltp_ticks_keep_their_nulls():
+    option = codec.decode(codec.encode(dict(OPTION, volume=None, change=None)))
+    assert option["volume"] is None and option["change"] is None
+    # A real change of the tick is kept, only the null is NaN in the record
+    assert math.isclose(codec.decode(codec.encode(OPTION))["change"], -1.25)
+
+
+def test_other_values_are_json():
+    assert codec.encode({"price": 1}) == b'{"price": 1}'
+    assert codec.decode(b'{"price": 1}') == {"price": 1}
+    assert codec.decode(codec.encode(dict(OPTION, last_price="101.5"))) == dict(OPTION, last_price="101.5")
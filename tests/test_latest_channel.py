@@ -0,0 +1,44 @@
+import time
+from queue import Empty
+
+import pytest
+
+from chain_snapshot import ChainLayout, SharedChainChannel
+from fakes import contract_details
+from latest_channel import LatestValueChannel
+
+
+def make_shm_channel():
+    details = contract_details(2)
+    return SharedChainChannel(ChainLayout(list(details), details))
+
+
+@pytest.fixture(params=[LatestValueChannel, make_shm_channel])
+def channel(request):
+    channel = request.param()
+    yield channel
+    channel.close(unlink=True)
+
+
+def test_get_raises_empty_like_a_queue(channel):
+    start = time.monotonic()
+    with pytest.raises(Empty):
+        channel.get(timeout=0.05)
+    assert time.monotonic() - start >= 0.05
+    with pytest.raises(Empty):
+        channel.get(block=False)
+    with pytest.raises(Empty):
+        channel.get(False, 10)
+
+
+def test_latest_value_is_delivered_once():
+    channel = LatestValueChannel()
+    try:
+        channel.put({"seq": 1})
+        channel.put({"seq": 2})
+        assert channel.get(block=False) == {"seq": 2}
+        assert channel.dropped == 1
+        with pytest.raises(Empty):
+            channel.get_nowait()
+    finally:
+        channel.close(unlink=True)
@@ -0,0 +1,29 @@
+import fakeredis
+
+from product import Option
+
+SYMBOL = "NIFTY2321617000CE"
+
+
+class RecordingKite:
+    def __init__(self):
+        self.placed = []
+
+    def place_order(self, **params):
+        self.placed.append(params)
+        return str(len(self.placed))
+
+    def order_history(self, order_id):
+        return [{"order_id": order_id, "status": "OPEN"}]
+
+
+def test_cached_order_ids_are_kept_per_transaction_type():
+    kite = RecordingKite()
+    option = Option(kite, SYMBOL, order_cache=fakeredis.FakeStrictRedis())
+    buy = option.buy(50)
+    sell = option.sell(50)
+    assert [params["transaction_type"] for params in kite.placed] == ["BUY", "SELL"]
+    assert (buy.order_id, sell.order_id) == ("1", "2")
+    # A repeated order of the same symbol, type and side returns the placed one instead of placing it again
+    assert option.sell(50).order_id == "2"
+    assert len(kite.placed) == 2
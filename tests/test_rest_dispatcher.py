@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+from kiteconnect import KiteConnect
+
+from rest_dispatcher import RequestDispatcher, merge_modify
+
+
+class RecordingKite:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def cancel_order(self, **params):
+        with self.lock:
+            self.calls.append(("cancel_order", params))
+        return params["order_id"]
+
+    def modify_order(self, **params):
+        with self.lock:
+            self.calls.append(("modify_order", params))
+        return params["order_id"]
+
+
+def modify(order_id="1", price=None, trigger_price=None, order_type=None):
+    return dict(variety="regular", order_id=order_id, price=price, trigger_price=trigger_price, order_type=order_type)
+
+
+def test_merge_keeps_latest_values():
+    queued = modify(price=100.0, trigger_price=99.0, order_type=KiteConnect.ORDER_TYPE_SL)
+    merge_modify(queued, modify(price=101.0, trigger_price=100.0))
+    assert queued == modify(price=101.0, trigger_price=100.0, order_type=KiteConnect.ORDER_TYPE_SL)
+
+
+def test_merge_to_market_clears_prices():
+    queued = modify(price=100.0, trigger_price=99.0, order_type=KiteConnect.ORDER_TYPE_SL)
+    merge_modify(queued, modify(order_type=KiteConnect.ORDER_TYPE_MARKET))
+    assert queued == modify(order_type=KiteConnect.ORDER_TYPE_MARKET)
+
+
+def test_merge_never_downgrades_market():
+    queued = modify(order_type=KiteConnect.ORDER_TYPE_MARKET)
+    merge_modify(queued, modify(price=101.0, trigger_price=100.0, order_type=KiteConnect.ORDER_TYPE_SL))
+    assert queued == modify(order_type=KiteConnect.ORDER_TYPE_MARKET)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (
+            modify(order_type=KiteConnect.ORDER_TYPE_MARKET),
+            modify(price=101.0, trigger_price=100.0, order_type=KiteConnect.ORDER_TYPE_SL),
+        ),
+        (
+            modify(price=101.0, trigger_price=100.0, order_type=KiteConnect.ORDER_TYPE_SL),
+            modify(order_type=KiteConnect.ORDER_TYPE_MARKET),
+        ),
+    ],
+)
+def test_queued_modifies_merge_to_market_exit(first, second):
+    kite = RecordingKite()
+    # One order request a second, the cancel takes it and the modifies wait together
+    dispatcher = RequestDispatcher(kite, workers=1, order_limits=((1, 1.0),))
+    dispatcher.cancel_order(variety="regular", order_id="0")
+    futures = [dispatcher.submit("modify_order", **first), dispatcher.submit("modify_order", **second)]
+    assert [future.result(timeout=5) for future in futures] == ["1", "1"]
+    dispatcher.close()
+    assert kite.calls[1:] == [("modify_order", modify(order_type=KiteConnect.ORDER_TYPE_MARKET))]
+    assert dispatcher.stats()["coalesced"] == 1
+    assert dispatcher.stats()["dispatched"]["exit"] == 2
+    assert dispatcher.stats()["dispatched"]["modify"] == 0
@@ -0,0 +1,183 @@
+import pickle
+import sys
+from multiprocessing import Process
+from threading import Thread
+
+import fakeredis
+import pytest
+
+import storage
+from storage import INLINE_SIZE, SLOT_HEADER, STORE_HEADER, InProcessStore, RedisBackend, SharedMemoryStore
+
+OPTION = {"token": 12345, "symbol": "NIFTY2321617000CE", "last_price": 101.5, "volume": 10, "change": -1.25}
+DETAIL = {"symbol": "NIFTY2321617000CE", "strike": 17000.0, "type": "CE"}
+# A symbol contract list, too large for a shared memory slot
+LARGE = [{"strike": float(strike), "type": "CE", "expiry": "2023-02-16", "token": strike} for strike in range(500)]
+
+
+def make_shm():
+    # Small on purpose, so that the checks grow the table and the arena
+    return SharedMemoryStore(n_keys=16, arena_size=1 << 12)
+
+
+BACKENDS = {
+    "memory": InProcessStore,
+    "shm": make_shm,
+    "redis": lambda: RedisBackend(connection=fakeredis.FakeStrictRedis()),
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request):
+    backend = BACKENDS[request.param]()
+    yield backend
+    backend.close(unlink=True)
+
+
+@pytest.fixture
+def shm():
+    backend = make_shm()
+    yield backend
+    backend.close(unlink=True)
+
+
+def arena_used(store: SharedMemoryStore) -> int:
+    return STORE_HEADER.unpack_from(store.buf, 0)[0]
+
+
+def write_from_child(backend, items):
+    backend.set_many(items)
+
+
+def test_missing_key(backend):
+    assert backend.get("missing") is None
+    assert backend.mget([]) == []
+
+
+def test_set_and_get(backend):
+    backend.set("NIFTY2321617000CE:12345", OPTION)
+    assert backend.get("NIFTY2321617000CE:12345") == OPTION
+
+
+def test_integer_keys_are_strings(backend):
+    backend.set(12345, DETAIL)
+    assert backend.get("12345") == backend.get(12345) == DETAIL
+
+
+def test_mget_keeps_key_order(backend):
+    backend.set("NIFTY2321617000CE:12345", OPTION)
+    backend.set(12345, DETAIL)
+    assert backend.mget(["NIFTY2321617000CE:12345", "missing", 12345]) == [OPTION, None, DETAIL]
+
+
+def test_overwrite_moves_between_inline_and_large(backend):
+    for value in (dict(OPTION, last_price=102.0), LARGE, LARGE[:300], OPTION):
+        backend.set("NIFTY2321617000CE:12345", value)
+        assert backend.get("NIFTY2321617000CE:12345") == value
+
+
+def test_set_many_and_delete(backend):
+    backend.set_many(("key:{}".format(idx), {"idx": idx}) for idx in range(1000))
+    assert backend.mget(["key:{}".format(idx) for idx in range(1000)]) == [{"idx": idx} for idx in range(1000)]
+    backend.delete(["key:{}".format(idx) for idx in range(0, 1000, 2)] + ["missing"])
+    assert backend.mget(["key:0", "key:1"]) == [None, {"idx": 1}]
+    backend.set("key:0", {"idx": 0})
+    assert backend.get("key:0") == {"idx": 0}
+
+
+def test_shm_written_from_child(shm):
+    shm.set("key:1", {"idx": 1})
+    child = Process(target=write_from_child, args=(shm, [("child", {"written": True}), ("key:1", None)]))
+    child.start()
+    child.join()
+    assert shm.get("child") == {"written": True}
+    assert shm.get("key:1") is None
+
+
+def test_shm_grows_until_fork(shm):
+    n_slots = shm.n_slots
+    shm.set_many(("key:{}".format(idx), {"idx": idx}) for idx in range(1000))
+    shm.set("contracts", LARGE)
+    assert shm.n_slots >= 4 * 1000 > n_slots
+    assert shm.arena_size > 1 << 12
+    assert shm.get("key:999") == {"idx": 999}
+    assert shm.get("contracts") == LARGE
+    child = Process(target=write_from_child, args=(shm, []))
+    child.start()
+    child.join()
+    assert not shm.growable
+
+
+def test_shm_overwrite_reuses_arena_block(shm):
+    shm.set("contracts", LARGE)
+    used = arena_used(shm)
+    for count in (500, 400, 450):
+        shm.set("contracts", LARGE[:count])
+        assert shm.get("contracts") == LARGE[:count]
+    assert arena_used(shm) == used
+
+
+def test_shm_compacts_full_arena_once_shared(shm):
+    shm.set("contracts", LARGE)
+    shm.set("small", OPTION)
+    shm.growable = False
+    arena_size = shm.arena_size
+    # Moving inline drops the arena block, the values written add up to several arenas
+    for _ in range(4 * arena_size // len(pickle.dumps(LARGE, pickle.HIGHEST_PROTOCOL))):
+        shm.set("small", LARGE)
+        assert shm.get("small") == LARGE
+        shm.set("small", OPTION)
+        assert shm.get("contracts") == LARGE
+    assert shm.arena_size == arena_size
+    with pytest.raises(ValueError):
+        shm.set("other", bytes(arena_size))
+    shm.delete(["contracts"])
+    shm.set("small", LARGE)
+    assert shm.get("small") == LARGE
+
+
+def test_shm_inline_values_stay_in_slot(shm):
+    shm.set("option", OPTION)
+    assert arena_used(shm) == 0
+    assert len(str(OPTION)) < INLINE_SIZE
+
+
+def test_shm_reads_while_another_thread_grows(shm):
+    shm.set("option", OPTION)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(2000):
+                assert shm.get("option") == OPTION
+        except Exception as error:
+            errors.append(error)
+
+    readers = [Thread(target=read) for _ in range(4)]
+    # Switch threads often enough to land inside a resize
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for reader in readers:
+            reader.start()
+        # Every new key past the table size doubles the table and moves the live keys
+        for idx in range(1000):
+            shm.set(f"key:{idx}", {"idx": idx})
+            shm.set(f"large:{idx % 8}", LARGE[: idx % 50 + 20])
+        for reader in readers:
+            reader.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert shm.get("key:999") == {"idx": 999}
+
+
+def test_shm_reader_gives_up_on_a_slot_left_mid_write(shm, monkeypatch):
+    monkeypatch.setattr(storage, "READ_TIMEOUT", 0.05)
+    shm.set("option", OPTION)
+    position = shm._position("option")
+    seq, key_hash, key_length, value_length, value_offset = SLOT_HEADER.unpack_from(shm.buf, position)
+    # A writer that died between the two sequence bumps
+    SLOT_HEADER.pack_into(shm.buf, position, seq + 1, key_hash, key_length, value_length, value_offset)
+    with pytest.raises(RuntimeError):
+        shm.get("option")
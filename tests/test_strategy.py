@@ -0,0 +1,108 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from broker import SimulatedBroker
+from order import Order
+from product import BasketResult
+import strategy as strategy_module
+from strategy import StraddleStrategy
+from synthetic_stops import ARMED
+
+CALL = "BANKNIFTY2321641000CE"
+PUT = "BANKNIFTY2321641000PE"
+OPTION_CHAIN = [
+    {"symbol": "NIFTY BANK", "last_price": 41000.0},
+    {"symbol": CALL, "last_price": 120.0},
+    {"symbol": PUT, "last_price": 100.0},
+]
+
+
+class OpenOrder(SimpleNamespace):
+    def get_status(self):
+        return "OPEN"
+
+
+def make_strategy(kite):
+    return StraddleStrategy(
+        kite, "BANKNIFTY", "2023-02-16", "", stream=[], underlying_symbol="NIFTY BANK", order_cache=None
+    )
+
+
+def test_monitor_triggers_skips_released_legs():
+    strategy = make_strategy(None)
+    strategy._option_orders = {"CE": OpenOrder(tradingsymbol=CALL), "PE": OpenOrder(tradingsymbol=PUT)}
+    strategy._stop_loss_orders = {"CE": OpenOrder(tradingsymbol=CALL), "PE": None}
+    # The put was stopped out and released, its strike left the window and the snapshot
+    option_chain = [{"symbol": "NIFTY BANK", "last_price": 41000.0}, {"symbol": CALL, "last_price": 120.0}]
+    strategy.monitor_triggers(option_chain)
+    assert strategy._stop_loss_orders["CE"] is not None
+
+
+@pytest.mark.parametrize("synthetic_stops", [False, True])
+def test_entry_places_targets(synthetic_stops):
+    broker = SimulatedBroker(lambda: datetime(2023, 2, 16, 9, 30))
+    for option in OPTION_CHAIN:
+        broker.on_tick(option["symbol"], option["last_price"])
+    strategy = StraddleStrategy(
+        broker,
+        "BANKNIFTY",
+        "2023-02-16",
+        "",
+        stream=[],
+        underlying_symbol="NIFTY BANK",
+        order_cache=None,
+        add_targets=True,
+        entry_delta=None,
+        synthetic_stops=synthetic_stops,
+    )
+    assert strategy.entry(OPTION_CHAIN)
+    assert strategy._targets == {"CE": 60.0, "PE": 50.0}
+    assert [order.tradingsymbol for order in strategy._target_orders.values()] == [CALL, PUT]
+    if synthetic_stops:
+        assert [order.status for order in strategy._target_orders.values()] == [ARMED, ARMED]
+    else:
+        assert [order.trigger_price for order in strategy._target_orders.values()] == [60.0, 50.0]
+
+
+class PartialFillKite:
+    # A sell that filled 10 of 25 and stays open until it is cancelled
+    def __init__(self):
+        self.status = "OPEN"
+        self.placed = []
+
+    def order_history(self, order_id):
+        if order_id == "1":
+            return [
+                {"order_id": "1", "tradingsymbol": CALL, "status": self.status, "quantity": 25, "filled_quantity": 10}
+            ]
+        return [{"order_id": order_id, "status": "COMPLETE"}]
+
+    def cancel_order(self, variety, order_id):
+        self.status = "CANCELLED"
+
+    def place_order(self, **params):
+        self.placed.append(params)
+        return str(len(self.placed) + 1)
+
+
+def test_unwind_buys_back_a_fill_the_order_book_has_not_seen():
+    broker = SimulatedBroker(lambda: datetime(2023, 2, 16, 9, 30))
+    broker.on_tick(CALL, 120.0)
+    order_id = broker.place_order("regular", CALL, "NFO", "SELL", 25, "MIS", "MARKET")
+    basket = BasketResult()
+    # The order update stream has not caught up, the order book still has no status for the sell
+    basket.orders[("option", "CE")] = SimpleNamespace(order_id=order_id, tradingsymbol=CALL, get_status=lambda: None)
+    make_strategy(broker).unwind_entry(basket, 25)
+    assert broker.positions[CALL] == 0
+
+
+def test_unwind_cancels_the_rest_and_buys_back_the_partial_fill(monkeypatch):
+    monkeypatch.setattr(strategy_module, "UNWIND_SETTLE_TIMEOUT", 0.0)
+    kite = PartialFillKite()
+    basket = BasketResult()
+    basket.orders[("option", "CE")] = Order(kite, "1")
+    make_strategy(kite).unwind_entry(basket, 25)
+    assert kite.status == "CANCELLED"
+    assert [(params["transaction_type"], params["quantity"]) for params in kite.placed] == [("BUY", 10)]
@@ -0,0 +1,65 @@
+import threading
+
+from kiteconnect import KiteConnect
+
+from product import Option
+from rest_dispatcher import RequestDispatcher
+from synthetic_stops import ARMED, CANCELLED, FIRED, STOP, TARGET, SyntheticStopEngine
+
+SYMBOL = "NIFTY2321617000CE"
+
+
+class FlakyKite:
+    # Rejects the first `failures` orders, then fills them
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.placed = []
+        self.lock = threading.Lock()
+
+    def place_order(self, **params):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("Order rejected")
+            self.placed.append(params)
+            return str(len(self.placed))
+
+    def order_history(self, order_id):
+        return [{"order_id": order_id, "status": "COMPLETE"}]
+
+
+def make_engine(kite):
+    engine = SyntheticStopEngine(product=lambda symbol: Option(kite, symbol, order_cache=None), order=None)
+    stop = engine.arm(SYMBOL, STOP, KiteConnect.TRANSACTION_TYPE_BUY, 50, 120.0)
+    target = engine.arm(SYMBOL, TARGET, KiteConnect.TRANSACTION_TYPE_BUY, 50, 80.0)
+    return engine, stop, target
+
+
+def test_fire_cancels_the_other_triggers():
+    kite = FlakyKite()
+    engine, stop, target = make_engine(kite)
+    engine.on_tick(SYMBOL, 121.0)
+    assert (stop.status, target.status) == (FIRED, CANCELLED)
+    assert stop.order_id == "1"
+    assert kite.placed[0]["transaction_type"] == KiteConnect.TRANSACTION_TYPE_BUY
+
+
+def test_failed_order_stays_armed_and_fires_on_the_next_tick():
+    kite = FlakyKite(failures=1)
+    engine, stop, target = make_engine(kite)
+    engine.on_tick(SYMBOL, 121.0)
+    assert (stop.status, target.status) == (ARMED, ARMED)
+    assert stop.order_id is None
+    engine.on_tick(SYMBOL, 122.0)
+    assert (stop.status, target.status) == (FIRED, CANCELLED)
+    assert len(kite.placed) == 1
+
+
+def test_fired_order_is_an_exit_request():
+    dispatcher = RequestDispatcher(FlakyKite(), workers=1)
+    engine, stop, _ = make_engine(dispatcher)
+    engine.on_tick(SYMBOL, 121.0)
+    dispatcher.close()
+    assert stop.status == FIRED
+    assert dispatcher.stats()["dispatched"]["exit"] == 1
+    assert dispatcher.stats()["dispatched"]["entry"] == 0
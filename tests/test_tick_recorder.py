@@ -0,0 +1,55 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+
+from tick_recorder import COLUMNS, TickReader, TickRecorder, session_path
+
+SESSION = date(2023, 2, 16)
+
+
+def ticks(tokens, price):
+    timestamp = datetime(2023, 2, 16, 9, 30)
+    return [
+        {
+            "instrument_token": token,
+            "last_price": price,
+            "volume_traded": 25,
+            "change": 0.5,
+            "exchange_timestamp": timestamp,
+        }
+        for token in tokens
+    ]
+
+
+def test_columns_line_up(tmp_path):
+    recorder = TickRecorder(str(tmp_path), session=SESSION)
+    recorder.record(ticks([1, 2], 100.0))
+    recorder.close()
+    reader = TickReader(session_path(str(tmp_path), SESSION))
+    assert len(reader) == 2
+    assert list(reader["token"]) == [1, 2]
+    assert list(reader["last_price"]) == [100.0, 100.0]
+
+
+def test_resume_after_ragged_stop_realigns_columns(tmp_path):
+    recorder = TickRecorder(str(tmp_path), session=SESSION)
+    recorder.record(ticks([1, 2], 100.0))
+    recorder.close()
+    path = session_path(str(tmp_path), SESSION)
+    # Stopped while writing the next batch: one more token and half a price were written
+    with open(os.path.join(path, "token.bin"), "ab") as f:
+        f.write(np.asarray([3], dtype="<u4").tobytes())
+    with open(os.path.join(path, "last_price.bin"), "ab") as f:
+        f.write(bytes(4))
+    recorder = TickRecorder(str(tmp_path), session=SESSION)
+    recorder.record(ticks([4, 5], 200.0))
+    recorder.close()
+    reader = TickReader(path)
+    assert len(reader) == 4
+    assert list(reader["token"]) == [1, 2, 4, 5]
+    assert list(reader["last_price"]) == [100.0, 100.0, 200.0, 200.0]
+    assert all(
+        os.path.getsize(os.path.join(path, column + ".bin")) == 4 * np.dtype(dtype).itemsize
+        for column, dtype in COLUMNS.items()
+    )
@@ -0,0 +1,167 @@
+import time
+from itertools import groupby
+from multiprocessing import Process, Queue
+from queue import Empty
+
+import pytest
+from kiteconnect import KiteConnect
+
+from fake_ticker_server import FakeTickerServer
+from fakes import EXPIRY, SYMBOL, StubKite, make_instruments
+from instrument_file import InstrumentMaster
+from storage import SharedMemoryStore
+from strike_window import MODE_FULL, StrikeWindow
+from ticker_shards import MAX_CONNECTIONS, TickerShards, assign_shards
+from websocket import WebsocketClient
+
+N_STRIKES = 20
+
+
+@pytest.fixture
+def client():
+    backend = SharedMemoryStore()
+    master = InstrumentMaster("test", backend)
+    master.kite = StubKite(N_STRIKES)
+    _, fno_contract = make_instruments(N_STRIKES)
+    token_detail, contract_token = master.build_instrument_records(master.kite.instruments(), fno_contract)
+    master.redis_db.data_dump_batch(list(token_detail.items()) + list(contract_token.items()))
+    yield WebsocketClient(SYMBOL, str(EXPIRY), "test", "test", True, order_updates=Queue(), storage=backend)
+    backend.close(unlink=True)
+
+
+@pytest.fixture
+def server():
+    server = FakeTickerServer(interval=0.1).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def start_shards():
+    workers = []
+
+    def start(shards: TickerShards):
+        for shard in range(len(shards.token_lists)):
+            workers.append(Process(target=shards.run, args=(shard,), daemon=True))
+            workers[-1].start()
+        wait_for(lambda: all(shards.stats.get(shard)["batches"] for shard in range(len(shards.token_lists))))
+
+    yield start
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+
+
+def wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.05)
+
+
+def drain(queue) -> list:
+    items = []
+    while True:
+        try:
+            items.append(queue.get(timeout=0.2))
+        except Empty:
+            return items
+
+
+def chain_groups(client):
+    # The chain split into two halves of strikes, each with the underlying and a window, like two chains
+    details = client.instrumentClass.token_details
+    underlying = [token for token in client.token_list if details[token]["type"] == "EQ"]
+    options = sorted(
+        (token for token in client.token_list if details[token]["type"] != "EQ"), key=lambda t: details[t]["strike"]
+    )
+    halves = (options[: len(options) // 2], options[len(options) // 2 :])
+    return [(underlying + tokens, [StrikeWindow(underlying + tokens, details, 2)]) for tokens in halves]
+
+
+def test_assign_shards_balances_tokens():
+    assert assign_shards([5, 3, 3, 1], 2) == [0, 1, 1, 0]
+    assert assign_shards([1, 1], 3) == [0, 1]
+    assert assign_shards([], 2) == []
+
+
+def test_tokens_split_evenly_without_groups(client):
+    shards = TickerShards(client, "test", "test", 3)
+    assert [token for tokens in shards.token_lists for token in tokens] == client.token_list
+    sizes = [len(tokens) for tokens in shards.token_lists]
+    assert max(sizes) - min(sizes) <= 1
+    assert [shards.stats.get(shard)["tokens"] for shard in range(3)] == sizes
+    with pytest.raises(ValueError):
+        TickerShards(client, "test", "test", MAX_CONNECTIONS + 1)
+
+
+def test_groups_keep_their_chain_on_one_shard(client):
+    groups = chain_groups(client)
+    shards = TickerShards(client, "test", "test", 2, groups=groups)
+    assert [set(tokens) for tokens in shards.token_lists] == [set(tokens) for tokens, _ in groups]
+    assert [manager.windows for manager in shards.managers] == [windows for _, windows in groups]
+
+
+def test_only_first_shard_forwards_order_updates(client, server, start_shards):
+    shards = TickerShards(client, "test", "test", 2, root=server.url)
+    start_shards(shards)
+    order = {"order_id": "1", "status": KiteConnect.STATUS_COMPLETE}
+    server.send_order_update(order)
+    # Both connections receive the update, only the first shard forwards it and its order stream status
+    assert drain(client.order_updates) == [("stream", True), ("order", order)]
+    assert server.connections == 2
+
+
+def test_held_legs_reach_the_shard_of_their_chain(client, server, start_shards):
+    groups = chain_groups(client)
+    shards = TickerShards(client, "test", "test", 2, root=server.url, groups=groups)
+    start_shards(shards)
+    connection_tokens = {}
+    for connection, action, value in server.messages():
+        if action == "subscribe":
+            connection_tokens.setdefault(connection, set()).update(value)
+    details = client.instrumentClass.token_details
+    # Highest call of the second half, outside the window of its shard
+    token = max((token for token in groups[1][0] if details[token]["type"] == "CE"), key=lambda t: details[t]["strike"])
+    assert all(token not in tokens for tokens in connection_tokens.values())
+    second_half = set(groups[1][0]) - set(groups[0][0])
+    (connection,) = [connection for connection, tokens in connection_tokens.items() if tokens & second_half]
+    messages = []
+
+    def sent(action, mode=None):
+        # Connections that sent `action` for the token, in `mode` for mode messages
+        messages.extend(server.messages())
+        return {
+            message_connection
+            for message_connection, message_action, value in messages
+            if message_action == action
+            and token in (value[1] if action == "mode" else value)
+            and (mode is None or value[0] == mode)
+        }
+
+    shards.hold([details[token]["symbol"]])
+    wait_for(lambda: sent("mode", MODE_FULL))
+    assert sent("subscribe") == sent("mode", MODE_FULL) == {connection}
+    shards.release([details[token]["symbol"]])
+    wait_for(lambda: sent("unsubscribe"))
+    assert sent("unsubscribe") == {connection}
+
+
+def test_stats_count_ticks_and_reconnects(client, server, start_shards):
+    shards = TickerShards(client, "test", "test", 1, root=server.url)
+    start_shards(shards)
+    server.drop_connections()
+    wait_for(lambda: shards.stats.get(0)["connects"] == 2)
+    ticks = shards.stats.get(0)["ticks"]
+    wait_for(lambda: shards.stats.get(0)["ticks"] > ticks)
+    stat = shards.stats.get(0)
+    assert stat["connected"]
+    assert stat["reconnects"] == 1
+    assert stat["tokens"] == len(client.token_list)
+    assert stat["batches"] <= stat["ticks"]
+    assert stat["tick_age"] is not None and stat["tick_age"] < 5
+    assert server.connections == 2
+    # A dropped connection reports both an error and a close
+    statuses = [connected for kind, connected in drain(client.order_updates) if kind == "stream"]
+    assert [connected for connected, _ in groupby(statuses)] == [True, False, True]
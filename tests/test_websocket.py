@@ -0,0 +1,24 @@
+import pytest
+
+from websocket import WebsocketClient
+
+
+@pytest.mark.parametrize("publish_on, transport", [("trades", "queue"), ("ticks", "pickle")])
+def test_unknown_modes_fail_before_workers_start(publish_on, transport):
+    client = WebsocketClient.__new__(WebsocketClient)
+    started = []
+    client.start_worker = lambda target, args=(): started.append(target)
+    with pytest.raises(ValueError):
+        client.queue_callBacks(publish_on=publish_on, transport=transport)
+    assert started == []
+
+
+def test_hub_shares_the_feed_setup():
+    from market_data_hub import MarketDataHub
+
+    feed = WebsocketClient.__new__(WebsocketClient)
+    feed.init_feed("test", "token", "memory")
+    hub = MarketDataHub("test", "token", storage="memory", ticker_root="ws://127.0.0.1:1")
+    assert set(vars(feed)) <= set(vars(hub))
+    assert hub.kws.root == "ws://127.0.0.1:1"
+    assert hub.token_list == [] and hub.subscription_manager is None